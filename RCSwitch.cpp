@@ -34,6 +34,7 @@
 
 char RCSwitch::OokReceivedCode[RCSWITCH_MAX_MESS_SIZE];
 bool RCSwitch::OokAvailableCode;
+volatile bool RCSwitch::bReceiving = false;
 
 OregonDecoderV2 orscV2;
 OregonDecoderV3 orscV3;
@@ -47,6 +48,7 @@ RCSwitch::RCSwitch(int rxpin, int txpin) {
 	RCSwitch::OokAvailableCode = false;
 	RCSwitch::OokReceivedCode[0] = '\0';
 	rcswp1.configure(1,this);
+	this->bReceiverRegistered = false;
 
 	if (rxpin != -1 ) {
 		this->enableReceive(rxpin);
@@ -91,18 +93,56 @@ void RCSwitch::enableReceive(int interrupt) {
 }
 
 
+/*
+ * The wiringPi ISR thread cannot be removed once it is registered so it is
+ * only registered once.  After that receiving is turned on and off by 
+ * setting which edges on the pin generate interrupts through sysfs.  Any 
+ * code left over from before receiving was disabled is discarded and the
+ * decoders are reset so that a new capture starts clean.
+ */
 void RCSwitch::enableReceive() {
 	if (this->nReceiverInterrupt != -1) {
-		wiringPiISR(this->nReceiverInterrupt, INT_EDGE_BOTH, &handleInterrupt);
+		RCSwitch::OokAvailableCode = false;
+		orscV2.resetDecoder();
+		orscV3.resetDecoder();
+		rcswp1.resetDecoder();
+		RCSwitch::bReceiving = true;
+		
+		if (this->bReceiverRegistered) {
+			this->setReceiveEdge("both");
+		} else {
+			wiringPiISR(this->nReceiverInterrupt, INT_EDGE_BOTH, &handleInterrupt);
+			this->bReceiverRegistered = true;
+		}
 	}
 }
 
 
 /*
- * Disable receiving data
+ * Disable receiving data - the pin stops generating interrupts and the 
+ * interrupt handler ignores anything that is already in flight
  */
 void RCSwitch::disableReceive() {
-	this->nReceiverInterrupt = -1;
+	RCSwitch::bReceiving = false;
+	if (this->nReceiverInterrupt != -1 && this->bReceiverRegistered) {
+		this->setReceiveEdge("none");
+	}
+}
+
+
+/*
+ * Set which edges on the receiver pin generate interrupts
+ */
+void RCSwitch::setReceiveEdge(const char *edge) {
+	char filename[64];
+	FILE *fh;
+	
+	snprintf(filename, sizeof(filename), "/sys/class/gpio/gpio%d/edge", this->nReceiverInterrupt);
+	fh = fopen(filename, "w");
+	if (fh != NULL) {
+		fprintf(fh, "%s\n", edge);
+		fclose(fh);
+	}
 }
 
 
@@ -157,6 +197,11 @@ void RCSwitch::handleInterrupt() {
 	word p = (unsigned short int) duration;
 
 	
+	// Ignore anything that arrives while receiving is disabled
+	if ( !RCSwitch::bReceiving ) {
+		return;
+	}
+	
 	// Avoid re-entry
 	if ( !OokAvailableCode ) {		// avoid reentrance -- wait until data is read
 		if (orscV2.nextPulse(p)) {
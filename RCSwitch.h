@@ -80,7 +80,10 @@ class RCSwitch {
   private:
 
     static void handleInterrupt();
+    void setReceiveEdge(const char *edge);
     int nReceiverInterrupt;
+    bool bReceiverRegistered;
+    static volatile bool bReceiving;
     int nTransmitterPin;
 
     static char OokReceivedCode[RCSWITCH_MAX_MESS_SIZE];
@@ -0,0 +1,653 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module for computing rolling statistics from the sensor packets.
+"""
+
+import math
+import time
+import logging
+from collections import deque
+
+from parser import parsePacketv21
+from utils import computeSeaLevelPressure
+
+__version__ = "0.2"
+__all__ = ["WIND_FIELDS", "RAIN_FIELDS", "PRESSURE_FIELDS", "WindAggregator", 
+		   "RainAggregator", "PressureTendency", "ArchiveAccumulator", "__version__", "__all__"]
+
+
+# Logger instance
+aggrLogger = logging.getLogger('__main__')
+
+
+# Fields provided by WindAggregator.getData()
+WIND_FIELDS = ('rollingGust', 'rollingGustDirection', 'rollingAverage', 'rollingDirection')
+
+# Fields provided by RainAggregator.getData()
+RAIN_FIELDS = ('rainfall15min', 'rainfallHour', 'rainfall24hr', 'rainfallDay', 'rainrateInstant')
+
+# Fields provided by PressureTendency.getData()
+PRESSURE_FIELDS = ('pressureTendency1hr', 'pressureTendency3hr', 'pressureTrend')
+
+
+class WindAggregator(object):
+	"""
+	Class for computing rolling wind statistics from timestamped WGR968
+	packets:
+	  * rollingGust - highest gust in the last gustWindow seconds, in m/s
+	  * rollingGustDirection - direction of that gust in degrees
+	  * rollingAverage - mean of the average wind speed over the last
+	    averageWindow seconds, in m/s
+	  * rollingDirection - vector-averaged wind direction over the last
+	    averageWindow seconds in degrees, weighted by the wind speed
+	The highest gust is kept in a monotonic deque and the averages use
+	running sums so each packet is O(1) and the memory is bounded by the
+	window lengths.
+	"""
+	
+	def __init__(self, gustWindow=600.0, averageWindow=120.0, maxSamples=1024):
+		self.gustWindow = float(gustWindow)
+		self.averageWindow = float(averageWindow)
+		self.maxSamples = int(maxSamples)
+		
+		## Gusts as (time, speed, direction) in decreasing order of speed
+		self._gusts = deque()
+		
+		## Averages as (time, speed, speed*sin, speed*cos, sin, cos) along
+		## with the running sums of everything but the time
+		self._samples = deque()
+		self._sums = [0.0, 0.0, 0.0, 0.0, 0.0]
+		
+		self._tLast = None
+		
+	def add(self, timestamp, average, gust, direction):
+		"""
+		Add a wind observation.  Observations need to be added in time
+		order.
+		"""
+		
+		if self._tLast is not None and timestamp <= self._tLast:
+			return
+		self._tLast = timestamp
+		
+		## Gust
+		while len(self._gusts) > 0 and self._gusts[-1][1] <= gust:
+			self._gusts.pop()
+		self._gusts.append( (timestamp, gust, direction) )
+		
+		## Averages
+		theta = math.radians(direction)
+		sample = (timestamp, average, average*math.sin(theta), average*math.cos(theta),
+				  math.sin(theta), math.cos(theta))
+		self._samples.append( sample )
+		for i in xrange(5):
+			self._sums[i] += sample[i+1]
+			
+		while len(self._samples) > self.maxSamples:
+			self._dropSample()
+		self._expire(timestamp)
+		
+	def observe(self, packets):
+		"""
+		Add the wind observations from a list of type, payload, timestamp
+		packets from read433.
+		"""
+		
+		for packet in packets:
+			if len(packet) < 3 or packet[0] != 'OSV2':
+				continue
+			try:
+				valid, sensorName, channel, sensorData = parsePacketv21(packet[1])
+			except (IndexError, ValueError):
+				continue
+			if valid and sensorName == 'WGR968':
+				self.add(packet[2], sensorData['average'], sensorData['gust'], sensorData['direction'])
+				
+	def _dropSample(self):
+		"""
+		Remove the oldest sample from the running sums.
+		"""
+		
+		sample = self._samples.popleft()
+		if len(self._samples) == 0:
+			## Start over to keep any round-off from building up
+			self._sums = [0.0, 0.0, 0.0, 0.0, 0.0]
+		else:
+			for i in xrange(5):
+				self._sums[i] -= sample[i+1]
+				
+	def _expire(self, tNow):
+		"""
+		Remove the observations that are outside of the windows.
+		"""
+		
+		while len(self._gusts) > 0 and self._gusts[0][0] <= tNow - self.gustWindow:
+			self._gusts.popleft()
+		while len(self._samples) > 0 and self._samples[0][0] <= tNow - self.averageWindow:
+			self._dropSample()
+			
+	def getData(self, tNow=None):
+		"""
+		Return a dictionary of the rolling wind statistics, which is empty if
+		there are no observations in the windows.
+		"""
+		
+		if tNow is not None:
+			self._expire(tNow)
+			
+		output = {}
+		if len(self._gusts) > 0:
+			output['rollingGust'] = self._gusts[0][1]
+			output['rollingGustDirection'] = self._gusts[0][2]
+			
+		n = len(self._samples)
+		if n > 0:
+			speed, x, y, ux, uy = self._sums
+			output['rollingAverage'] = max([0.0, speed / n])
+			
+			### Fall back on the unweighted directions if it is calm
+			if abs(x) < 1e-6 and abs(y) < 1e-6:
+				x, y = ux, uy
+			output['rollingDirection'] = int(round(math.degrees(math.atan2(x, y)))) % 360
+			
+		return output
+
+
+class RainAggregator(object):
+	"""
+	Class for computing rainfall totals and the rain rate from the running 
+	rainfall counter reported by the RGR968, in mm:
+	  * rainfall15min - rainfall in the last 15 minutes
+	  * rainfallHour - rainfall in the last hour
+	  * rainfall24hr - rainfall in the last 24 hours
+	  * rainfallDay - rainfall since local midnight
+	  * rainrateInstant - rain rate, in mm/hr, from the time between the 
+	    last two increases of the counter
+	The increases are accumulated in a ring of one minute buckets that 
+	covers 24 hours, with running sums for each of the windows, so each 
+	reading is O(1) and the memory use is fixed.
+	
+	The counter rolls over at 'modulus' mm.  Any other decrease, or an 
+	increase of more than 'maxStep' mm, is treated as the sensor being 
+	reset and is not counted.
+	"""
+	
+	_windows = (15, 60, 1440)
+	
+	def __init__(self, modulus=10000.0, maxStep=100.0, rateWindow=900.0):
+		self.modulus = float(modulus)
+		self.maxStep = float(maxStep)
+		self.rateWindow = float(rateWindow)
+		
+		self._ring = [0.0 for i in xrange(self._windows[-1])]
+		self._sums = [0.0 for w in self._windows]
+		self._minute = None
+		
+		self._day = None
+		self._dayTotal = 0.0
+		
+		self._tLast = None
+		self._counter = None
+		self._tLastTip = None
+		self._lastTip = 0.0
+		self._rate = 0.0
+		
+		self._stats = {'readings': 0, 'wraps': 0, 'resets': 0}
+		
+	def getStats(self):
+		"""
+		Return a dictionary of counter statistics.
+		"""
+		
+		return self._stats.copy()
+		
+	def _advance(self, minute):
+		"""
+		Move the ring forward to the specified minute, dropping the buckets
+		that fall out of each window.
+		"""
+		
+		if self._minute is None or minute - self._minute >= len(self._ring):
+			self._ring = [0.0 for i in xrange(len(self._ring))]
+			self._sums = [0.0 for w in self._windows]
+			self._minute = minute
+			return
+			
+		while self._minute < minute:
+			self._minute += 1
+			for i,w in enumerate(self._windows):
+				self._sums[i] -= self._ring[(self._minute - w) % len(self._ring)]
+			self._ring[self._minute % len(self._ring)] = 0.0
+			
+			## Start over once a day to keep any round-off from building up
+			if self._minute % len(self._ring) == 0:
+				for i,w in enumerate(self._windows):
+					self._sums[i] = sum([self._ring[(self._minute - j) % len(self._ring)] for j in xrange(w)])
+					
+	def add(self, timestamp, rainfall):
+		"""
+		Add a reading of the rainfall counter.  Readings need to be added in
+		time order.
+		"""
+		
+		if rainfall is None or rainfall < 0:
+			return
+		if self._tLast is not None and timestamp <= self._tLast:
+			return
+		self._tLast = timestamp
+		self._stats['readings'] += 1
+		
+		self._advance( int(timestamp // 60) )
+		day = time.localtime(timestamp)[:3]
+		if day != self._day:
+			self._day = day
+			self._dayTotal = 0.0
+			
+		## Work out how much the counter has gone up
+		if self._counter is None:
+			delta = 0.0
+		else:
+			delta = rainfall - self._counter
+			if delta < 0 and -delta > self.modulus / 2:
+				delta += self.modulus
+				self._stats['wraps'] += 1
+			if delta < 0 or delta > self.maxStep:
+				aggrLogger.warning('Rainfall counter went from %.1f to %.1f mm, treating it as a reset', self._counter, rainfall)
+				delta = 0.0
+				self._stats['resets'] += 1
+		self._counter = rainfall
+		
+		if delta <= 0:
+			return
+			
+		## Accumulate
+		self._ring[self._minute % len(self._ring)] += delta
+		for i in xrange(len(self._windows)):
+			self._sums[i] += delta
+		self._dayTotal += delta
+		
+		## Rate
+		if self._tLastTip is None:
+			dt = self.rateWindow
+		else:
+			dt = min([timestamp - self._tLastTip, self.rateWindow])
+		self._rate = delta / max([dt, 1.0]) * 3600
+		self._tLastTip = timestamp
+		self._lastTip = delta
+		
+	def observe(self, packets):
+		"""
+		Add the rainfall counter readings from a list of type, payload, 
+		timestamp packets from read433.
+		"""
+		
+		for packet in packets:
+			if len(packet) < 3 or packet[0] != 'OSV2':
+				continue
+			try:
+				valid, sensorName, channel, sensorData = parsePacketv21(packet[1])
+			except (IndexError, ValueError):
+				continue
+			if valid and sensorName == 'RGR968':
+				self.add(packet[2], sensorData['rainfall'])
+				
+	def getData(self, tNow=None):
+		"""
+		Return a dictionary of the rainfall totals and rate, which is empty if
+		the counter has not been read yet.
+		"""
+		
+		if self._counter is None:
+			return {}
+			
+		if tNow is None:
+			tNow = time.time()
+		self._advance( max([self._minute, int(tNow // 60)]) )
+		if time.localtime(tNow)[:3] != self._day:
+			self._day = time.localtime(tNow)[:3]
+			self._dayTotal = 0.0
+			
+		output = {}
+		for name,total in zip(('rainfall15min', 'rainfallHour', 'rainfall24hr'), self._sums):
+			output[name] = round(max([0.0, total]), 2)
+		output['rainfallDay'] = round(self._dayTotal, 2)
+		
+		## The rate decays if there hasn't been an increase in a while
+		rate = 0.0
+		if self._tLastTip is not None:
+			since = tNow - self._tLastTip
+			if since <= self.rateWindow:
+				rate = self._rate
+				if since > 0:
+					rate = min([rate, self._lastTip / since * 3600])
+		output['rainrateInstant'] = round(rate, 2)
+		
+		return output
+
+
+class PressureTendency(object):
+	"""
+	Class for computing the barometric pressure tendency from the pressure
+	readings over the last hour and the last three hours:
+	  * pressureTendency1hr - change over the last hour, in hPa
+	  * pressureTendency3hr - change over the last three hours, in hPa
+	  * pressureTrend - 'rising', 'falling', or 'steady' based on the three
+	    hour change
+	The changes come from a least-squares fit to the readings in each 
+	window.  The readings are kept in a fixed-size ring buffer and each 
+	window keeps running sums for the fit, so each reading is O(1).  A 
+	tendency is only reported once the readings span at least half of its
+	window.
+	"""
+	
+	_windows = (3600.0, 10800.0)
+	
+	def __init__(self, capacity=1024, steady=0.5):
+		self.capacity = int(capacity)
+		self.steady = float(steady)
+		
+		self._times = [0.0 for i in xrange(self.capacity)]
+		self._values = [0.0 for i in xrange(self.capacity)]
+		self._next = 0
+		
+		## Times are relative to a reference time to keep the sums well 
+		## conditioned
+		self._tRef = None
+		
+		## Per-window index of the oldest reading and the sums of 1, t, p, 
+		## t*t, and t*p
+		self._starts = [0 for w in self._windows]
+		self._sums = [[0.0, 0.0, 0.0, 0.0, 0.0] for w in self._windows]
+		
+	def _accumulate(self, i, index, sign):
+		"""
+		Add (sign=1) or remove (sign=-1) a reading from the sums for a 
+		window.
+		"""
+		
+		t = self._times[index % self.capacity] - self._tRef
+		p = self._values[index % self.capacity]
+		sums = self._sums[i]
+		sums[0] += sign
+		sums[1] += sign*t
+		sums[2] += sign*p
+		sums[3] += sign*t*t
+		sums[4] += sign*t*p
+		
+	def _rebuild(self, tRef):
+		"""
+		Move the reference time and recompute all of the sums.
+		"""
+		
+		self._tRef = tRef
+		for i in xrange(len(self._windows)):
+			self._sums[i] = [0.0, 0.0, 0.0, 0.0, 0.0]
+			for index in xrange(self._starts[i], self._next):
+				self._accumulate(i, index, 1)
+				
+	def _expire(self, tNow):
+		"""
+		Remove the readings that are outside of each window.
+		"""
+		
+		for i,w in enumerate(self._windows):
+			while self._starts[i] < self._next \
+			      and (self._times[self._starts[i] % self.capacity] <= tNow - w \
+			           or self._next - self._starts[i] > self.capacity):
+				self._accumulate(i, self._starts[i], -1)
+				self._starts[i] += 1
+				
+	def add(self, timestamp, pressure):
+		"""
+		Add a pressure reading in hPa.  Readings need to be added in time 
+		order.
+		"""
+		
+		if pressure is None or pressure <= 0:
+			return
+		if self._next > 0 and timestamp <= self._times[(self._next - 1) % self.capacity]:
+			return
+			
+		## Make room in the ring buffer
+		self._expire(timestamp)
+		for i in xrange(len(self._windows)):
+			if self._next - self._starts[i] >= self.capacity:
+				self._accumulate(i, self._starts[i], -1)
+				self._starts[i] += 1
+				
+		self._times[self._next % self.capacity] = timestamp
+		self._values[self._next % self.capacity] = pressure
+		if self._tRef is None:
+			self._tRef = timestamp
+		for i in xrange(len(self._windows)):
+			self._accumulate(i, self._next, 1)
+		self._next += 1
+		
+		## Keep the reference time close to the data
+		if timestamp - self._tRef > 86400:
+			self._rebuild(timestamp)
+			
+	def observe(self, packets, elevation=0.0):
+		"""
+		Add the pressure readings from a list of type, payload, timestamp 
+		packets from read433, correcting them to sea level if an elevation is
+		provided.
+		"""
+		
+		for packet in packets:
+			if len(packet) < 3 or packet[0] != 'OSV2':
+				continue
+			try:
+				valid, sensorName, channel, sensorData = parsePacketv21(packet[1])
+			except (IndexError, ValueError):
+				continue
+			if valid and sensorName == 'BHTR968':
+				pressure = sensorData['pressure']
+				if elevation != 0.0:
+					pressure = computeSeaLevelPressure(pressure, elevation)
+				self.add(packet[2], pressure)
+				
+	def getData(self, tNow=None):
+		"""
+		Return a dictionary of the pressure tendencies, which is empty if 
+		there are not enough readings yet.
+		"""
+		
+		if tNow is not None:
+			self._expire(tNow)
+			
+		output = {}
+		for i,w in enumerate(self._windows):
+			n, st, sp, stt, stp = self._sums[i]
+			if n < 2:
+				continue
+			tFirst = self._times[self._starts[i] % self.capacity]
+			tLast = self._times[(self._next - 1) % self.capacity]
+			if tLast - tFirst < w / 2:
+				continue
+				
+			denom = n*stt - st*st
+			if denom <= 0:
+				continue
+			slope = (n*stp - st*sp) / denom
+			output['pressureTendency%ihr' % int(w / 3600)] = round(slope*w, 2)
+			
+		try:
+			change = output['pressureTendency3hr']
+			if change >= self.steady:
+				output['pressureTrend'] = 'rising'
+			elif change <= -self.steady:
+				output['pressureTrend'] = 'falling'
+			else:
+				output['pressureTrend'] = 'steady'
+		except KeyError:
+			pass
+			
+		return output
+
+
+class ArchiveAccumulator(object):
+	"""
+	Class for combining the current conditions from several capture cycles
+	into a single archive entry for each interval seconds, aligned to the
+	wall clock.  Within each interval:
+	  * wind directions are vector-averaged, weighted by the wind speed,
+	  * gusts and rain rates are the peak values, with the direction of 
+	    the peak gust,
+	  * the rainfall counter, rainfall totals, and pressure tendencies are
+	    the latest values,
+	  * anything that is not a number is the latest value, and
+	  * everything else is the mean, with the minimum and maximum saved in
+	    the 'lows' and 'highs' entries of the record.
+	"""
+	
+	## Direction fields and the speed used to weight them
+	_directionFields = {'direction': 'average', 'rollingDirection': 'rollingAverage'}
+	
+	## Peak fields and the direction that goes with them
+	_peakFields = {'gust': 'gustDirection', 'rollingGust': 'rollingGustDirection', 
+				   'rainrate': None, 'rainrateInstant': None}
+	
+	## Fields where the latest value is used
+	_latestFields = RAIN_FIELDS + PRESSURE_FIELDS + ('rainfall',)
+	
+	def __init__(self, interval=300.0):
+		self.interval = float(interval)
+		
+		self._tEnd = None
+		self._reset()
+		
+	def _reset(self):
+		self._cycles = 0
+		self._sums = {}
+		self._lows = {}
+		self._highs = {}
+		self._vectors = {}
+		self._peaks = {}
+		self._last = {}
+		self._lengths = {}
+		
+	def getBoundary(self, t):
+		"""
+		Return the end of the interval that contains the specified time.
+		"""
+		
+		if self.interval <= 0:
+			return t
+		return math.ceil(t / self.interval) * self.interval
+		
+	def _accumulate(self, key, value, data):
+		"""
+		Add a single value to the interval.
+		"""
+		
+		if key in self._directionFields:
+			theta = math.radians(value)
+			speed = data.get(self._directionFields[key], 0.0) or 0.0
+			vector = self._vectors.get(key, [0.0, 0.0, 0.0, 0.0])
+			vector[0] += speed*math.sin(theta)
+			vector[1] += speed*math.cos(theta)
+			vector[2] += math.sin(theta)
+			vector[3] += math.cos(theta)
+			self._vectors[key] = vector
+			
+		elif key in self._peakFields:
+			if key not in self._peaks or value > self._peaks[key][0]:
+				self._peaks[key] = (value, data.get(self._peakFields[key], None))
+				
+		elif key in self._latestFields:
+			self._last[key] = value
+			
+		else:
+			try:
+				self._sums[key][0] += 1
+				self._sums[key][1] += value
+				self._lows[key] = min([self._lows[key], value])
+				self._highs[key] = max([self._highs[key], value])
+			except KeyError:
+				self._sums[key] = [1, value]
+				self._lows[key] = value
+				self._highs[key] = value
+				
+	def add(self, timestamp, data):
+		"""
+		Add the current conditions from a capture cycle that ended at the 
+		specified time.  Returns a list of the timestamp, record pairs that 
+		are ready to be archived.
+		"""
+		
+		output = []
+		
+		## Is this the start of a new interval?
+		tEnd = self.getBoundary(timestamp)
+		if self._tEnd is not None and tEnd != self._tEnd:
+			output.append( self.flush() )
+		self._tEnd = tEnd
+		
+		## Accumulate
+		self._cycles += 1
+		skip = [direction for direction in self._peakFields.itervalues() if direction is not None]
+		for key,value in data.iteritems():
+			if value is None or key in skip:
+				continue
+				
+			if isinstance(value, list):
+				self._lengths[key] = max([self._lengths.get(key, 0), len(value)])
+				for i,v in enumerate(value):
+					if v is not None:
+						self._accumulate((key, i), v, data)
+			elif isinstance(value, (int, long, float)) and not isinstance(value, bool):
+				self._accumulate(key, value, data)
+			else:
+				self._last[key] = value
+				
+		## Is this the end of the interval?
+		if timestamp >= tEnd:
+			output.append( self.flush() )
+			
+		return [entry for entry in output if entry is not None]
+		
+	def flush(self):
+		"""
+		Return the timestamp and record for the current interval and start a 
+		new one.  Returns None if there is nothing to archive.
+		"""
+		
+		if self._cycles == 0:
+			return None
+			
+		record = {}
+		lows = {}
+		highs = {}
+		
+		def store(output, key, value):
+			if isinstance(key, tuple):
+				key, i = key
+				if key not in output:
+					output[key] = [None for j in xrange(self._lengths[key])]
+				output[key][i] = value
+			else:
+				output[key] = value
+				
+		for key,(n,total) in self._sums.iteritems():
+			store(record, key, total if n == 1 else float(total) / n)
+			store(lows, key, self._lows[key])
+			store(highs, key, self._highs[key])
+		for key,(x,y,ux,uy) in self._vectors.iteritems():
+			if abs(x) < 1e-6 and abs(y) < 1e-6:
+				x, y = ux, uy
+			store(record, key, int(round(math.degrees(math.atan2(x, y)))) % 360)
+		for key,(value,direction) in self._peaks.iteritems():
+			store(record, key, value)
+			if self._peakFields[key] is not None and direction is not None:
+				store(record, self._peakFields[key], direction)
+		for key,value in self._last.iteritems():
+			store(record, key, value)
+		record['lows'] = lows
+		record['highs'] = highs
+		
+		tEnd = self._tEnd
+		self._reset()
+		
+		return tEnd, record
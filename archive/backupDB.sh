@@ -2,3 +2,8 @@
 
 tag=`date +"%Y%m%d-%H%M%S"`
 sqlite3 wx-data.db ".backup 'wx-${tag}.db.bak'"
+
+# The monthly partitions never change once written so only new ones need
+# to be copied
+mkdir -p partitions.bak
+cp -n partitions/*.part partitions.bak/ 2>/dev/null
@@ -28,4 +28,43 @@ CREATE TABLE wx (
 	outDewpoint4 REAL DEFAULT -99.0,
 	windchill REAL DEFAULT -99.0,
 	uv INTEGER DEFAULT -99);
+CREATE TABLE wxdelta (
+	dateTime INTEGER NOT NULL UNIQUE PRIMARY KEY,
+	keyframe INTEGER NOT NULL,
+	usUnits INTEGER,
+	barometer REAL,
+	inTemp REAL,
+	outTemp REAL,
+	outTemp1 REAL,
+	outTemp2 REAL,
+	outTemp3 REAL,
+	outTemp4 REAL,
+	inHumidity REAL,
+	outHumidity REAL,
+	outHumidity1 REAL,
+	outHumidity2 REAL,
+	outHumidity3 REAL,
+	outHumidity4 REAL,
+	windSpeed REAL,
+	windDir REAL,
+	windGust REAL,
+	rainRate REAL,
+	rain REAL,
+	inDewpoint REAL,
+	outDewpoint REAL,
+	outDewpoint1 REAL,
+	outDewpoint2 REAL,
+	outDewpoint3 REAL,
+	outDewpoint4 REAL,
+	windchill REAL,
+	uv INTEGER);
+CREATE TABLE records (
+	field TEXT NOT NULL,
+	period TEXT NOT NULL,
+	periodStart INTEGER NOT NULL,
+	minValue REAL,
+	minTime INTEGER,
+	maxValue REAL,
+	maxTime INTEGER,
+	PRIMARY KEY (field, period));
 COMMIT;
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module for backing up and compacting the archive in the background.
+"""
+
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+
+__version__ = "0.2"
+__all__ = ["BACKUP_FILE", "BackupProcessor", "CompactionProcessor", "__version__", "__all__"]
+
+
+# Logger instance
+backupLogger = logging.getLogger('__main__')
+
+
+# Files
+## Backup copy of the archive
+BACKUP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive', 'wx-data.db.bak')
+
+
+class BackupProcessor(threading.Thread):
+	"""
+	Class responsible for periodically making an online, incremental backup 
+	of the archive, and its monthly partitions, without holding off the 
+	polling thread.
+	"""
+	
+	def __init__(self, config, db, filename=BACKUP_FILE):
+		threading.Thread.__init__(self)
+		self.config = config
+		self.db = db
+		self.filename = filename
+		
+		self.progress = {'table': None, 'copied': 0, 'total': 0, 
+						 'lastStart': None, 'lastStop': None}
+						
+		self.thread = None
+		self.alive = threading.Event()
+		
+	def start(self):
+		if self.thread is not None:
+			self.cancel()
+			
+		self.thread = threading.Thread(target=self.run, name='backup')
+		self.thread.setDaemon(1)
+		self.alive.set()
+		self.thread.start()
+		
+		backupLogger.info('Started the BackupProcessor background thread')
+		
+	def cancel(self):
+		if self.thread is not None:
+			self.alive.clear()          # clear alive event for thread
+			self.thread.join()
+			
+		backupLogger.info('Stopped the BackupProcessor background thread')
+		
+	def backup(self):
+		"""
+		Run a single backup of the archive, pausing between steps.  Returns 
+		True if the backup completed, False if it was interrupted.
+		"""
+		
+		stepSize = self.config.getint('Archive', 'backupstep')
+		stepPause = self.config.getfloat('Archive', 'backuppause')
+		
+		self.progress['lastStart'] = time.time()
+		backupLogger.info('Starting backup of the archive to \'%s\'', os.path.basename(self.filename))
+		
+		steps = self.db.backup(self.filename, stepSize=stepSize)
+		try:
+			for table,nCopied,nTotal in steps:
+				self.progress['table'] = table
+				self.progress['copied'] = nCopied
+				self.progress['total'] = nTotal
+				backupLogger.debug('Backup of table \'%s\' at %i of %i rows', table, nCopied, nTotal)
+				
+				if not self.alive.isSet():
+					backupLogger.warning('Backup of the archive interrupted')
+					return False
+				time.sleep(stepPause)
+		finally:
+			steps.close()
+			
+		self.progress['lastStop'] = time.time()
+		backupLogger.info('Finished backup of the archive in %.1f s', self.progress['lastStop']-self.progress['lastStart'])
+		
+		return True
+		
+	def run(self):
+		# Pick up where we left off
+		try:
+			tLastBackup = os.path.getmtime(self.filename)
+		except OSError:
+			tLastBackup = 0.0
+			
+		while self.alive.isSet():
+			interval = self.config.getfloat('Archive', 'backupinterval')*3600
+			if interval > 0 and time.time() - tLastBackup >= interval:
+				try:
+					self.backup()
+				except Exception, e:
+					backupLogger.error('Backup of the archive failed: %s', str(e))
+				tLastBackup = time.time()
+				
+			## Sleep
+			time.sleep(5)
+
+
+class CompactionProcessor(threading.Thread):
+	"""
+	Class responsible for moving old data out of the archive and into the
+	monthly partitions once a month, and at startup, without holding off 
+	the polling thread.  This only runs if Archive/keepmonths is greater
+	than zero.
+	"""
+	
+	def __init__(self, config, db):
+		threading.Thread.__init__(self)
+		self.config = config
+		self.db = db
+		
+		self.progress = {'lastStart': None, 'lastStop': None, 'moved': 0}
+		
+		self.thread = None
+		self.alive = threading.Event()
+		
+	def start(self):
+		if self.thread is not None:
+			self.cancel()
+			
+		self.thread = threading.Thread(target=self.run, name='compaction')
+		self.thread.setDaemon(1)
+		self.alive.set()
+		self.thread.start()
+		
+		backupLogger.info('Started the CompactionProcessor background thread')
+		
+	def cancel(self):
+		if self.thread is not None:
+			self.alive.clear()          # clear alive event for thread
+			self.thread.join()
+			
+		backupLogger.info('Stopped the CompactionProcessor background thread')
+		
+	def run(self):
+		tLastCompact = None
+		
+		while self.alive.isSet():
+			keepMonths = self.config.getint('Archive', 'keepmonths')
+			tMonth = datetime.now().strftime("%Y-%m")
+			if keepMonths > 0 and tMonth != tLastCompact:
+				self.progress['lastStart'] = time.time()
+				try:
+					self.progress['moved'] = self.db.compactArchive(keepMonths=keepMonths)
+				except Exception, e:
+					backupLogger.error('Compaction of the archive failed: %s', str(e))
+				self.progress['lastStop'] = time.time()
+				tLastCompact = tMonth
+				
+			## Sleep
+			time.sleep(5)
@@ -148,18 +148,171 @@ def loadConfig(filename):
 	config.set('Account', 'id', 'Your_Id_Here')
 	config.set('Account', 'password', 'Your_Password_Here')
 	
+	## Dummy upload information
+	##  1) baseURL - WUnderground PWS upload URL
+	##  2) timeout - Timeout, in seconds, for each upload
+	##  3) backlogSize - Maximum number of observations to keep on disk
+	##     while WUnderground is unreachable
+	##  4) retryInterval - Seconds to wait before retrying a failed upload,
+	##     doubled after each failure
+	##  5) interval - Minimum number of seconds between WUnderground uploads
+	##  6) realtime - Whether or not to also send changes to the 
+	##     WUnderground RapidFire service as packets arrive
+	##  7) rtFreq - Minimum number of seconds between RapidFire uploads
+	##  8) rtWindow - Maximum number of RapidFire uploads in flight
+	config.add_section('Upload')
+	config.set('Upload', 'baseurl', 'http://weatherstation.wunderground.com/weatherstation/updateweatherstation.php')
+	config.set('Upload', 'timeout', '10.0')
+	config.set('Upload', 'backlogsize', '1440')
+	config.set('Upload', 'retryinterval', '30.0')
+	config.set('Upload', 'interval', '0.0')
+	config.set('Upload', 'realtime', 'False')
+	config.set('Upload', 'rtfreq', '5.0')
+	config.set('Upload', 'rtwindow', '2')
+	
+	## Dummy PWSWeather information
+	##  1) enabled - Whether or not to upload to PWSWeather
+	##  2) ID - PWSWeather station ID
+	##  3) Password - PWSWeather password
+	##  4) interval - Minimum number of seconds between uploads
+	config.add_section('PWSWeather')
+	config.set('PWSWeather', 'enabled', 'False')
+	config.set('PWSWeather', 'id', 'Your_Id_Here')
+	config.set('PWSWeather', 'password', 'Your_Password_Here')
+	config.set('PWSWeather', 'interval', '0.0')
+	
+	## Dummy CWOP information
+	##  1) enabled - Whether or not to upload to CWOP via APRS-IS
+	##  2) callsign - Amateur radio callsign or CWOP ID
+	##  3) passcode - APRS-IS passcode (-1 for CWOP IDs)
+	##  4) latitude - Station latitude in degrees
+	##  5) longitude - Station longitude in degrees
+	##  6) server - APRS-IS server as host:port
+	##  7) interval - Minimum number of seconds between uploads
+	config.add_section('CWOP')
+	config.set('CWOP', 'enabled', 'False')
+	config.set('CWOP', 'callsign', 'Your_Callsign_Here')
+	config.set('CWOP', 'passcode', '-1')
+	config.set('CWOP', 'latitude', '0.0')
+	config.set('CWOP', 'longitude', '0.0')
+	config.set('CWOP', 'server', 'cwop.aprs.net:14580')
+	config.set('CWOP', 'interval', '300.0')
+	
+	## Dummy webhook information
+	##  1) enabled - Whether or not to POST the data to a webhook
+	##  2) url - URL to POST the data to as JSON
+	##  3) fields - Comma-separated list of name=field pairs to send (empty 
+	##     for all fields)
+	##  4) interval - Minimum number of seconds between uploads
+	config.add_section('Webhook')
+	config.set('Webhook', 'enabled', 'False')
+	config.set('Webhook', 'url', 'http://localhost/wx')
+	config.set('Webhook', 'fields', '')
+	config.set('Webhook', 'interval', '0.0')
+	
+	## Dummy local file sink information
+	##  1) enabled - Whether or not to append the data to a local file
+	##  2) filename - File to append the data to as JSON
+	##  3) fields - Comma-separated list of name=field pairs to save (empty 
+	##     for all fields)
+	##  4) interval - Minimum number of seconds between entries
+	config.add_section('FileSink')
+	config.set('FileSink', 'enabled', 'False')
+	config.set('FileSink', 'filename', '/tmp/wxPi.json')
+	config.set('FileSink', 'fields', '')
+	config.set('FileSink', 'interval', '0.0')
+	
 	## Dummy station information
 	##  1) elevation - Station elevation in meters
 	##  2) duration - Duration, in seconds, to record data for
 	##  3) radioPin - GPIO pin that the radio is connected to
 	##  4) enableBMP085 - enable reading a BMP085/BMP180 sensor over I2C
 	##  5) includeIndoor - Whether or not to include indoor data
+	##  6) sampleInterval - Seconds between BMP085/BMP180 samples, which are 
+	##     averaged over each capture window
+	##  7) samplerThreads - Number of threads to use for reading sensors
+	##  8) adaptiveCapture - Whether or not to only listen to the radio 
+	##     around the times the sensors are expected to transmit
+	##  9) captureMargin - Seconds to listen on either side of an expected
+	##     transmission
+	## 10) fullScanEvery - Number of cycles between full scans to look for
+	##     new sensors when adaptiveCapture is enabled
+	## 11) stateTTL - Maximum age, in seconds, of the last sensor values 
+	##     saved to archive/wx-state.json that can be used on startup
+	## 12) gustWindow - Seconds over which to report the highest wind gust
+	##     along with the per-cycle gust
+	## 13) windWindow - Seconds over which to average the wind speed and
+	##     direction along with the per-cycle values
+	## 14) stateInterval - Minimum number of seconds between writes of
+	##     archive/wx-state.json
+	##
+	## Other sensors from sensors/ can be added with sections named 
+	## 'Sensor <name>', i.e.,
+	##   [Sensor atticTemperature]
+	##   plugin = DHT22
+	##   measurement = temperature
+	##   pinnumber = 22
+	##   interval = 30
+	##   timeout = 5
 	config.add_section('Station')
 	config.set('Station', 'elevation', '0.0')
 	config.set('Station', 'duration', '60.0')
 	config.set('Station', 'radiopin', '18')
 	config.set('Station', 'enablebmp085', 'True')
 	config.set('Station', 'includeindoor', 'False')
+	config.set('Station', 'sampleinterval', '5.0')
+	config.set('Station', 'samplerthreads', '2')
+	config.set('Station', 'adaptivecapture', 'False')
+	config.set('Station', 'capturemargin', '2.0')
+	config.set('Station', 'fullscanevery', '60')
+	config.set('Station', 'statettl', '300.0')
+	config.set('Station', 'gustwindow', '600.0')
+	config.set('Station', 'windwindow', '120.0')
+	config.set('Station', 'stateinterval', '180.0')
+	
+	## Dummy freshness information - how long, in seconds, the values from a
+	## sensor are used after it was last heard from
+	##  1) default - Sensors not listed below
+	##  2) THGR968 - Outdoor temperature/humidity sensor
+	##  3) THGR268 - Additional temperature/humidity sensors
+	##  4) WGR968 - Anemometer
+	##  5) RGR968 - Rain gauge
+	##  6) BHTR968 - Indoor temperature/humidity/pressure sensor
+	##  7) BMP085 - BMP085/BMP180 over I2C
+	##
+	## Sensors from sensors/ can also be listed by name, i.e., 
+	##   atticTemperature = 900
+	config.add_section('Freshness')
+	config.set('Freshness', 'default', '300.0')
+	config.set('Freshness', 'thgr968', '300.0')
+	config.set('Freshness', 'thgr268', '300.0')
+	config.set('Freshness', 'wgr968', '120.0')
+	config.set('Freshness', 'rgr968', '600.0')
+	config.set('Freshness', 'bhtr968', '600.0')
+	config.set('Freshness', 'bmp085', '300.0')
+	
+	## Dummy archive information
+	##  1) keepMonths - Number of months to keep in the database before 
+	##     moving the data into the monthly partitions in the background
+	##     (0 = never)
+	##  2) backupInterval - Hours between online backups of the database
+	##     (0 = never)
+	##  3) backupStep - Number of rows to check per backup step
+	##  4) backupPause - Seconds to pause between backup steps
+	##  5) storage - How to store entries in the database, either 'wide' 
+	##     for every column or 'delta' for only the columns that changed
+	##  6) keyframeInterval - Number of entries between full entries for 
+	##     the 'delta' storage mode
+	##  7) interval - Seconds between archive entries, with the polling 
+	##     cycles in each interval combined into a single entry
+	config.add_section('Archive')
+	config.set('Archive', 'keepmonths', '0')
+	config.set('Archive', 'backupinterval', '24.0')
+	config.set('Archive', 'backupstep', '500')
+	config.set('Archive', 'backuppause', '0.25')
+	config.set('Archive', 'storage', 'wide')
+	config.set('Archive', 'keyframeinterval', '60')
+	config.set('Archive', 'interval', '60.0')
 	
 	## Dummy LED information
 	##  1) redPin - GPIO pin that a red LED is attached to
@@ -4,9 +4,12 @@ Module for interfacing with the sqlite3 database.
 
 import os
 import sys
+import json
+import math
 import time
 import uuid
 import Queue
+import shutil
 import logging
 import sqlite3
 import threading
@@ -18,6 +21,8 @@ try:
 except ImportError:
 	import StringIO
 
+from partition import getPartitionName, listPartitions, writePartition, readPartition, bucketColumns
+
 __version__ = "0.2"
 __all__ = ["Archive", "__version__", "__all__"]
 
@@ -64,12 +69,20 @@ class DatabaseProcessor(threading.Thread):
 		
 		return rid
 		
-	def getResponse(self, rid):
-		qid, qresp = self.output.get()
+	def getResponse(self, rid, withError=False):
+		"""
+		Wait for and return the output of the specified request.  If 
+		'withError' is True, a two-element tuple of the output and the error
+		message (None if the request succeeded) is returned instead.
+		"""
+		
+		qid, qresp, qerr = self.output.get()
 		while qid != rid:
-			self.output.put( (qid,qresp) )
-			qid, qresp = self.output.get()
+			self.output.put( (qid,qresp,qerr) )
+			qid, qresp, qerr = self.output.get()
 			
+		if withError:
+			return qresp, qerr
 		return qresp
 		
 	def dict_factory(self, cursor, row):
@@ -81,34 +94,229 @@ class DatabaseProcessor(threading.Thread):
 	def run(self):
 		self._dbConn = sqlite3.connect(self._dbName)
 		self._dbConn.row_factory = self.dict_factory
+		## Trigonometry in degrees for averaging the wind direction
+		self._dbConn.create_function('DSIN', 1, lambda x: None if x is None else math.sin(math.radians(x)))
+		self._dbConn.create_function('DCOS', 1, lambda x: None if x is None else math.cos(math.radians(x)))
 		self._cursor = self._dbConn.cursor()
 		
 		while self.alive.isSet() or not self.input.empty():
 			try:
-				rid, cmd = self.input.get()
+				rid, cmd = self.input.get(timeout=1.0)
+			except Queue.Empty:
+				continue
+				
+			try:
 				self._cursor.execute(cmd)
 				output = []
 				for row in self._cursor.fetchall():
 					output.append( row )
 				if cmd[:6] != 'SELECT':
 					self._dbConn.commit()
-				self.output.put( (rid,output) )
+				self.output.put( (rid,output,None) )
 				
 			except Exception, e:
 				exc_type, exc_value, exc_traceback = sys.exc_info()
 				dbLogger.error("DatabaseProcessor: %s at line %i", e, traceback.tb_lineno(exc_traceback))
+				self.output.put( (rid,[],str(e)) )
 				## Grab the full traceback and save it to a string via StringIO
-                fileObject = StringIO.StringIO()
-                traceback.print_tb(exc_traceback, file=fileObject)
-                tbString = fileObject.getvalue()
-                fileObject.close()
-                ## Print the traceback to the logger as a series of DEBUG messages
-                for line in tbString.split('\n'):
-                	dbLogger.debug("%s", line)
+				fileObject = StringIO.StringIO()
+				traceback.print_tb(exc_traceback, file=fileObject)
+				tbString = fileObject.getvalue()
+				fileObject.close()
+				## Print the traceback to the logger as a series of DEBUG messages
+				for line in tbString.split('\n'):
+					dbLogger.debug("%s", line)
 					
 		self._dbConn.close()
 
 
+class ArchiveWriter(threading.Thread):
+	"""
+	Class responsible for writing entries to the archive in the background.
+	Entries are first appended to an on-disk spool file so that they 
+	survive a crash and then placed on a bounded in-memory queue for the 
+	writer thread.  If the in-memory queue fills up the writer falls back 
+	to reading the pending entries directly from the spool.  Any entries 
+	left in the spool are written out when the thread is next started.
+	"""
+	
+	def __init__(self, archive, spoolName, queueSize=64):
+		self.archive = archive
+		self._spoolName = spoolName
+		self.input = Queue.Queue(queueSize)
+		
+		self._lock = threading.Lock()
+		self._spool = None
+		self._seq = 0
+		self._overflow = False
+		self._callbacks = {}
+		self._stats = {'depth': 0, 'maxDepth': 0, 'queued': 0, 'written': 0, 
+					   'failed': 0, 'overflowed': 0, 'lastLatency': 0.0}
+					   
+		self.thread = None
+		self.alive = threading.Event()
+		
+	def start(self):
+		if self.thread is not None:
+			self.cancel()
+			
+		# Recover anything left over from last time
+		pending = self._readSpool()
+		if len(pending) > 0:
+			self._seq = pending[-1]['seq']
+			self._overflow = True
+			self._stats['depth'] = len(pending)
+			dbLogger.info('Found %i unwritten archive entries in the spool', len(pending))
+		self._spool = open(self._spoolName, 'a+')
+		
+		## Make sure that a partial line left by a crash is terminated
+		self._spool.seek(0, os.SEEK_END)
+		if self._spool.tell() > 0:
+			self._spool.seek(-1, os.SEEK_END)
+			if self._spool.read(1) != '\n':
+				self._spool.write('\n')
+				self._spool.flush()
+				
+		self.thread = threading.Thread(target=self.run, name='dbWriter')
+		self.thread.setDaemon(1)
+		self.alive.set()
+		self.thread.start()
+		
+		dbLogger.info('Started the ArchiveWriter background thread')
+		
+	def cancel(self):
+		if self.thread is not None:
+			self.alive.clear()          # clear alive event for thread
+			self.thread.join()
+			self._spool.close()
+			
+		dbLogger.info('Stopped the ArchiveWriter background thread')
+		
+	def _readSpool(self):
+		"""
+		Read in the spool file and return a list of entries that have not 
+		yet been written to the archive, sorted by sequence number.
+		"""
+		
+		entries, done = {}, set()
+		try:
+			fh = open(self._spoolName, 'r')
+		except IOError:
+			return []
+		for line in fh:
+			try:
+				record = json.loads(line)
+			except ValueError:
+				## Partial line from a crash
+				continue
+			if 'done' in record:
+				done.add( record['done'] )
+			else:
+				entries[record['seq']] = record
+		fh.close()
+		
+		return [entries[seq] for seq in sorted(entries.keys()) if seq not in done]
+		
+	def _markDone(self, seq, success, tQueued, callback):
+		"""
+		Record that an entry has been processed, update the statistics, and
+		call the completion callback, if any.
+		"""
+		
+		with self._lock:
+			self._spool.write( json.dumps({'done': seq})+'\n' )
+			self._spool.flush()
+			
+			self._stats['depth'] -= 1
+			if success:
+				self._stats['written'] += 1
+			else:
+				self._stats['failed'] += 1
+			self._stats['lastLatency'] = time.time() - tQueued
+			
+			## Truncate the spool once everything has been written
+			if self._stats['depth'] == 0 and not self._overflow:
+				self._spool.seek(0)
+				self._spool.truncate()
+				
+		if callback is not None:
+			try:
+				callback(seq, success)
+			except Exception, e:
+				dbLogger.error('ArchiveWriter: callback failed: %s', str(e))
+				
+	def put(self, timestamp, data, callback=None):
+		"""
+		Add an entry to the spool and the write queue and return its sequence
+		number.  This never blocks on the database.
+		"""
+		
+		with self._lock:
+			self._seq += 1
+			seq = self._seq
+			tQueued = time.time()
+			
+			## Make it durable
+			record = {'seq': seq, 'timestamp': timestamp, 'data': data, 'tQueued': tQueued}
+			self._spool.write( json.dumps(record)+'\n' )
+			self._spool.flush()
+			os.fsync(self._spool.fileno())
+			
+			self._stats['queued'] += 1
+			self._stats['depth'] += 1
+			self._stats['maxDepth'] = max([self._stats['maxDepth'], self._stats['depth']])
+			
+			## Queue it, keeping everything in order once we fall back to the spool
+			if not self._overflow:
+				try:
+					self.input.put_nowait( (seq, timestamp, json.loads(json.dumps(data)), tQueued, callback) )
+				except Queue.Full:
+					self._overflow = True
+					self._stats['overflowed'] += 1
+					dbLogger.warning('ArchiveWriter: write queue full, falling back to the spool')
+			if self._overflow and callback is not None:
+				self._callbacks[seq] = callback
+				
+		return seq
+		
+	def getStats(self):
+		"""
+		Return a dictionary of write queue statistics.
+		"""
+		
+		with self._lock:
+			stats = self._stats.copy()
+		stats['memoryDepth'] = self.input.qsize()
+		return stats
+		
+	def run(self):
+		while self.alive.isSet() or not self.input.empty() or self._overflow:
+			## Regular queue
+			try:
+				seq, timestamp, data, tQueued, callback = self.input.get(timeout=1.0)
+				success = self.archive._insertData(timestamp, data, replace=True)
+				self._markDone(seq, success, tQueued, callback)
+				continue
+			except Queue.Empty:
+				pass
+				
+			## Spool fallback - only once the in-memory queue is drained
+			if self._overflow:
+				with self._lock:
+					if not self.input.empty():
+						continue
+					pending = self._readSpool()
+					if len(pending) == 0:
+						self._overflow = False
+						self._spool.seek(0)
+						self._spool.truncate()
+				for record in pending:
+					success = self.archive._insertData(record['timestamp'], record['data'], replace=True)
+					with self._lock:
+						callback = self._callbacks.pop(record['seq'], None)
+					self._markDone(record['seq'], success, record['tQueued'], callback)
+
+
 class Archive(object):
 	_dbConn = None
 	_cursor = None
@@ -128,11 +336,55 @@ class Archive(object):
 				 'rainfall': 'rain',
 				 'uvIndex': 'uv'}
 				 
-	def __init__(self):
+	# Version of the records index, stored as the database's user_version, 
+	# that is bumped whenever the way the index is built changes
+	_recordsVersion = 1
+	
+	# Direction columns that need to be vector averaged and the speed 
+	# column to weight them by
+	_dbVectors = {'windDir': 'windSpeed'}
+				 
+	# Columns that hold data, in table order
+	_dbColumns = ['barometer', 'inTemp', 'outTemp', 'outTemp1', 'outTemp2', 'outTemp3', 'outTemp4', 
+				  'inHumidity', 'outHumidity', 'outHumidity1', 'outHumidity2', 'outHumidity3', 'outHumidity4', 
+				  'windSpeed', 'windDir', 'windGust', 'rainRate', 'rain', 
+				  'inDewpoint', 'outDewpoint', 'outDewpoint1', 'outDewpoint2', 'outDewpoint3', 'outDewpoint4', 
+				  'windchill', 'uv']
+				  
+	def __init__(self, storage='wide', keyframeInterval=60):
+		"""
+		Initialize the archive.  The 'storage' keyword controls how entries are
+		stored in the database:
+		  * 'wide' - every column is written for every entry (wx table)
+		  * 'delta' - only columns that have changed since the previous 
+		    entry are written, with a full keyframe entry written every 
+		    'keyframeInterval' entries (wxdelta table)
+		The two layouts are stored in separate tables so changing the storage
+		mode of an existing archive starts a new table.
+		"""
+		
 		self._dbName = os.path.join(os.path.dirname(__file__), 'archive', 'wx-data.db')
 		if not os.path.exists(self._dbName):
 			raise RuntimeError("Archive database not found")
+		self._spoolName = os.path.join(os.path.dirname(__file__), 'archive', 'wx-spool.json')
 		self._backend = None
+		self._writer = None
+		self._partitions = listPartitions()
+		self._partitionsLock = threading.RLock()
+		
+		if storage not in ('wide', 'delta'):
+			raise ValueError("Unknown storage mode '%s'" % storage)
+		self._storage = storage
+		self._table = 'wx' if storage == 'wide' else 'wxdelta'
+		self._keyframeInterval = int(keyframeInterval)
+		self._deltaLock = threading.Lock()
+		self._lastRow = None
+		self._sinceKeyframe = 0
+		self._writeStats = {'rows': 0, 'keyframes': 0, 'values': 0}
+		self._recordsLock = threading.Lock()
+		self._records = {}
+		self._recordsThread = None
+		self._recordsAbort = threading.Event()
 		
 	def start(self):
 		"""
@@ -143,42 +395,207 @@ class Archive(object):
 			self._backend = DatabaseProcessor(self._dbName)
 		self._backend.start()
 		
+		if self._storage == 'delta':
+			cNames = ['dateTime INTEGER NOT NULL UNIQUE PRIMARY KEY', 'keyframe INTEGER NOT NULL', 'usUnits INTEGER']
+			for column in self._dbColumns:
+				cNames.append( '%s %s' % (column, 'INTEGER' if column == 'uv' else 'REAL') )
+			rid = self._backend.appendRequest('CREATE TABLE IF NOT EXISTS wxdelta (%s)' % ','.join(cNames))
+			self._backend.getResponse(rid)
+			
+		self._loadRecords()
+		
+		if self._writer is None:
+			self._writer = ArchiveWriter(self, self._spoolName)
+		self._writer.start()
+		
 	def cancel(self):
 		"""
 		Close the database.
 		"""
 	
+		if self._recordsThread is not None:
+			self._recordsAbort.set()
+			self._recordsThread.join()
+			self._recordsThread = None
+		if self._writer is not None:
+			self._writer.cancel()
 		if self._backend is not None:
 			self._backend.cancel()
 			
-	def getData(self, age=0):
+	def _getPeriodStarts(self, timestamp):
 		"""
-		Return a collection of data a certain number of seconds into the past.
+		Return a dictionary of the start of the local day, month, and year 
+		that contain the specified time, along with 0 for all-time.
 		"""
 		
-		# Fetch the entries that match
-		if age <= 0:
-			sqlCmd = 'SELECT * FROM wx ORDER BY dateTime DESC LIMIT 1'
-			rid = self._backend.appendRequest(sqlCmd)
-		else:
-			# Figure out how far to look back into the database
-			tNow = time.time()
-			tLookback = tNow - age
-			sqlCmd = 'SELECT * FROM wx WHERE dateTime >= %i ORDER BY dateTime LIMIT 1' % tLookback
-			rid = self._backend.appendRequest(sqlCmd)
+		tDay = datetime.fromtimestamp(timestamp).replace(hour=0, minute=0, second=0, microsecond=0)
+		tMonth = tDay.replace(day=1)
+		tYear = tMonth.replace(month=1)
+		
+		return {'day': int(tDay.strftime("%s")), 'month': int(tMonth.strftime("%s")), 
+				'year': int(tYear.strftime("%s")), 'all': 0}
+				
+	def _loadRecords(self):
+		"""
+		Load the records index from the database.  If it is empty or was 
+		built by an older version it is rebuilt from the data already in the
+		archive in the background so that starting up is not held off.
+		"""
+		
+		rid = self._backend.appendRequest('CREATE TABLE IF NOT EXISTS records (field TEXT NOT NULL, period TEXT NOT NULL, periodStart INTEGER NOT NULL, minValue REAL, minTime INTEGER, maxValue REAL, maxTime INTEGER, PRIMARY KEY (field, period))')
+		self._backend.getResponse(rid)
+		
+		rid = self._backend.appendRequest('SELECT * FROM records')
+		rows = self._backend.getResponse(rid)
+		
+		with self._recordsLock:
+			self._records = {}
+			for row in rows:
+				self._records[(row['field'], row['period'])] = [row['periodStart'], row['minValue'], row['minTime'], 
+																row['maxValue'], row['maxTime']]
+																
+		rid = self._backend.appendRequest('PRAGMA user_version')
+		version = self._backend.getResponse(rid)[0]['user_version']
+		
+		if len(rows) == 0 or version < self._recordsVersion:
+			dbLogger.info('Rebuilding the records index in the background')
+			self._recordsAbort.clear()
+			self._recordsThread = threading.Thread(target=self.rebuildRecords, name='records')
+			self._recordsThread.setDaemon(1)
+			self._recordsThread.start()
 			
-		# Fetch the output
-		output = self._backend.getResponse(rid)
-		try:
-			row = output[0]
-		except IndexError:
-			return 0, {}
+	def rebuildRecords(self, stepSize=7*86400):
+		"""
+		Rebuild the records index from the data in the monthly partitions,
+		a month at a time, and then from the data in the database, a week 
+		at a time.  Returns True if the index was rebuilt and False if there
+		was nothing to rebuild it from or the archive is being closed.
+		"""
+		
+		rid = self._backend.appendRequest('SELECT MIN(dateTime) AS dateTime FROM %s' % self._table)
+		tStart = self._backend.getResponse(rid)[0]['dateTime']
+		if tStart is None and len(self._partitions) == 0:
+			return False
 			
-		# Check for an empty database
-		if row is None:
-			return 0, {}
+		with self._recordsLock:
+			self._records = {}
+		for year,month,filename in self._partitions:
+			if self._recordsAbort.isSet():
+				return False
+			for row in readPartition(filename):
+				columns = [column for column in self._dbColumns if column in row]
+				self._updateRecords(row['dateTime'], columns, [row[column] for column in columns], save=False)
+				
+		tStop = time.time()
+		if tStart is None:
+			tStart = tStop + 1
+		while tStart <= tStop:
+			if self._recordsAbort.isSet():
+				return False
+			for row in self._fetchRows(tStart, tStop=tStart+stepSize):
+				columns = [column for column in self._dbColumns if column in row]
+				self._updateRecords(row['dateTime'], columns, [row[column] for column in columns], save=False)
+			tStart += stepSize
+		self._saveRecords(self._records.keys())
+		rid = self._backend.appendRequest('PRAGMA user_version = %i' % self._recordsVersion)
+		self._backend.getResponse(rid)
+		
+		dbLogger.info('Rebuilt the records index with %i entries', len(self._records))
+		return True
+		
+	def _updateRecords(self, timestamp, cNames, dValues, lows=None, highs=None, save=True):
+		"""
+		Update the records index with a new entry and, optionally, save the 
+		records that changed to the database.  If the entry covers more than 
+		one reading, the lowest and highest value of each column can be 
+		provided as dictionaries via the 'lows' and 'highs' keywords.
+		"""
+		
+		if lows is None:
+			lows = {}
+		if highs is None:
+			highs = {}
+		
+		starts = self._getPeriodStarts(timestamp)
+		
+		changed = []
+		with self._recordsLock:
+			for column,value in zip(cNames, dValues):
+				if column not in self._dbColumns or value is None or value == -99:
+					continue
+				low = lows.get(column, value)
+				high = highs.get(column, value)
+				
+				for period,start in starts.iteritems():
+					key = (column, period)
+					try:
+						record = self._records[key]
+					except KeyError:
+						record = None
+						
+					if record is None or record[0] < start:
+						## New period
+						self._records[key] = [start, low, timestamp, high, timestamp]
+						changed.append( key )
+					elif record[0] == start:
+						if low < record[1]:
+							record[1], record[2] = low, timestamp
+							changed.append( key )
+						if high > record[3]:
+							record[3], record[4] = high, timestamp
+							changed.append( key )
+							
+		if save and len(changed) > 0:
+			self._saveRecords( list(set(changed)) )
 			
-		# Convert it to the "standard" dictionary format
+	def _saveRecords(self, keys):
+		"""
+		Write the specified entries of the records index to the database in a
+		single statement.
+		"""
+		
+		if len(keys) == 0:
+			return True
+			
+		with self._recordsLock:
+			values = []
+			for key in keys:
+				record = self._records[key]
+				values.append( "('%s','%s',%i,%s,%i,%s,%i)" % (key[0], key[1], record[0], record[1], record[2], record[3], record[4]) )
+				
+		rid = self._backend.appendRequest('INSERT OR REPLACE INTO records (field, period, periodStart, minValue, minTime, maxValue, maxTime) VALUES %s' % ','.join(values))
+		output, error = self._backend.getResponse(rid, withError=True)
+		
+		return error is None
+		
+	def getRecords(self, period='day'):
+		"""
+		Return a dictionary of the minimum and maximum values, and when they
+		happened, of each field for the current local 'day', 'month', or 
+		'year', or for 'all' time.
+		"""
+		
+		start = self._getPeriodStarts(time.time())[period]
+		
+		names = {}
+		for name,column in self._dbMapper.iteritems():
+			names[column] = name
+			
+		output = {}
+		with self._recordsLock:
+			for (column,p),record in self._records.iteritems():
+				if p != period or record[0] != start:
+					continue
+				output[names.get(column, column)] = {'min': record[1], 'minTime': record[2], 
+													 'max': record[3], 'maxTime': record[4]}
+		return output
+		
+	def _convertRow(self, row):
+		"""
+		Convert a row from the wx table into the "standard" dictionary format
+		and return the timestamp and the dictionary.
+		"""
+		
 		timestamp = row['dateTime']
 		output = {'temperature': row['outTemp'], 'humidity': row['outHumidity'], 
 		          'dewpoint': row['outDewpoint'], 'windchill': row['windchill'], 
@@ -193,59 +610,490 @@ class Archive(object):
 			output['altHumidity'].append( row['outHumidity%i' % i] if row['outHumidity%i' % i] != -99 else None )
 			output['altDewpoint'].append( row['outDewpoint%i' % i] if row['outDewpoint%i' % i] != -99 else None )
 			
-		# Get the rainfall relative to the start of the year
-		
 		return timestamp, output
 		
-	def getDataYearStart(self):
-		tNow = datetime.now()
-		tYear = tNow.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
-		tYear = int( tYear.strftime("%s") )
+	def _getFirstAfter(self, tLookback):
+		"""
+		Return the first row at or after the specified time, looking first 
+		in the monthly partitions and then in the database.  Returns None if 
+		no such row exists.
+		"""
+		
+		with self._partitionsLock:
+			# Check the partitions that could contain the time
+			tMonth = datetime.fromtimestamp(tLookback)
+			for year,month,filename in self._partitions:
+				if (year, month) < (tMonth.year, tMonth.month):
+					continue
+				rows = readPartition(filename, tStart=tLookback)
+				if len(rows) > 0:
+					return rows[0]
+					
+			# Check the database
+			output = self._fetchRows(tLookback, limit=1)
+		try:
+			return output[0]
+		except IndexError:
+			return None
+			
+	def _readPartitions(self, tStart, tStop=None, columns=None):
+		"""
+		Return a list of rows, sorted by time, from the monthly partitions 
+		with tStart <= dateTime < tStop.  If 'columns' is provided only those
+		columns (plus dateTime) are read in.
+		"""
+		
+		tMonthStart = datetime.fromtimestamp(tStart)
+		tMonthStop = datetime.fromtimestamp(tStop if tStop is not None else time.time())
+		
+		rows = []
+		for year,month,filename in self._partitions:
+			if (year, month) < (tMonthStart.year, tMonthStart.month) \
+			   or (year, month) > (tMonthStop.year, tMonthStop.month):
+				continue
+			rows.extend( readPartition(filename, columns=columns, tStart=tStart, tStop=tStop) )
+		return rows
+		
+	def _fillRows(self, rows):
+		"""
+		Given a list of rows from the wxdelta table that starts with a 
+		keyframe, fill in the unchanged (NULL) columns from the preceding 
+		rows so that they look like rows from the wx table.
+		"""
+		
+		last = {}
+		for row in rows:
+			del row['keyframe']
+			for column,value in row.iteritems():
+				if value is None:
+					row[column] = last.get(column, -99)
+			last = row
+			
+		return rows
+		
+	def _fetchRows(self, tStart, tStop=None, limit=None):
+		"""
+		Return a list of full rows from the database, sorted by time, with 
+		tStart <= dateTime < tStop.  If 'limit' is provided, at most that 
+		many rows are returned.  For the delta storage mode the rows are 
+		rebuilt starting from the closest keyframe at or before tStart.
+		"""
 		
-		sqlCmd = 'SELECT * FROM wx WHERE dateTime >= %i ORDER BY dateTime LIMIT 1' % tYear
+		tStart = int(tStart)
+		where = 'dateTime >= %i' % tStart
+		if tStop is not None:
+			where += ' AND dateTime < %i' % int(tStop)
+			
+		if self._storage == 'wide':
+			sqlCmd = 'SELECT * FROM wx WHERE %s ORDER BY dateTime' % where
+			if limit is not None:
+				sqlCmd += ' LIMIT %i' % limit
+			rid = self._backend.appendRequest(sqlCmd)
+			return self._backend.getResponse(rid)
+			
+		# Find the keyframe to start from
+		sqlCmd = 'SELECT MAX(dateTime) AS dateTime FROM wxdelta WHERE keyframe = 1 AND dateTime <= %i' % tStart
 		rid = self._backend.appendRequest(sqlCmd)
+		tKey = self._backend.getResponse(rid)[0]['dateTime']
+		if tKey is None:
+			tKey = tStart
 			
-		# Fetch the output
+		sqlCmd = 'SELECT * FROM wxdelta WHERE dateTime >= %i' % tKey
+		if tStop is not None:
+			sqlCmd += ' AND dateTime < %i' % int(tStop)
+		if limit is not None:
+			sqlCmd += ' AND dateTime <= IFNULL((SELECT dateTime FROM wxdelta WHERE %s ORDER BY dateTime LIMIT 1 OFFSET %i), %i)' % (where, limit-1, 2**31-1)
+		sqlCmd += ' ORDER BY dateTime'
+		rid = self._backend.appendRequest(sqlCmd)
+		rows = self._fillRows( self._backend.getResponse(rid) )
+		
+		return [row for row in rows if row['dateTime'] >= tStart]
+		
+	def _fetchLatest(self):
+		"""
+		Return the most recent full row from the database or None if the 
+		database is empty.
+		"""
+		
+		if self._storage == 'wide':
+			sqlCmd = 'SELECT * FROM wx ORDER BY dateTime DESC LIMIT 1'
+			rid = self._backend.appendRequest(sqlCmd)
+		else:
+			sqlCmd = 'SELECT * FROM wxdelta WHERE dateTime >= IFNULL((SELECT MAX(dateTime) FROM wxdelta WHERE keyframe = 1), 0) ORDER BY dateTime'
+			rid = self._backend.appendRequest(sqlCmd)
 		output = self._backend.getResponse(rid)
 		try:
-			row = output[0]
+			return self._fillRows(output)[-1] if self._storage == 'delta' else output[0]
 		except IndexError:
-			## Looks like we don't have a full year yet, get the oldest entry avaliable
-			sqlCmd = 'SELECT * FROM wx ORDER BY dateTime LIMIT 1' % tYear
-			rid = self._backend.appendRequest(sqlCmd)
+			return None
 			
-			## Fetch the output
-			output = self._backend.getResponse(rid)
+	def getData(self, age=0):
+		"""
+		Return a collection of data a certain number of seconds into the past.
+		"""
+		
+		# Fetch the entries that match
+		if age <= 0:
+			row = self._fetchLatest()
+		else:
+			# Figure out how far to look back into the database
+			tNow = time.time()
+			tLookback = tNow - age
+			row = self._getFirstAfter(tLookback)
 			
 		# Check for an empty database
 		if row is None:
 			return 0, {}
 			
 		# Convert it to the "standard" dictionary format
-		timestamp = row['dateTime']
-		output = {'temperature': row['outTemp'], 'humidity': row['outHumidity'], 
-		          'dewpoint': row['outDewpoint'], 'windchill': row['windchill'], 
-		          'indoorTemperature': row['inTemp'], 'indoorHumidity': row['inHumidity'], 
-		          'indoorDewpoint': row['inDewpoint'], 'pressure': row['barometer'], 
-		          'rainrate': row['rainRate'], 'rainfall': row['rain'], 
-		          'average': row['windSpeed'], 'gust': row['windGust'], 'direction': row['windDir'], 
-			  'altTemperature': [], 'altHumidity': [], 'altDewpoint': [],
-			  'uvIndex': row['uv']}
-		for i in xrange(1, 5):
-			output['altTemperature'].append( row['outTemp%i' % i] if row['outTemp%i' % i] != -99 else None )
-			output['altHumidity'].append( row['outHumidity%i' % i] if row['outHumidity%i' % i] != -99 else None )
-			output['altDewpoint'].append( row['outDewpoint%i' % i] if row['outDewpoint%i' % i] != -99 else None )
+		return self._convertRow(row)
+		
+	def getDataYearStart(self):
+		tNow = datetime.now()
+		tYear = tNow.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+		tYear = int( tYear.strftime("%s") )
+		
+		# Fetch the first entry of the year.  If we don't have a full year yet 
+		# this is the oldest entry available.
+		row = self._getFirstAfter(tYear)
+		
+		# Check for an empty database
+		if row is None:
+			return 0, {}
 			
-		return timestamp, output
-
-	def writeData(self, timestamp, data):
+		# Convert it to the "standard" dictionary format
+		return self._convertRow(row)
+		
+	def getSeries(self, field, tStart, tStop=None):
 		"""
-		Write a collection of data to the database.
+		Return a list of timestamp, value pairs for a single field from the
+		archive between tStart and tStop, including anything that has been 
+		moved into the monthly partitions.  Missing values are skipped.
 		"""
 		
-		# Build up the values to insert
-		cNames = ['dateTime', 'usUnits']
-		dValues = [int(timestamp), 0]
+		column = self._dbMapper[field]
+		
+		with self._partitionsLock:
+			rows = self._readPartitions(tStart, tStop=tStop, columns=[column])
+			rows.extend( self._fetchRows(tStart, tStop=tStop) )
+		
+		output = []
+		for row in rows:
+			if row[column] is not None and row[column] != -99:
+				output.append( (row['dateTime'], row[column]) )
+		return output
+		
+	def getHistory(self, tStart, tStop=None, fields=None, nPoints=500):
+		"""
+		Return the archived values for the specified fields between tStart
+		and tStop, downsampled to at most nPoints buckets.  Each bucket 
+		reports the mean, minimum, and maximum of every field along with 
+		the mean timestamp of the bucket.  The wind direction is vector 
+		averaged, weighted by the wind speed, and has no minimum or maximum.
+		Missing values (-99) are ignored when computing the bucket 
+		statistics.  Data in the database, in 
+		either storage mode, are downsampled by sqlite3 and data that have 
+		been moved into the monthly partitions are downsampled as they are 
+		read in.
+		"""
+		
+		# Validate
+		if tStop is None:
+			tStop = time.time()
+		tStart, tStop = int(tStart), int(tStop)
+		if fields is None:
+			fields = ['temperature', 'humidity', 'dewpoint', 'pressure',
+					  'average', 'gust', 'rainrate', 'rainfall']
+		columns = [self._dbMapper[field] for field in fields]
+		nPoints = max([1, int(nPoints)])
+		
+		# Figure out the bucket width in seconds
+		width = (tStop - tStart + nPoints - 1) / nPoints
+		width = max([1, width])
+		
+		# Directions are vector averaged, weighted by the speed, and so need
+		# the speed to be read in as well
+		vectors = {}
+		for column in columns:
+			if column in self._dbVectors:
+				vectors[column] = self._dbVectors[column]
+		readColumns = list(columns)
+		for column in vectors.itervalues():
+			if column not in readColumns:
+				readColumns.append( column )
+				
+		# Downsample what is in the partitions
+		self._partitionsLock.acquire()
+		rows = self._readPartitions(tStart, tStop=tStop, columns=readColumns)
+		buckets = bucketColumns(rows, columns, tStart, width, vectors=vectors)
+		
+		# Downsample what is in the database.  For the delta storage mode the
+		# unchanged (NULL) columns are filled in from the most recent entry 
+		# that has them, which is never further back than the last keyframe.
+		where = 'dateTime >= %i AND dateTime < %i' % (tStart, tStop)
+		if self._storage == 'wide':
+			source = 'wx WHERE %s' % where
+		else:
+			fill = ['dateTime']
+			for column in readColumns:
+				fill.append( 'COALESCE(%s, (SELECT %s FROM wxdelta AS p WHERE p.dateTime < d.dateTime AND p.%s IS NOT NULL ORDER BY p.dateTime DESC LIMIT 1)) AS %s' % (column, column, column, column) )
+			source = '(SELECT %s FROM wxdelta AS d WHERE %s)' % (','.join(fill), where)
+			
+		cNames = ['(dateTime - %i) / %i AS bucket' % (tStart, width), 
+				  'SUM(dateTime) AS dateTime', 'COUNT(*) AS n']
+		for column in columns:
+			valid = 'CASE WHEN %s != -99 THEN %s END' % (column, column)
+			cNames.append( 'COUNT(%s) AS %s_count' % (valid, column) )
+			if column in vectors:
+				speed = 'CASE WHEN %s > 0 THEN %s ELSE 0 END' % (vectors[column], vectors[column])
+				cNames.append( 'SUM(CASE WHEN %s != -99 THEN (%s)*DSIN(%s) END) AS %s_x' % (column, speed, column, column) )
+				cNames.append( 'SUM(CASE WHEN %s != -99 THEN (%s)*DCOS(%s) END) AS %s_y' % (column, speed, column, column) )
+				cNames.append( 'SUM(DSIN(%s)) AS %s_ux' % (valid, column) )
+				cNames.append( 'SUM(DCOS(%s)) AS %s_uy' % (valid, column) )
+			else:
+				for stat in ('SUM', 'MIN', 'MAX'):
+					cNames.append( '%s(%s) AS %s_%s' % (stat, valid, column, stat.lower()) )
+		sqlCmd = 'SELECT %s FROM %s GROUP BY bucket' % (','.join(cNames), source)
+		try:
+			rid = self._backend.appendRequest(sqlCmd)
+			rows = self._backend.getResponse(rid)
+		finally:
+			self._partitionsLock.release()
+			
+		## Merge the two sets of buckets
+		for row in rows:
+			try:
+				bucket = buckets[row['bucket']]
+			except KeyError:
+				bucket = {'dateTime': 0, 'n': 0}
+				for column in columns:
+					if column in vectors:
+						bucket[column] = [0, 0.0, 0.0, 0.0, 0.0]
+					else:
+						bucket[column] = [0, 0.0, None, None]
+				buckets[row['bucket']] = bucket
+				
+			bucket['dateTime'] += row['dateTime']
+			bucket['n'] += row['n']
+			for column in columns:
+				stats = bucket[column]
+				if row['%s_count' % column] == 0:
+					continue
+				stats[0] += row['%s_count' % column]
+				if column in vectors:
+					for i,part in enumerate(('x', 'y', 'ux', 'uy')):
+						stats[i+1] += row['%s_%s' % (column, part)]
+					continue
+				stats[1] += row['%s_sum' % column]
+				stats[2] = row['%s_min' % column] if stats[2] is None else min([stats[2], row['%s_min' % column]])
+				stats[3] = row['%s_max' % column] if stats[3] is None else max([stats[3], row['%s_max' % column]])
+				
+		# Convert it to a column-oriented dictionary
+		output = {'timestamp': []}
+		for field in fields:
+			output[field] = {'mean': [], 'min': [], 'max': []}
+		for b in sorted(buckets.keys()):
+			bucket = buckets[b]
+			output['timestamp'].append( int(bucket['dateTime'] / bucket['n']) )
+			for field,column in zip(fields, columns):
+				if column in vectors:
+					### Directions only have a mean
+					n, x, y, ux, uy = bucket[column]
+					if abs(x) < 1e-6 and abs(y) < 1e-6:
+						x, y = ux, uy
+					output[field]['mean'].append( int(round(math.degrees(math.atan2(x, y)))) % 360 if n > 0 else None )
+					output[field]['min'].append( None )
+					output[field]['max'].append( None )
+					continue
+					
+				n, total, vMin, vMax = bucket[column]
+				output[field]['mean'].append( total / n if n > 0 else None )
+				output[field]['min'].append( vMin )
+				output[field]['max'].append( vMax )
+				
+		return output
+		
+	def compactArchive(self, keepMonths=3):
+		"""
+		Move all complete months older than the specified number of months 
+		out of the database and into compressed, column-oriented partition 
+		files.  Returns the number of rows moved.
+		"""
+		
+		# Find the start of the oldest month to keep
+		tNow = datetime.now()
+		year, month = tNow.year, tNow.month - keepMonths
+		while month < 1:
+			year -= 1
+			month += 12
+		tKeep = int( datetime(year, month, 1).strftime("%s") )
+		
+		# Find the oldest entry in the database
+		rid = self._backend.appendRequest('SELECT MIN(dateTime) AS dateTime FROM %s' % self._table)
+		tOldest = self._backend.getResponse(rid)[0]['dateTime']
+		if tOldest is None or tOldest >= tKeep:
+			return 0
+			
+		# Move the data, one month at a time
+		nMoved = 0
+		tMonth = datetime.fromtimestamp(tOldest).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+		while int( tMonth.strftime("%s") ) < tKeep:
+			if tMonth.month == 12:
+				tNext = tMonth.replace(year=tMonth.year+1, month=1)
+			else:
+				tNext = tMonth.replace(month=tMonth.month+1)
+			t0, t1 = int( tMonth.strftime("%s") ), int( tNext.strftime("%s") )
+			
+			rows = self._fetchRows(t0, t1)
+			if len(rows) > 0:
+				## Merge with anything that is already in the partition
+				filename = getPartitionName(tMonth.year, tMonth.month)
+				if os.path.exists(filename):
+					seen = set([row['dateTime'] for row in rows])
+					for row in readPartition(filename):
+						if row['dateTime'] not in seen:
+							rows.append( row )
+				writePartition(filename, rows)
+				
+				## Only delete once the partition is safely on disk and readers
+				## can see it.  Readers hold the partition lock while they read 
+				## both the partitions and the database so that the month is 
+				## never missing from, or doubled in, what they get back.  For 
+				## the delta storage mode the first entry left needs to become a
+				## keyframe.
+				with self._partitionsLock:
+					self._partitions = listPartitions()
+					if self._storage == 'delta':
+						following = self._fetchRows(t1, limit=1)
+					sqlCmd = 'DELETE FROM %s WHERE dateTime >= %i AND dateTime < %i' % (self._table, t0, t1)
+					rid = self._backend.appendRequest(sqlCmd)
+					self._backend.getResponse(rid)
+					if self._storage == 'delta' and len(following) > 0:
+						row = following[0]
+						cNames = ['dateTime', 'keyframe', 'usUnits'] + self._dbColumns
+						dValues = [row['dateTime'], 1, row['usUnits']] + [row[column] for column in self._dbColumns]
+						sqlCmd = 'INSERT OR REPLACE INTO wxdelta (%s) VALUES (%s)' % (','.join(cNames), ','.join([str(v) for v in dValues]))
+						rid = self._backend.appendRequest(sqlCmd)
+						self._backend.getResponse(rid)
+				nMoved += len(rows)
+				
+			tMonth = tNext
+			
+		dbLogger.info('Moved %i rows from the archive into monthly partitions', nMoved)
+		
+		return nMoved
+		
+	def backup(self, filename, stepSize=500):
+		"""
+		Generator that brings the specified backup database, and a copy of 
+		the monthly partitions next to it, up to date with the archive a few
+		rows at a time.  Tables with a dateTime column are compared with the
+		backup in windows of stepSize rows so that rows that were rewritten 
+		in place (keyframe conversions, spool replays) are copied again and 
+		rows that were deleted (compaction) are removed from the backup.  
+		Other tables are small and are copied in full.  Each step is a 
+		single request to the database thread so that other readers and 
+		writers are only held off for the duration of one step.  After each
+		step a three-element tuple of table name, rows checked, and rows to
+		check is yielded.
+		"""
+		
+		rid = self._backend.appendRequest("ATTACH DATABASE '%s' AS bak" % filename)
+		self._backend.getResponse(rid)
+		
+		try:
+			rid = self._backend.appendRequest("SELECT name, sql FROM main.sqlite_master WHERE type = 'table'")
+			tables = self._backend.getResponse(rid)
+			for table in tables:
+				name = table['name']
+				
+				## Make sure the table exists in the backup
+				sqlCmd = table['sql'].replace('CREATE TABLE %s' % name, 'CREATE TABLE IF NOT EXISTS bak.%s' % name, 1)
+				rid = self._backend.appendRequest(sqlCmd)
+				self._backend.getResponse(rid)
+				
+				rid = self._backend.appendRequest('PRAGMA main.table_info(%s)' % name)
+				columns = [column['name'] for column in self._backend.getResponse(rid)]
+				if 'dateTime' not in columns:
+					## Full copy
+					rid = self._backend.appendRequest('DELETE FROM bak.%s' % name)
+					self._backend.getResponse(rid)
+					rid = self._backend.appendRequest('INSERT INTO bak.%s SELECT * FROM main.%s' % (name, name))
+					self._backend.getResponse(rid)
+					yield name, 1, 1
+					continue
+					
+				## Windowed sync.  The first window is open below and the last
+				## one is open above so that anything in the backup outside of
+				## what is left in the archive is removed.
+				rid = self._backend.appendRequest('SELECT COUNT(*) AS n FROM main.%s' % name)
+				nTotal = self._backend.getResponse(rid)[0]['n']
+				
+				nChecked = 0
+				tLast = None
+				while True:
+					sqlCmd = 'SELECT dateTime FROM main.%s' % name
+					if tLast is not None:
+						sqlCmd += ' WHERE dateTime > %i' % tLast
+					sqlCmd += ' ORDER BY dateTime LIMIT 1 OFFSET %i' % (stepSize-1)
+					rid = self._backend.appendRequest(sqlCmd)
+					output = self._backend.getResponse(rid)
+					tNext = output[0]['dateTime'] if len(output) > 0 else None
+					
+					where = []
+					if tLast is not None:
+						where.append( 'dateTime > %i' % tLast )
+					if tNext is not None:
+						where.append( 'dateTime <= %i' % tNext )
+					where = ' WHERE %s' % ' AND '.join(where) if len(where) > 0 else ''
+					
+					sqlCmd = 'INSERT OR REPLACE INTO bak.%s SELECT * FROM main.%s%s EXCEPT SELECT * FROM bak.%s%s' % (name, name, where, name, where)
+					rid = self._backend.appendRequest(sqlCmd)
+					self._backend.getResponse(rid)
+					sqlCmd = 'DELETE FROM bak.%s%s %s dateTime NOT IN (SELECT dateTime FROM main.%s%s)' % (name, where, 'AND' if where else 'WHERE', name, where)
+					rid = self._backend.appendRequest(sqlCmd)
+					self._backend.getResponse(rid)
+					
+					if tNext is None:
+						break
+					tLast = tNext
+					nChecked = min([nChecked + stepSize, nTotal])
+					yield name, nChecked, nTotal
+					
+				yield name, nTotal, nTotal
+				
+		finally:
+			rid = self._backend.appendRequest('DETACH DATABASE bak')
+			self._backend.getResponse(rid)
+			
+		# Partitions last.  Compaction writes a month's partition before it
+		# deletes those rows from the database so anything that was removed 
+		# from the backup database above is in one of these.  Partition 
+		# files are only ever replaced by renaming so they can be copied 
+		# without holding anything off.
+		path = os.path.join(os.path.dirname(os.path.abspath(filename)), 'partitions.bak')
+		if not os.path.exists(path):
+			os.makedirs(path)
+		partitions = listPartitions()
+		for i,(year,month,source) in enumerate(partitions):
+			target = os.path.join(path, os.path.basename(source))
+			try:
+				sStat, tStat = os.stat(source), os.stat(target)
+				if sStat.st_size == tStat.st_size and int(sStat.st_mtime) == int(tStat.st_mtime):
+					continue
+			except OSError:
+				pass
+			shutil.copy2(source, target+'.tmp')
+			os.rename(target+'.tmp', target)
+			yield 'partitions', i+1, len(partitions)
+			
+	def _mapColumns(self, data):
+		"""
+		Given a collection of data, return a list of the database columns and
+		a list of the values for those columns.
+		"""
+		
+		cNames, dValues = [], []
 		for key in data.keys():
 			try:
 				cNames.append( self._dbMapper[key] )
@@ -264,8 +1112,118 @@ class Archive(object):
 							cNames.append( "%s%i" % (nameBase, i+1) )
 							dValues.append( data[key][i] )
 							
+		return cNames, dValues
+		
+	def _insertData(self, timestamp, data, replace=False):
+		"""
+		Write a collection of data to the database and wait for the insert 
+		to finish.  Returns True if the insert succeeded, False otherwise.  
+		If 'replace' is True, any existing entry with the same timestamp is
+		replaced.
+		"""
+		
+		# Build up the values to insert
+		rNames, rValues = self._mapColumns(data)
+		cNames = ['dateTime', 'usUnits'] + rNames
+		dValues = [int(timestamp), 0] + rValues
+		
+		# Build up the extremes for the records index - if the entry covers 
+		# more than one reading
+		lows = dict(zip(*self._mapColumns(data.get('lows', {}))))
+		highs = dict(zip(*self._mapColumns(data.get('highs', {}))))
+		
 		# Add the entry to the database
-		rid = self._backend.appendRequest('INSERT INTO wx (%s) VALUES (%s)' % (','.join(cNames), ','.join([str(v) for v in dValues])))
-		output = self._backend.getResponse(rid)
+		verb = 'INSERT OR REPLACE' if replace else 'INSERT'
+		if self._storage == 'delta':
+			with self._deltaLock:
+				cNames, dValues = self._deltaEncode(cNames, dValues)
+				rid = self._backend.appendRequest('%s INTO wxdelta (%s) VALUES (%s)' % (verb, ','.join(cNames), ','.join([str(v) for v in dValues])))
+				output, error = self._backend.getResponse(rid, withError=True)
+				if error is not None:
+					## Make sure the next entry is a keyframe
+					self._lastRow = None
+		else:
+			rid = self._backend.appendRequest('%s INTO wx (%s) VALUES (%s)' % (verb, ','.join(cNames), ','.join([str(v) for v in dValues])))
+			output, error = self._backend.getResponse(rid, withError=True)
+			
+		if error is None:
+			self._writeStats['rows'] += 1
+			self._writeStats['values'] += len(cNames)
+			self._updateRecords(int(timestamp), rNames, rValues, lows=lows, highs=highs)
+			
+		return error is None
 		
-		return True
+	def _deltaEncode(self, cNames, dValues):
+		"""
+		Given the column names and values for a new entry, return the column
+		names and values that need to be written to the wxdelta table.  This
+		is either a keyframe with every column or only the columns that have
+		changed since the previous entry.
+		"""
+		
+		# Expand to a full row with the usual -99 for missing values
+		row = dict(zip(cNames, dValues))
+		full = {}
+		for column in self._dbColumns:
+			full[column] = row.get(column, -99)
+			
+		# Figure out where we are
+		if self._lastRow is None:
+			self._lastRow = self._fetchLatest()
+			self._sinceKeyframe = self._keyframeInterval
+			
+		if self._sinceKeyframe >= self._keyframeInterval:
+			## Keyframe
+			columns = self._dbColumns
+			self._sinceKeyframe = 0
+			self._writeStats['keyframes'] += 1
+			keyframe = 1
+		else:
+			## Delta
+			columns = [column for column in self._dbColumns if full[column] != self._lastRow[column]]
+			keyframe = 0
+		self._sinceKeyframe += 1
+		self._lastRow = full
+		
+		cNames = ['dateTime', 'keyframe', 'usUnits'] + columns
+		dValues = [row['dateTime'], keyframe, row['usUnits']] + [full[column] for column in columns]
+		
+		return cNames, dValues
+		
+	def getStorageStats(self):
+		"""
+		Return a dictionary of statistics about how much data has been written
+		to the database since the archive was started and how much space the
+		wide and delta tables take up on disk.  The on-disk sizes are None if
+		sqlite3 was built without the dbstat virtual table.
+		"""
+		
+		stats = self._writeStats.copy()
+		stats['storage'] = self._storage
+		stats['wideValues'] = stats['rows']*(len(self._dbColumns)+2)
+		
+		rid = self._backend.appendRequest("SELECT name, SUM(pgsize) AS size FROM dbstat WHERE name IN ('wx', 'wxdelta') GROUP BY name")
+		output, error = self._backend.getResponse(rid, withError=True)
+		stats['wxSize'], stats['wxdeltaSize'] = None, None
+		for row in output:
+			stats['%sSize' % row['name']] = row['size']
+			
+		return stats
+		
+	def writeDataAsync(self, timestamp, data, callback=None):
+		"""
+		Queue a collection of data to be written to the database in the 
+		background and return immediately.  If a callback function is 
+		provided it is called from the writer thread with the sequence 
+		number of the entry and whether or not the write succeeded.  Returns 
+		the sequence number of the entry.
+		"""
+		
+		return self._writer.put(timestamp, data, callback=callback)
+		
+	def getWriteStats(self):
+		"""
+		Return a dictionary of statistics about the background write queue.
+		"""
+		
+		return self._writer.getStats()
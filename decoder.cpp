@@ -3,6 +3,7 @@
 #include <iostream>
 #include <stdlib.h>
 #include <time.h>
+#include <sys/time.h>
 #include "wiringPi.h"
 
 #include "RCSwitch.h"
@@ -16,21 +17,60 @@ static int initalized = 0;
 RCSwitch *rc;
 
 
+/*
+  getTime - Function to return the current time as a floating point UNIX 
+  timestamp.
+*/
+
+static double getTime(void) {
+	struct timeval tv;
+	
+	gettimeofday(&tv, NULL);
+	return (double) tv.tv_sec + (double) tv.tv_usec / 1e6;
+}
+
+
+/*
+  buildPacket - Function to convert a message and the time it was received 
+  into a three-element tuple of type, payload, and timestamp.
+*/
+
+static PyObject *buildPacket(char *message, double timestamp) {
+	PyObject *temp, *temp2, *temp2a, *temp2b, *temp3, *temp4;
+	
+	temp = PyString_FromString(message);
+	temp2 = PyObject_CallMethod(temp, "split", "(si)", " ", 1);
+	
+	temp2a = PyList_GetItem(temp2, (Py_ssize_t) 0);
+	temp2b = PyList_GetItem(temp2, (Py_ssize_t) 1);
+	temp4 = PyFloat_FromDouble(timestamp);
+	temp3 = PyTuple_Pack((Py_ssize_t) 3, temp2a, temp2b, temp4);
+	
+	Py_DECREF(temp);
+	Py_DECREF(temp2);
+	Py_DECREF(temp4);
+	
+	return temp3;
+}
+
+
 /*
   read433 - Function for reading directly from an RTL-SDR and returning a list of
   Manchester decoded bits.
 */
 
 static PyObject *read433(PyObject *self, PyObject *args, PyObject *kwds) {
-	PyObject *output, *bits, *temp, *temp2, *temp2a, *temp2b, *temp3;
-	long inputPin, duration, verbose, tStart, nMessage, i;
+	PyObject *output, *bits, *temp3, *callback, *result;
+	long inputPin, duration, verbose, tStart, nMessage, i, failed;
 	struct sigaction sigact;
 	char message[RCSWITCH_MAX_MESS_SIZE];
 	char messages[1024][RCSWITCH_MAX_MESS_SIZE];
+	double times[1024];
 	
 	verbose = 0;
-	static char *kwlist[] = {"inputPin", "duration", NULL};
-	if( !PyArg_ParseTupleAndKeywords(args, kwds, "ii", kwlist, &inputPin, &duration) ) {
+	callback = NULL;
+	static char *kwlist[] = {"inputPin", "duration", "callback", NULL};
+	if( !PyArg_ParseTupleAndKeywords(args, kwds, "ii|O", kwlist, &inputPin, &duration, &callback) ) {
 		PyErr_Format(PyExc_RuntimeError, "Invalid parameters");
 		return NULL;
 	}
@@ -40,6 +80,13 @@ static PyObject *read433(PyObject *self, PyObject *args, PyObject *kwds) {
 		PyErr_Format(PyExc_ValueError, "Duration value must be greater than zero");
 		return NULL;
 	}
+	if( callback == Py_None ) {
+		callback = NULL;
+	}
+	if( callback != NULL && !PyCallable_Check(callback) ) {
+		PyErr_Format(PyExc_TypeError, "Callback must be callable");
+		return NULL;
+	}
 	
 	// Setup the 433 MHz receiver if needed
 	if( !initalized ) {
@@ -53,16 +100,21 @@ static PyObject *read433(PyObject *self, PyObject *args, PyObject *kwds) {
 		}
 		
 		initalized = (int) inputPin;
+	} else {
+		// Start listening again, discarding anything decoded in between
+		rc->enableReceive();
 	}
 	
 	// Go
 	Py_BEGIN_ALLOW_THREADS
 	
 	nMessage = 0;
+	failed = 0;
 	tStart = (long) time(NULL);
 	while ((long) time(NULL) - tStart < duration && !do_exit) {
 		//// Check for a message
 		if ( rc->OokAvailable() ) {
+			times[nMessage] = getTime();
 			rc->getOokCode(message);
 			
 			if( verbose ) {
@@ -72,6 +124,23 @@ static PyObject *read433(PyObject *self, PyObject *args, PyObject *kwds) {
 			strcpy(messages[nMessage], message);
 			nMessage += 1;
 			
+			//// Hand the packet off as soon as it arrives - if needed
+			if( callback != NULL ) {
+				Py_BLOCK_THREADS
+				
+				temp3 = buildPacket(message, times[nMessage-1]);
+				result = PyObject_CallFunctionObjArgs(callback, temp3, NULL);
+				Py_DECREF(temp3);
+				if( result == NULL ) {
+					failed = 1;
+					duration = 0;
+				} else {
+					Py_DECREF(result);
+				}
+				
+				Py_UNBLOCK_THREADS
+			}
+			
 			if( nMessage == 1024 ) {
 				duration = 0;
 			}
@@ -84,24 +153,20 @@ static PyObject *read433(PyObject *self, PyObject *args, PyObject *kwds) {
 	
 	Py_END_ALLOW_THREADS
 	
-	// Shutdown the receiver
+	// Shutdown the receiver - no interrupts until the next capture
 	rc->disableReceive();
 	
+	// Pass along any errors raised by the callback
+	if( failed ) {
+		return NULL;
+	}
+	
 	// Setup the output list
 	bits = PyList_New(0);
 	for(i=0; i<nMessage; i++) {
-		strcpy(message, messages[i]);
-		
-		temp = PyString_FromString(message);
-		temp2 = PyObject_CallMethod(temp, "split", "(si)", " ", 1);
-		
-		temp2a = PyList_GetItem(temp2, (Py_ssize_t) 0);
-		temp2b = PyList_GetItem(temp2, (Py_ssize_t) 1);
-		temp3 = PyTuple_Pack((Py_ssize_t) 2, temp2a, temp2b);
+		temp3 = buildPacket(messages[i], times[i]);
 		PyList_Append(bits, temp3);
 		
-		Py_DECREF(temp);
-		Py_DECREF(temp2);
 		Py_DECREF(temp3);
 	}
 	
@@ -118,10 +183,13 @@ suitable for identifying Oregon Scientific v2.1 and v3.0 sensor data.\n\
 Inputs:\n\
   * inputPin - GPIO pin on the Raspberry Pi to use\n\
   * duration - integer number of seconds to capture data for\n\
+  * callback - optional function that is called with each packet as it\n\
+               is received\n\
 \n\
 Outputs:\n\
- * packets - a list of two-element tuples containing the protocol and\n\
-             the packat data-header as a hex string\n\
+ * packets - a list of three-element tuples containing the protocol,\n\
+             the packat data-header as a hex string, and the time the\n\
+             packet was received as a UNIX timestamp\n\
 \n\
 Based on:\n\
  * http://www.osengr.org/WxShield/Downloads/OregonScientific-RF-Protocols-II.pdf\n\
@@ -155,5 +223,5 @@ PyMODINIT_FUNC initdecoder(void) {
 	m = Py_InitModule3("decoder", DecoderMethods, Decoder_doc);
 	
 	// Version and revision information
-	PyModule_AddObject(m, "__version__", PyString_FromString("0.2"));
+	PyModule_AddObject(m, "__version__", PyString_FromString("0.4"));
 }
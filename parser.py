@@ -9,15 +9,40 @@ import threading
 
 from utils import computeDewPoint, computeWindchill, computeSeaLevelPressure
 
-__version__ = '0.2'
-__all__ = ['computeChecksum', 'parsePacketv21', 'parsePacketStream', 
-           '__version__', '__all__']
+__version__ = '0.3'
+__all__ = ['SENSOR_FIELDS', 'DERIVED_FIELDS', 'computeChecksum', 'parsePacketv21', 
+           'getSensorKey', 'parsePacketStream', '__version__', '__all__']
 
 
 # Setup the logger
 parserLogger = logging.getLogger('__main__')
 
 
+# Fields in the parsePacketStream() output that come from each sensor
+SENSOR_FIELDS = {'BHTR968': ('indoorTemperature', 'indoorHumidity', 'indoorDewpoint', 
+                             'pressure', 'comfortLevel', 'forecast'), 
+                 'RGR968':  ('rainrate', 'rainfall'), 
+                 'WGR968':  ('average', 'gust', 'direction', 'gustDirection'), 
+                 'THGR268': ('altTemperature', 'altHumidity', 'altDewpoint'), 
+                 'THGR968': ('temperature', 'humidity', 'dewpoint')}
+
+# Fields in the parsePacketStream() output that are computed from the values
+# of other fields
+DERIVED_FIELDS = {'windchill': ('temperature', 'average'), 
+                  'rollingGust': ('gust',), 
+                  'rollingGustDirection': ('gust',), 
+                  'rollingAverage': ('average',), 
+                  'rollingDirection': ('average',), 
+                  'rainfall15min': ('rainfall',), 
+                  'rainfallHour': ('rainfall',), 
+                  'rainfall24hr': ('rainfall',), 
+                  'rainfallDay': ('rainfall',), 
+                  'rainrateInstant': ('rainfall',), 
+                  'pressureTendency1hr': ('pressure',), 
+                  'pressureTendency3hr': ('pressure',), 
+                  'pressureTrend': ('pressure',)}
+
+
 def computeChecksum(bits):
 	"""
 	Compute the byte-based checksum for a sequence of bits.
@@ -259,9 +284,29 @@ def parsePacketv21(packet, wxData=None):
 	return True, nm, channel, output
 
 
+def getSensorKey(packet):
+	"""
+	Given a type,payload[,timestamp] packet from read433, return the sensor
+	name and channel of a valid Oregon Scientific packet as a string, i.e.,
+	'THGR268-1', or None if the packet is not valid.
+	"""
+	
+	if packet[0] != 'OSV2':
+		return None
+		
+	try:
+		valid, sensorName, channel, sensorData = parsePacketv21(packet[1])
+	except (IndexError, ValueError):
+		return None
+	if not valid:
+		return None
+		
+	return '%s-%i' % (sensorName, channel)
+
+
 def parsePacketStream(packets, elevation=0.0, inputDataDict=None):
 	"""
-	Given a sequence of two-element type,payload packets from read433, 
+	Given a sequence of type,payload[,timestamp] packets from read433, 
 	find all of the Oregon Scientific sensor values and return the data 
 	as a dictionary.  In the process, compute various derived quantities 
 	(dew point, windchill, and sea level correctedpressure).
@@ -280,7 +325,8 @@ def parsePacketStream(packets, elevation=0.0, inputDataDict=None):
 	# Parse the packet payload and save the output
 	gspd = []
 	gdir = []
-	for pType,pPayload in packets:
+	for packet in packets:
+		pType, pPayload = packet[0], packet[1]
 		if pType == 'OSV2':
 			valid, sensorName, channel, sensorData = parsePacketv21(pPayload)
 		else:
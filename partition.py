@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module for reading and writing the compressed, column-oriented monthly
+partition files used to hold old data that has been moved out of the
+sqlite3 database.
+"""
+
+import os
+import json
+import math
+import zlib
+import struct
+import logging
+
+__version__ = "0.1"
+__all__ = ["PARTITION_PATH", "getPartitionName", "listPartitions", "writePartition",
+		   "readPartition", "bucketColumns", "__version__", "__all__"]
+
+
+# Logger instance
+partLogger = logging.getLogger('__main__')
+
+
+# Files
+## Base path for the partition files
+PARTITION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive', 'partitions')
+
+## Magic string for identifying partition files
+_MAGIC = 'WXPIPART1\n'
+
+
+def getPartitionName(year, month, path=PARTITION_PATH):
+	"""
+	Return the filename of the partition for the specified year and month.
+	"""
+	
+	return os.path.join(path, 'wx-%04i-%02i.part' % (year, month))
+
+
+def listPartitions(path=PARTITION_PATH):
+	"""
+	Return a sorted list of (year, month, filename) tuples for all of the
+	partitions in the specified directory.
+	"""
+	
+	partitions = []
+	try:
+		filenames = os.listdir(path)
+	except OSError:
+		filenames = []
+		
+	for filename in filenames:
+		if filename[:3] != 'wx-' or filename[-5:] != '.part':
+			continue
+		try:
+			year, month = [int(v) for v in filename[3:-5].split('-', 1)]
+		except ValueError:
+			continue
+		partitions.append( (year, month, os.path.join(path, filename)) )
+	partitions.sort()
+	
+	return partitions
+
+
+def _encodeColumn(values):
+	"""
+	Delta encode and compress a list of numeric values.  Floating point
+	values are stored as integers in units of 0.001 and None is stored as
+	the standard -99 missing value.  Returns the scale factor and the
+	compressed data.
+	"""
+	
+	# Figure out if we can store the values as-is
+	scale = 1
+	for value in values:
+		if value is not None and value != int(value):
+			scale = 1000
+			break
+			
+	# Delta encode
+	deltas = []
+	last = 0
+	for value in values:
+		if value is None:
+			value = -99
+		value = int(round(value*scale))
+		deltas.append( value - last )
+		last = value
+		
+	return scale, zlib.compress(struct.pack('<%iq' % len(deltas), *deltas), 9)
+
+
+def _decodeColumn(scale, data, count):
+	"""
+	Undo _encodeColumn() and return a list of values.
+	"""
+	
+	deltas = struct.unpack('<%iq' % count, zlib.decompress(data))
+	
+	values = []
+	last = 0
+	for delta in deltas:
+		last += delta
+		values.append( last if scale == 1 else float(last)/scale )
+		
+	return values
+
+
+def writePartition(filename, rows):
+	"""
+	Given a filename and a list of row dictionaries from the wx table,
+	write a compressed column-oriented partition file.  The rows are
+	sorted by dateTime before they are written.  The file is written
+	to a temporary file and then renamed so that a partition is never
+	left half written.
+	"""
+	
+	# Sort and extract the columns
+	rows = sorted(rows, key=lambda x: x['dateTime'])
+	columns = sorted(rows[0].keys())
+	columns.remove('dateTime')
+	columns.insert(0, 'dateTime')
+	
+	# Encode
+	header = {'columns': columns, 'count': len(rows),
+			  'tStart': rows[0]['dateTime'], 'tStop': rows[-1]['dateTime'],
+			  'scales': [], 'sizes': []}
+	blobs = []
+	for column in columns:
+		scale, blob = _encodeColumn([row[column] for row in rows])
+		header['scales'].append( scale )
+		header['sizes'].append( len(blob) )
+		blobs.append( blob )
+		
+	# Write
+	path = os.path.dirname(filename)
+	if not os.path.exists(path):
+		os.makedirs(path)
+	fh = open(filename+'.tmp', 'wb')
+	fh.write(_MAGIC)
+	fh.write(json.dumps(header)+'\n')
+	for blob in blobs:
+		fh.write(blob)
+	fh.flush()
+	os.fsync(fh.fileno())
+	fh.close()
+	os.rename(filename+'.tmp', filename)
+	
+	partLogger.info('Wrote %i rows to partition \'%s\'', len(rows), os.path.basename(filename))
+	
+	return True
+
+
+def readPartition(filename, columns=None, tStart=None, tStop=None):
+	"""
+	Read in a partition file and return a list of row dictionaries.  Only
+	the columns requested (plus dateTime) are decompressed.  If tStart
+	and/or tStop are provided, only rows with tStart <= dateTime < tStop
+	are returned.
+	"""
+	
+	fh = open(filename, 'rb')
+	if fh.readline() != _MAGIC:
+		fh.close()
+		raise RuntimeError("Invalid partition file '%s'" % os.path.basename(filename))
+	header = json.loads(fh.readline())
+	data = fh.read()
+	fh.close()
+	
+	# Decode the columns that we need
+	if columns is None:
+		columns = header['columns']
+	values = {}
+	offset = 0
+	for column,scale,size in zip(header['columns'], header['scales'], header['sizes']):
+		if column == 'dateTime' or column in columns:
+			values[column] = _decodeColumn(scale, data[offset:offset+size], header['count'])
+		offset += size
+		
+	# Convert to rows
+	rows = []
+	for i,t in enumerate(values['dateTime']):
+		if tStart is not None and t < tStart:
+			continue
+		if tStop is not None and t >= tStop:
+			break
+		row = {}
+		for column in values.keys():
+			row[column] = values[column][i]
+		rows.append( row )
+		
+	return rows
+
+
+def bucketColumns(rows, columns, tStart, width, vectors={}):
+	"""
+	Given a list of row dictionaries, a list of columns, a start time, and
+	a bucket width in seconds, compute the per-bucket count, mean, minimum,
+	and maximum of each column the same way Archive.getHistory() does in
+	the database.  Direction columns listed in vectors, a dictionary of 
+	direction column -> speed column, are instead accumulated as the count,
+	the speed-weighted vector sum, and the unit vector sum.  Returns a 
+	dictionary of bucket number -> bucket dictionary.
+	"""
+	
+	buckets = {}
+	for row in rows:
+		b = (int(row['dateTime']) - tStart) / width
+		try:
+			bucket = buckets[b]
+		except KeyError:
+			bucket = {'dateTime': 0, 'n': 0}
+			for column in columns:
+				if column in vectors:
+					bucket[column] = [0, 0.0, 0.0, 0.0, 0.0]
+				else:
+					bucket[column] = [0, 0.0, None, None]
+			buckets[b] = bucket
+			
+		bucket['dateTime'] += row['dateTime']
+		bucket['n'] += 1
+		for column in columns:
+			value = row[column]
+			if value is None or value == -99:
+				continue
+			stats = bucket[column]
+			stats[0] += 1
+			if column in vectors:
+				theta = math.radians(value)
+				speed = row.get(vectors[column], 0.0)
+				if speed is None or speed < 0:
+					speed = 0.0
+				stats[1] += speed*math.sin(theta)
+				stats[2] += speed*math.cos(theta)
+				stats[3] += math.sin(theta)
+				stats[4] += math.cos(theta)
+				continue
+			stats[1] += value
+			stats[2] = value if stats[2] is None else min([stats[2], value])
+			stats[3] = value if stats[3] is None else max([stats[3], value])
+			
+	return buckets
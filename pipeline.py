@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module for building simple multi-threaded processing pipelines.
+"""
+
+import time
+import Queue
+import logging
+import threading
+import traceback
+
+__version__ = "0.2"
+__all__ = ["PipelineStage", "__version__", "__all__"]
+
+
+# Logger instance
+pipeLogger = logging.getLogger('__main__')
+
+
+class PipelineStage(object):
+	"""
+	Class for running one stage of a pipeline in its own thread.  Each
+	stage has a bounded input queue and a worker function that is called
+	with every item taken from the queue.  If the worker returns something
+	other than None, that is passed along to all of the stages connected
+	to this one via connect().
+	
+	Adding an item to a stage never blocks.  If the input queue is full the
+	oldest item is dropped to make room so that an upstream stage is never
+	held up by a slow downstream one.  Stages that must not lose anything,
+	i.e., the archive, can be made lossless and then the input queue is
+	unbounded and maxsize is only the backlog at which to start warning.
+	Lossless stages also work through anything still queued when they are
+	cancelled so stages should be cancelled from upstream to downstream.
+	"""
+	
+	def __init__(self, name, worker, maxsize=4, lossless=False):
+		self.name = name
+		self.worker = worker
+		self.maxsize = maxsize
+		self.lossless = lossless
+		self.input = Queue.Queue(0 if lossless else maxsize)
+		self.outputs = []
+		
+		self._stats = {'processed': 0, 'dropped': 0, 'errors': 0,
+					   'lastLatency': 0.0, 'maxLatency': 0.0, 'meanLatency': 0.0,
+					   'lastWait': 0.0}
+					
+		self.thread = None
+		self.alive = threading.Event()
+		
+	def connect(self, *stages):
+		"""
+		Send the output of this stage to the specified stages.
+		"""
+		
+		self.outputs.extend(stages)
+		
+	def start(self):
+		if self.thread is not None:
+			self.cancel()
+			
+		self.thread = threading.Thread(target=self.run, name=self.name)
+		self.thread.setDaemon(1)
+		self.alive.set()
+		self.thread.start()
+		
+		pipeLogger.info('Started the %s pipeline stage', self.name)
+		
+	def cancel(self):
+		if self.thread is not None:
+			self.alive.clear()          # clear alive event for thread
+			self.thread.join()
+			self.thread = None
+			
+		pipeLogger.info('Stopped the %s pipeline stage', self.name)
+		
+	def put(self, item):
+		"""
+		Add an item to the input queue, dropping the oldest item if the queue
+		is full and the stage is not lossless.
+		"""
+		
+		if self.lossless:
+			self.input.put( (time.time(), item) )
+			if self.maxsize > 0 and self.input.qsize() > self.maxsize:
+				pipeLogger.warning('Pipeline stage %s is backed up, %i items waiting', self.name, self.input.qsize())
+			return
+			
+		while True:
+			try:
+				self.input.put_nowait( (time.time(), item) )
+				break
+			except Queue.Full:
+				try:
+					self.input.get_nowait()
+					self._stats['dropped'] += 1
+					pipeLogger.warning('Pipeline stage %s is backed up, dropped an item', self.name)
+				except Queue.Empty:
+					pass
+					
+	def getStats(self):
+		"""
+		Return a dictionary of statistics for this stage:  the current backlog,
+		the number of items processed, dropped, and failed, and the worker
+		latency and queue wait time in seconds.
+		"""
+		
+		stats = self._stats.copy()
+		stats['backlog'] = self.input.qsize()
+		return stats
+		
+	def _process(self, tQueued, item):
+		"""
+		Run the worker on a single item, update the statistics, and pass the
+		output along.
+		"""
+		
+		t0 = time.time()
+		try:
+			output = self.worker(item)
+		except Exception, e:
+			self._stats['errors'] += 1
+			pipeLogger.error('Pipeline stage %s failed: %s', self.name, str(e))
+			for line in traceback.format_exc().split('\n'):
+				pipeLogger.debug("%s", line)
+			output = None
+		t1 = time.time()
+		
+		## Update the statistics
+		latency = t1 - t0
+		self._stats['processed'] += 1
+		self._stats['lastLatency'] = latency
+		self._stats['maxLatency'] = max([self._stats['maxLatency'], latency])
+		self._stats['meanLatency'] += (latency - self._stats['meanLatency']) / self._stats['processed']
+		self._stats['lastWait'] = t0 - tQueued
+		
+		## Pass it along
+		if output is not None:
+			for stage in self.outputs:
+				stage.put(output)
+				
+	def run(self):
+		while self.alive.isSet():
+			try:
+				tQueued, item = self.input.get(timeout=1.0)
+			except Queue.Empty:
+				continue
+			self._process(tQueued, item)
+			
+		# Lossless stages finish what is already queued before they stop
+		if self.lossless:
+			nLeft = self.input.qsize()
+			if nLeft > 0:
+				pipeLogger.info('Pipeline stage %s is finishing %i queued items', self.name, nLeft)
+			while True:
+				try:
+					tQueued, item = self.input.get_nowait()
+				except Queue.Empty:
+					break
+				self._process(tQueued, item)
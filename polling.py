@@ -4,6 +4,8 @@
 Module for polling the various sensors.
 """
 
+import copy
+import math
 import time
 import logging
 import threading
@@ -16,9 +18,15 @@ from datetime import datetime, timedelta
 
 from decoder import read433
 from parser import parsePacketStream
-from utils import computeDewPoint, computeSeaLevelPressure, wuUploader
+from utils import computeDewPoint, computeSeaLevelPressure
+from pipeline import PipelineStage
+from scheduler import sleepUntil, CycleScheduler, TransmitTracker
+from uploader import initPublishers, RealtimeWUPublisher
+from sampling import SensorSampler, initSamplers
+from state import FreshnessTracker
+from aggregates import WIND_FIELDS, RAIN_FIELDS, PRESSURE_FIELDS, WindAggregator, RainAggregator, PressureTendency, ArchiveAccumulator
 
-from sensors.bmpBackend import BMP085
+from sensors.bmpBackend import getBMP085
 
 __version__ = "0.1"
 __all__ = ["PollingProcessor", "__version__", "__all__"]
@@ -31,24 +39,122 @@ pollLogger = logging.getLogger('__main__')
 class PollingProcessor(threading.Thread):
 	"""
 	Class responsible to running the various zones according to the schedule.
+	
+	The work is split into a pipeline of stages that each run in their own 
+	thread and are joined by queues:
+	  1) capture - read from the 433 MHz radio
+	  2) parse - decode the packets, merge in the BMP085/180 values, and 
+	     update the current conditions
+	  3) archive - combine the current conditions into one entry per archive
+	     interval and save it to the archive
+	  4) upload - publish the current conditions to WUnderground and the
+	     other enabled destinations
+	This keeps the radio from ever having to wait on the network or the disk.
+	The parse and archive stages never drop anything while the upload and 
+	realtime stages drop the oldest item if they fall behind.
+	The BMP085/180 and any sensors from sensors/ listed in the configuration
+	are sampled by a small thread pool while the radio is capturing and the
+	averages are merged in by the parse stage.
+	The parse stage also keeps track of which sensor each value came from and
+	drops the values from sensors that have not reported recently, so that 
+	they show up as missing in the archive and are not uploaded.
+	If real-time uploads are enabled there is also a realtime stage that is
+	fed each packet as it arrives.
+	Captures start on wall clock boundaries and, if adaptive capture is 
+	enabled, the radio only listens around the times each sensor is expected
+	to transmit.
 	"""
-
-	def __init__(self, config, db, leds, buildState=False, loopsForState=1, sensorData={}):
+	
+	def __init__(self, config, db, leds, state, sensorData={}, checkpoint=None):
 		threading.Thread.__init__(self)
 		self.config = config
 		self.db = db
 		self.leds = leds
-		self.buildState = buildState
-		self.loopsForState = loopsForState
+		self.state = state
+		self.checkpoint = checkpoint
 		self.sensorData = sensorData
 		
+		self.stages = {'parse': PipelineStage('parser', self._parse, lossless=True), 
+					   'archive': PipelineStage('archiver', self._archive, lossless=True), 
+					   'upload': PipelineStage('uploader', self._upload)}
+		self.stages['parse'].connect(self.stages['archive'], self.stages['upload'])
+		self._captureStats = {'processed': 0, 'lastLatency': 0.0}
+		self.scheduler = CycleScheduler(period=self.config.getfloat('Station', 'duration'))
+		self.tracker = TransmitTracker(margin=self.config.getfloat('Station', 'capturemargin'), 
+									   fullScanEvery=self.config.getint('Station', 'fullscanevery'))
+		self._i2cStats = {'transactions': 0}
+		
+		self.publishers = initPublishers(self.config, archive=self.db)
+		self.publishers.setCallback(self._uploadCallback)
+		
+		## Real-time uploads as packets arrive - if needed
+		self.realtime = None
+		if self.config.getbool('Upload', 'realtime'):
+			self.realtime = RealtimeWUPublisher(self.config.get('Account', 'id'), 
+												self.config.get('Account', 'password'), 
+												rtfreq=self.config.getfloat('Upload', 'rtfreq'), 
+												window=self.config.getint('Upload', 'rtwindow'), 
+												timeout=self.config.getfloat('Upload', 'timeout'))
+			self.stages['realtime'] = PipelineStage('realtime', self._realtime, maxsize=16)
+		self._rtData = copy.deepcopy(sensorData)
+		
+		## Sensors that are sampled while the radio is capturing
+		self.samplers = initSamplers(self.config)
+		if self.config.getbool('Station', 'enablebmp085'):
+			self.samplers.add( SensorSampler('bmp085', self._readBMP085, 
+										 interval=self.config.getfloat('Station', 'sampleinterval')) )
+		
+		## Rolling wind statistics
+		self.wind = WindAggregator(gustWindow=self.config.getfloat('Station', 'gustwindow'), 
+								   averageWindow=self.config.getfloat('Station', 'windwindow'))
+		if self.checkpoint is not None:
+			self.wind.observe(self.checkpoint.getPackets())
+			
+		## Rainfall totals and rate - seeded with the last day from the 
+		## archive
+		self.rain = RainAggregator()
+		try:
+			for tRain,rainfall in self.db.getSeries('rainfall', time.time()-86400):
+				self.rain.add(tRain, rainfall)
+		except Exception, e:
+			pollLogger.warning('Cannot load the rainfall history: %s', str(e))
+			
+		## Pressure tendency - seeded with the last three hours from the 
+		## archive
+		self.pressure = PressureTendency()
+		try:
+			for tPressure,pressure in self.db.getSeries('pressure', time.time()-10800):
+				self.pressure.add(tPressure, pressure)
+		except Exception, e:
+			pollLogger.warning('Cannot load the pressure history: %s', str(e))
+			
+		## Combines the cycles into archive entries
+		self.accumulator = ArchiveAccumulator(interval=self.config.getfloat('Archive', 'interval'))
+		
+		## Where each value came from and when - anything that we start with
+		## needs to be refreshed by a sensor before its time-to-live is up
+		ttls = dict(self.config.items('Freshness'))
+		self.freshness = FreshnessTracker(ttls=ttls, defaultTTL=ttls.pop('default', 300.0))
+		self.freshness.updateFromData('startup', self.sensorData, time.time())
+		if self.checkpoint is not None:
+			self.freshness.observe(self.checkpoint.getPackets())
+			
+		self._tLastUpdate = 0.0
+		
 		self.thread = None
 		self.alive = threading.Event()
 		
 	def start(self):
 		if self.thread is not None:
 			self.cancel()
-        	       
+			
+		self.publishers.start()
+		self.samplers.start()
+		if self.realtime is not None:
+			self.realtime.start()
+		for name in self.stages.keys():
+			self.stages[name].start()
+			
 		self.thread = threading.Thread(target=self.run, name='poller')
 		self.thread.setDaemon(1)
 		self.alive.set()
@@ -61,95 +167,270 @@ class PollingProcessor(threading.Thread):
 			self.alive.clear()          # clear alive event for thread
 			self.thread.join()
 			
+		## Upstream to downstream so that what the lossless stages flush out
+		## still has somewhere to go
+		for name in ('parse', 'archive', 'upload', 'realtime'):
+			if name in self.stages:
+				self.stages[name].cancel()
+		self.publishers.cancel()
+		self.samplers.cancel()
+		if self.realtime is not None:
+			self.realtime.cancel()
+		if self.checkpoint is not None:
+			self.checkpoint.save(force=True)
+			
 		pollLogger.info('Stopped the PollingProcessor background thread')
 		
-	def run(self):
-		tLastUpdate = 0.0
-		sensorData = self.sensorData
+	def getStats(self):
+		"""
+		Return a dictionary of per-stage latency and backlog statistics.
+		"""
 		
-		while self.alive.isSet():
-			## Begin the loop
-			t0 = time.time()
+		stats = {'capture': self._captureStats.copy(), 'i2c': self._i2cStats.copy(), 
+				 'samplers': self.samplers.getStats(), 
+				 'scheduler': self.scheduler.getStats(), 
+				 'tracker': self.tracker.getStats()}
+		for name in self.stages.keys():
+			stats[name] = self.stages[name].getStats()
+		stats['publishers'] = self.publishers.getStats()
+		if self.realtime is not None:
+			stats['publishers']['rapidfire'] = self.realtime.getStats()
+		return stats
+		
+	def _archiveCallback(self, seq, success):
+		if not success:
+			pollLogger.error('Failed to save entry %i to the archive', seq)
 			
-			## Load in the current configuration
-			wuID = self.config.get('Account', 'id')
-			wuPW = self.config.get('Account', 'password')
+	def _uploadCallback(self, name, tData, success):
+		if success:
+			pollLogger.info('Posted data to %s', name)
+			led = self.leds['green']
+		else:
+			pollLogger.error('Failed to post data to %s', name)
+			led = self.leds['red']
+			
+		## Blink for a bit without holding up the publisher - WUnderground only
+		if name == 'wunderground':
+			led.blink()
+			timer = threading.Timer(3, led.blink)
+			timer.setDaemon(1)
+			timer.start()
 			
+	def _readBMP085(self):
+		"""
+		Read the temperature and station pressure from the BMP085/180.
+		"""
+		
+		ps = getBMP085(address=0x77, mode=3)
+		nTransactions = ps.getTransactionCount()
+		temperature, pressure = ps.readTemperatureAndPressure()
+		self._i2cStats['transactions'] = ps.getTransactionCount() - nTransactions
+		
+		return {'pressure': pressure / 100.0, 'indoorTemperature': temperature}
+		
+	def _packetCallback(self, packet):
+		"""
+		Called by read433 with each packet as it is received.  This needs to 
+		be quick so the packet is just handed off to the real-time stage.
+		"""
+		
+		self.stages['realtime'].put(packet)
+		
+	def _realtime(self, packet):
+		"""
+		Real-time stage - decode a single packet and send any fields that 
+		changed to the RapidFire publisher, using the time the packet was 
+		received as the start of the upload latency.
+		"""
+		
+		elevation = self.config.getfloat('Station', 'elevation')
+		
+		self._rtData = parsePacketStream([packet,], elevation=elevation, 
+										 inputDataDict=self._rtData)
+		self.realtime.put(packet[2], self._rtData)
+		
+	def _parse(self, item):
+		"""
+		Parse stage - decode the packets from a capture window, merge in the 
+		BMP085/180 values, and update the current conditions.  Returns the 
+		timestamp and a copy of the current conditions.
+		"""
+		
+		tData, packets = item
+		
+		elevation = self.config.getfloat('Station', 'elevation')
+		enableBMP085 = self.config.getbool('Station', 'enablebmp085')
+		
+		## Process the received packets and update the internal state
+		self.leds['yellow'].on()
+		sensorData = parsePacketStream(packets, elevation=elevation, 
+										inputDataDict=self.sensorData)
+		if self.checkpoint is not None:
+			self.checkpoint.update(packets)
+			self.checkpoint.save()
+		self.leds['yellow'].off()
+		
+		# Merge in the BMP085/180 values averaged over the capture window - 
+		# if needed.  Samplers without any new samples do not report 
+		# anything so that their old values can age out.
+		collected = self.samplers.collect()
+		bmp = collected.get('bmp085', {}) if enableBMP085 else {}
+		if 'pressure' in bmp:
+			self.leds['yellow'].on()
+			sensorData['pressure'] = computeSeaLevelPressure(bmp['pressure'], elevation)
+			if 'indoorHumidity' in sensorData.keys():
+				sensorData['indoorTemperature'] = bmp['indoorTemperature']
+				sensorData['indoorDewpoint'] = computeDewPoint(sensorData['indoorTemperature'], sensorData['indoorHumidity'])
+			self.leds['yellow'].off()
+			
+		# Merge in the values from the other sensors, leaving alone anything 
+		# the BMP085/180 just provided
+		for name,values in collected.iteritems():
+			if name == 'bmp085' and enableBMP085:
+				continue
+			for key,value in values.iteritems():
+				if key not in bmp:
+					sensorData[key] = value
+			
+		# Update the rolling wind statistics
+		self.wind.observe(packets)
+		for key in WIND_FIELDS:
+			try:
+				del sensorData[key]
+			except KeyError:
+				pass
+		sensorData.update( self.wind.getData(tData) )
+		
+		# Update the rainfall totals and rate
+		self.rain.observe(packets)
+		for key in RAIN_FIELDS:
+			try:
+				del sensorData[key]
+			except KeyError:
+				pass
+		sensorData.update( self.rain.getData(tData) )
+		
+		# Update the pressure tendency from whichever sensor is providing 
+		# the pressure
+		if 'pressure' in bmp:
+			self.pressure.add(tData, sensorData['pressure'])
+		else:
+			self.pressure.observe(packets, elevation=elevation)
+		for key in PRESSURE_FIELDS:
+			try:
+				del sensorData[key]
+			except KeyError:
+				pass
+		sensorData.update( self.pressure.getData(tData) )
+		self.sensorData = sensorData
+		
+		## Update where each value came from and drop the values from any 
+		## sensors that have stopped reporting
+		self.freshness.observe(packets)
+		samplerStats = self.samplers.getStats()
+		for name,values in collected.iteritems():
+			self.freshness.update(name, values.keys(), samplerStats[name]['lastSample'])
+		self.freshness.expire(tData)
+		sensorData, stale = self.freshness.filter(sensorData)
+		if len(stale) > 0:
+			pollLogger.warning('Dropping stale values for: %s', ', '.join(sorted(stale)))
+			
+		## Share the current conditions
+		self.state.publish(tData, sensorData)
+		self.state.setStatus('pipeline', self.getStats())
+		self.state.setStatus('freshness', self.freshness.describe())
+		
+		return tData, sensorData
+		
+	def _archive(self, item):
+		"""
+		Archive stage - combine the current conditions into an entry for the
+		current archive interval and save any entries that are complete to 
+		the archive.
+		"""
+		
+		tData, sensorData = item
+		
+		self.accumulator.interval = self.config.getfloat('Archive', 'interval')
+		
+		## Check if there is anything to update in the archive
+		self.leds['yellow'].on()
+		for tRecord,record in self.accumulator.add(tData, sensorData):
+			self.db.writeDataAsync(tRecord, record, callback=self._archiveCallback)
+			pollLogger.info('Saving archive entry for %s', datetime.fromtimestamp(tRecord).strftime("%Y-%m-%d %H:%M:%S"))
+		pollLogger.debug('Archive write queue depth is %i', self.db.getWriteStats()['depth'])
+		self.leds['yellow'].off()
+		
+	def _upload(self, item):
+		"""
+		Upload stage - hand the current conditions off to the publishers.
+		"""
+		
+		tData, sensorData = item
+		
+		## Queue the results for publishing
+		if tData != self._tLastUpdate:
+			self.publishers.publish(tData, sensorData)
+			self._tLastUpdate = 1.0*tData
+			
+		else:
+			pollLogger.warning('Data timestamp has not changed since last poll, upload skipped')
+			
+	def run(self):
+		while self.alive.isSet():
+			## Load in the current configuration
 			radioPin = self.config.getint('Station', 'radiopin')
 			duration = self.config.getfloat('Station', 'duration')
-			elevation = self.config.getfloat('Station', 'elevation')
-			enableBMP085 = self.config.getbool('Station', 'enablebmp085')
-			includeIndoor = self.config.getbool('Station', 'includeindoor')
 			
-			## Read from the 433 MHz radio
-			for i in xrange(self.loopsForState):
-				self.leds['red'].on()
-				tData = time.time() + int(round(duration-5))/2.0
-				packets = read433(radioPin, int(round(duration-5)))
-				self.leds['red'].off()
+			## Wait for the start of the next cycle
+			self.scheduler.period = duration
+			tStart, tStop = self.scheduler.nextCycle()
+			self.scheduler.waitUntil(tStart, alive=self.alive)
+			if not self.alive.isSet():
+				break
 				
-				## Process the received packets and update the internal state
-				self.leds['yellow'].on()
-				sensorData = parsePacketStream(packets, elevation=elevation, 
-												inputDataDict=sensorData)
-				self.leds['yellow'].off()
+			## Work out when to listen during the cycle - either the whole 
+			## cycle or just around the expected sensor transmissions
+			windows = None
+			if self.config.getbool('Station', 'adaptivecapture'):
+				windows = self.tracker.plan(tStart, tStop)
+			if windows is None:
+				windows = [(tStart, tStop),]
 				
-				# Poll the BMP085/180 - if needed
-				if enableBMP085:
-					self.leds['red'].on()
-					ps = BMP085(address=0x77, mode=3)
-					pressure = ps.readPressure() / 100.0
-					temperature = ps.readTemperature()
-					self.leds['red'].off()
-			
-					self.leds['yellow'].on()
-					sensorData['pressure'] =  pressure
-					sensorData['pressure'] = computeSeaLevelPressure(sensorData['pressure'], elevation)
-					if 'indoorHumidity' in sensorData.keys():
-						sensorData['indoorTemperature'] = ps.readTemperature()
-						sensorData['indoorDewpoint'] = computeDewPoint(sensorData['indoorTemperature'], sensorData['indoorHumidity'])
-					self.leds['yellow'].off()
+			## Read from the 433 MHz radio.  The data are timestamped with the
+			## end of the cycle.
+			t0 = time.time()
+			tData = tStop
+			packets = []
+			listened = 0.0
+			for wStart,wStop in windows:
+				sleepUntil(wStart, alive=self.alive)
+				if not self.alive.isSet():
+					break
 					
-			## Have we built up the state?
-			if self.buildState:
-				self.loopsForState = 1
-				
-			## Check if there is anything to update in the archive
-			self.leds['yellow'].on()
-			if tData != tLastUpdate:
-				self.db.writeData(tData, sensorData)
-				pollLogger.info('Saving current state to archive')
-			else:
-				pollLogger.warning('Data timestamp has not changed since last poll, archiving skipped')
-			self.leds['yellow'].off()
-			
-			## Post the results to WUnderground
-			if tData != tLastUpdate:
-				uploadStatus = wuUploader(wuID, wuPW, 
-											tData, sensorData, archive=self.db, 
-											includeIndoor=includeIndoor)
-											
-				if uploadStatus:
-					tLastUpdate = 1.0*tData
+				### read433 works in whole seconds
+				window = int(wStop - math.floor(time.time()))
+				if window < 1:
+					continue
 					
-					pollLogger.info('Posted data to WUnderground')
-					self.leds['green'].blink()
-					time.sleep(3)
-					self.leds['green'].blink()
+				tListen = time.time()
+				self.leds['red'].on()
+				if self.realtime is not None:
+					packets.extend( read433(radioPin, window, callback=self._packetCallback) )
 				else:
-					pollLogger.error('Failed to post data to WUnderground')
-					self.leds['red'].blink()
-					time.sleep(3)
-					self.leds['red'].blink()
-					
-			else:
-				pollLogger.warning('Data timestamp has not changed since last poll, archiving skipped')
+					packets.extend( read433(radioPin, window) )
+				self.leds['red'].off()
+				listened += time.time() - tListen
 				
-			## Done
-			t1 = time.time()
-			tSleep = duration - (t1-t0)
-			tSleep = tSleep if tSleep > 0 else 0
+			if not self.alive.isSet():
+				break
+			self.tracker.observe(packets)
+			self.tracker.record(listened, tStop - tStart)
 			
-			## Sleep
-			time.sleep(tSleep)
-			
\ No newline at end of file
+			## Hand the packets off to the rest of the pipeline
+			self.stages['parse'].put( (tData, packets) )
+			
+			t1 = time.time()
+			self._captureStats['processed'] += 1
+			self._captureStats['lastLatency'] = t1 - t0
+			pollLogger.debug('Pipeline status: %s', str(self.getStats()))
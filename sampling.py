@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module for sampling sensors in the background and averaging the results.
+"""
+
+import time
+import Queue
+import logging
+import threading
+import traceback
+
+__version__ = "0.3"
+__all__ = ["PLUGINS", "SensorSampler", "SamplerGroup", "initSamplers",
+		   "__version__", "__all__"]
+
+
+# Logger instance
+sampLogger = logging.getLogger('__main__')
+
+
+# Sensor plugins from sensors/ that can be used in the configuration file
+PLUGINS = {'Analogue': ('sensors.analogue', 'Analogue'),
+		   'BMP085':   ('sensors.bmp085',   'BMP085'),
+		   'DHT22':    ('sensors.dht22',    'DHT22'),
+		   'MCP3008':  ('sensors.mcp3008',  'MCP3008')}
+
+
+class SensorSampler(object):
+	"""
+	Class for sampling a sensor on its own schedule.  The reader function is
+	called every interval seconds by a SamplerGroup and should return a
+	dictionary of values.  The values are accumulated until collect() is
+	called, which returns their averages.  This lets slow sensors, like the
+	BMP085 with its 26 ms conversion time, be oversampled while the radio is
+	capturing data.
+	
+	If a call to the reader takes longer than timeout seconds its result is
+	thrown away and the sensor is not read again until that call returns.
+	"""
+	
+	def __init__(self, name, reader, interval=5.0, timeout=None):
+		self.name = name
+		self.reader = reader
+		self.interval = float(interval)
+		if timeout is None:
+			timeout = self.interval
+		self.timeout = float(timeout)
+		
+		self._lock = threading.Lock()
+		self._sums = {}
+		
+		self._call = 0
+		self._busy = False
+		self._expired = False
+		self._tStart = 0.0
+		self.tNext = 0.0
+		
+		self._stats = {'samples': 0, 'errors': 0, 'timeouts': 0, 'skipped': 0,
+					   'lastLatency': 0.0, 'lastSample': 0.0}
+					
+	def collect(self):
+		"""
+		Return a dictionary of the average of each value since the last
+		call.  If there have not been any new samples an empty dictionary is
+		returned so that a sensor that stops responding does not look like 
+		it is still reporting.
+		"""
+		
+		self._lock.acquire()
+		output = {}
+		for key,(n,total) in self._sums.iteritems():
+			output[key] = total / n
+		self._sums = {}
+		self._lock.release()
+		
+		return output
+		
+	def getStats(self):
+		"""
+		Return a dictionary of sampling statistics.
+		"""
+		
+		stats = self._stats.copy()
+		stats['busy'] = self._busy
+		return stats
+		
+	def begin(self):
+		"""
+		Mark the start of a call to the reader and return a token for it, or
+		None if the previous call has not returned yet.
+		"""
+		
+		self._lock.acquire()
+		if self._busy:
+			self._stats['skipped'] += 1
+			token = None
+		else:
+			self._call += 1
+			self._busy = True
+			self._expired = False
+			self._tStart = time.time()
+			token = self._call
+		self._lock.release()
+		
+		return token
+		
+	def expire(self, tNow=None):
+		"""
+		Check whether or not the current call to the reader has timed out.
+		"""
+		
+		if tNow is None:
+			tNow = time.time()
+			
+		self._lock.acquire()
+		if self._busy and not self._expired and tNow - self._tStart > self.timeout:
+			self._expired = True
+			self._stats['timeouts'] += 1
+			sampLogger.warning('Sampling %s timed out after %.1f s', self.name, self.timeout)
+		self._lock.release()
+		
+	def sample(self, token=None):
+		"""
+		Read the sensor once and add the values to the running sums.
+		"""
+		
+		if token is None:
+			token = self.begin()
+			if token is None:
+				return False
+				
+		t0 = time.time()
+		try:
+			values = self.reader()
+		except Exception, e:
+			values = None
+			sampLogger.warning('Sampling %s failed: %s', self.name, str(e))
+			for line in traceback.format_exc().split('\n'):
+				sampLogger.debug("%s", line)
+		t1 = time.time()
+		
+		self._lock.acquire()
+		self._busy = False
+		self._stats['lastLatency'] = t1 - t0
+		if values is None:
+			self._stats['errors'] += 1
+		elif self._expired:
+			values = None
+		else:
+			for key,value in values.iteritems():
+				if value is None:
+					continue
+				try:
+					self._sums[key][0] += 1
+					self._sums[key][1] += value
+				except KeyError:
+					self._sums[key] = [1, float(value)]
+			self._stats['samples'] += 1
+			self._stats['lastSample'] = t1
+		self._lock.release()
+		
+		return (values is not None)
+
+
+class SamplerGroup(object):
+	"""
+	Class for sampling a collection of SensorSampler instances from a small
+	pool of worker threads.  A scheduler thread hands each sampler to the
+	pool when it is due and enforces the per-sampler timeouts so that a
+	sensor that stops responding only ever ties up one worker.
+	"""
+	
+	def __init__(self, samplers=[], poolSize=2):
+		self.samplers = list(samplers)
+		self.poolSize = int(poolSize)
+		
+		self.input = Queue.Queue()
+		
+		self.thread = None
+		self.workers = []
+		self.alive = threading.Event()
+		
+	def add(self, sampler):
+		self.samplers.append(sampler)
+		
+	def start(self):
+		if self.thread is not None:
+			self.cancel()
+			
+		self.alive.set()
+		for i in xrange(self.poolSize):
+			worker = threading.Thread(target=self._work, name='sampler%i' % i)
+			worker.setDaemon(1)
+			worker.start()
+			self.workers.append(worker)
+			
+		self.thread = threading.Thread(target=self.run, name='samplers')
+		self.thread.setDaemon(1)
+		self.thread.start()
+		
+		sampLogger.info('Started the SamplerGroup background threads')
+		
+	def cancel(self):
+		if self.thread is not None:
+			self.alive.clear()          # clear alive event for thread
+			self.thread.join()
+			self.thread = None
+			
+		## Don't wait on workers that are stuck reading a sensor
+		for worker in self.workers:
+			worker.join(1.0)
+		self.workers = []
+		
+		sampLogger.info('Stopped the SamplerGroup background threads')
+		
+	def collect(self):
+		"""
+		Return a dictionary of the averaged values from each sampler that 
+		has new samples since the last call, keyed by sampler name.
+		"""
+		
+		output = {}
+		for sampler in self.samplers:
+			values = sampler.collect()
+			if len(values) > 0:
+				output[sampler.name] = values
+		return output
+		
+	def getStats(self):
+		"""
+		Return a dictionary of sampling statistics for each sampler.
+		"""
+		
+		stats = {}
+		for sampler in self.samplers:
+			stats[sampler.name] = sampler.getStats()
+		stats['poolBacklog'] = self.input.qsize()
+		return stats
+		
+	def _work(self):
+		while self.alive.isSet():
+			try:
+				sampler, token = self.input.get(timeout=1.0)
+			except Queue.Empty:
+				continue
+				
+			sampler.sample(token)
+			
+	def run(self):
+		while self.alive.isSet():
+			tNow = time.time()
+			for sampler in self.samplers:
+				sampler.expire(tNow)
+				
+				if tNow >= sampler.tNext:
+					token = sampler.begin()
+					if token is not None:
+						self.input.put( (sampler, token) )
+						
+					sampler.tNext += sampler.interval
+					if sampler.tNext < tNow:
+						sampler.tNext = tNow + sampler.interval
+						
+			time.sleep(0.05)
+
+
+def _loadPlugin(name):
+	"""
+	Import a sensor plugin from sensors/ and return its class.
+	"""
+	
+	moduleName, className = PLUGINS[name]
+	module = __import__(moduleName, fromlist=[className,])
+	return getattr(module, className)
+
+
+def initSamplers(config):
+	"""
+	Given a LockingConfigParser configuration instance, create a
+	SamplerGroup with a SensorSampler for each of the sensor plugins in the
+	configuration.  Sensors are described by sections named 'Sensor <name>'
+	that contain:
+	  * plugin - name of the plugin in sensors/ to use
+	  * field - name to use for the value in the current conditions
+	    (defaults to <name>)
+	  * interval - seconds between samples
+	  * timeout - seconds to wait for a sample
+	along with any settings needed by the plugin itself, i.e., pinNumber.
+	"""
+	
+	group = SamplerGroup(poolSize=config.getint('Station', 'samplerthreads'))
+	
+	sections = [s for s in config.sections() if s.lower().startswith('sensor ')]
+	## The MCP3008 needs to be setup before any Analogue sensors
+	sections.sort(key=lambda x: 0 if config.has_option(x, 'plugin') and config.get(x, 'plugin') == 'MCP3008' else 1)
+	
+	for section in sections:
+		name = section.split(None, 1)[1]
+		
+		try:
+			plugin = config.get(section, 'plugin')
+			pluginClass = _loadPlugin(plugin)
+			
+			## ConfigParser lowercases everything so restore the case of the
+			## settings that the plugin is expecting
+			keys = {}
+			for key in pluginClass.requiredData + pluginClass.optionalData:
+				keys[key.lower()] = key
+			data = {}
+			for key,value in config.items(section):
+				if key in ('plugin', 'field', 'interval', 'timeout'):
+					continue
+				data[keys.get(key, key)] = value
+				
+			if plugin == 'Analogue':
+				mcpClass = _loadPlugin('MCP3008')
+				if mcpClass.sharedClass is None:
+					mcpClass({})
+			sensor = pluginClass(data)
+			
+		except Exception, e:
+			sampLogger.error('Cannot setup sensor \'%s\': %s', name, str(e))
+			for line in traceback.format_exc().split('\n'):
+				sampLogger.debug("%s", line)
+			continue
+			
+		## The MCP3008 is only used by the Analogue sensors
+		if plugin == 'MCP3008':
+			continue
+			
+		try:
+			field = config.get(section, 'field')
+		except Exception:
+			field = name
+		try:
+			interval = config.getfloat(section, 'interval')
+		except Exception:
+			interval = 60.0
+		try:
+			timeout = config.getfloat(section, 'timeout')
+		except Exception:
+			timeout = interval
+			
+		reader = lambda sensor=sensor, field=field: {field: sensor.getVal()}
+		group.add( SensorSampler(name, reader, interval=interval, timeout=timeout) )
+		sampLogger.info('Added %s sensor \'%s\' as \'%s\'', plugin, name, field)
+		
+	return group
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module for scheduling the polling cycles on wall clock boundaries and for
+working out when the radio needs to be listening during each cycle.
+"""
+
+import math
+import time
+import logging
+
+from parser import getSensorKey
+
+__version__ = "0.2"
+__all__ = ["sleepUntil", "CycleScheduler", "TransmitTracker", "__version__", "__all__"]
+
+
+# Logger instance
+schdLogger = logging.getLogger('__main__')
+
+
+def sleepUntil(t, alive=None):
+	"""
+	Sleep until the specified time, checking the optional threading.Event
+	every second to see if we should stop waiting.
+	"""
+	
+	while alive is None or alive.isSet():
+		tWait = t - time.time()
+		if tWait <= 0:
+			break
+		time.sleep(min([tWait, 1.0]))
+
+
+class CycleScheduler(object):
+	"""
+	Class for running cycles that start and stop on multiples of the period,
+	i.e., every full minute for a 60 s period, so that the cycle timing does
+	not drift.  Each call to nextCycle() returns the start and stop time of
+	the next cycle:
+	  * if the previous cycle ended on time the next one picks up where it
+	    left off,
+	  * if the previous cycle overran by no more than the tolerance the next
+	    cycle is shortened so that it still ends on a boundary, and
+	  * if the previous cycle overran by more than that the missed cycles are
+	    skipped and the next cycle starts on the next boundary.
+	"""
+	
+	def __init__(self, period=60.0, tolerance=5.0):
+		self.period = float(period)
+		self.tolerance = float(tolerance)
+		
+		self._tStop = None
+		
+		self._stats = {'cycles': 0, 'overruns': 0, 'compressed': 0, 'skipped': 0,
+					   'lastJitter': 0.0, 'maxJitter': 0.0, 'meanJitter': 0.0}
+					
+	def getStats(self):
+		"""
+		Return a dictionary of scheduling statistics.  The jitter is how far,
+		in seconds, after its scheduled time a cycle actually started.
+		"""
+		
+		return self._stats.copy()
+		
+	def getBoundary(self, t):
+		"""
+		Return the first boundary at or after the specified time.
+		"""
+		
+		return math.ceil(t / self.period) * self.period
+		
+	def nextCycle(self, tNow=None):
+		"""
+		Return the scheduled start and stop times for the next cycle.
+		"""
+		
+		if tNow is None:
+			tNow = time.time()
+			
+		if self._tStop is None:
+			## First cycle - wait for the first boundary
+			tStart = self.getBoundary(tNow)
+			
+		else:
+			tStart = self._tStop
+			late = tNow - tStart
+			if late > self.tolerance:
+				self._stats['overruns'] += 1
+				if late < self.period - self.tolerance:
+					### Shorten this cycle
+					self._stats['compressed'] += 1
+					schdLogger.warning('Polling cycle is %.1f s late, shortening the next cycle', late)
+				else:
+					### Skip to the next boundary
+					nSkipped = int(late // self.period)
+					self._stats['skipped'] += nSkipped
+					tStart = self.getBoundary(tNow)
+					schdLogger.warning('Polling cycle is %.1f s late, skipping %i cycle(s)', late, nSkipped)
+					
+		tStop = tStart + self.period
+		self._tStop = tStop
+		
+		return tStart, tStop
+		
+	def waitUntil(self, tStart, alive=None):
+		"""
+		Sleep until the specified start time, checking the optional
+		threading.Event every second to see if we should stop waiting.
+		Returns the start jitter in seconds.
+		"""
+		
+		sleepUntil(tStart, alive=alive)
+		
+		jitter = max([0.0, time.time() - tStart])
+		self._stats['cycles'] += 1
+		self._stats['lastJitter'] = jitter
+		self._stats['maxJitter'] = max([self._stats['maxJitter'], jitter])
+		self._stats['meanJitter'] += (jitter - self._stats['meanJitter']) / self._stats['cycles']
+		
+		return jitter
+
+
+class TransmitTracker(object):
+	"""
+	Class for learning when each Oregon Scientific sensor transmits so that
+	the radio only has to listen around the expected arrivals rather than
+	for the whole cycle.  Each model transmits on its own fixed period, 
+	i.e., ~14 s for the anemometer and ~39-47 s for the others, so the 
+	period and phase of each sensor/channel can be worked out from the 
+	packet timestamps.
+	
+	plan() returns a list of start/stop times to listen during a cycle or 
+	None if a full scan is needed.  Full scans are used:
+	  * until the period of every sensor has been confirmed,
+	  * when a sensor misses the specified number of expected 
+	    transmissions, and
+	  * every fullScanEvery cycles to pick up any new sensors.
+	Sensors that have not been heard from in forget seconds are dropped.
+	"""
+	
+	def __init__(self, margin=2.0, missing=3, forget=600.0, fullScanEvery=60, maxPeriod=120.0):
+		self.margin = float(margin)
+		self.missing = int(missing)
+		self.forget = float(forget)
+		self.fullScanEvery = int(fullScanEvery)
+		self.maxPeriod = float(maxPeriod)
+		
+		self.sensors = {}
+		self._cycles = 0
+		
+		self._stats = {'fullScans': 0, 'windowed': 0, 'windows': 0, 
+					   'listened': 0.0, 'elapsed': 0.0}
+					
+	def getStats(self):
+		"""
+		Return a dictionary of capture statistics, including the fraction of
+		the time the radio has been listening and the schedule learned for 
+		each sensor.
+		"""
+		
+		stats = self._stats.copy()
+		try:
+			stats['dutyCycle'] = stats['listened'] / stats['elapsed']
+		except ZeroDivisionError:
+			stats['dutyCycle'] = 1.0
+		stats['sensors'] = {}
+		for key,sensor in self.sensors.iteritems():
+			stats['sensors'][key] = sensor.copy()
+		return stats
+		
+	def observe(self, packets):
+		"""
+		Update the transmit schedules using a list of type, payload, 
+		timestamp packets from read433.
+		"""
+		
+		for packet in packets:
+			if len(packet) < 3:
+				continue
+			key = getSensorKey(packet)
+			if key is not None:
+				self._update(key, packet[2])
+				
+	def _update(self, key, t):
+		"""
+		Update the transmit schedule for a single sensor using the time a 
+		packet was received.
+		"""
+		
+		try:
+			sensor = self.sensors[key]
+		except KeyError:
+			self.sensors[key] = {'last': t, 'period': None, 'error': 0.0, 
+								 'locked': False, 'missed': 0}
+			schdLogger.debug('Found new sensor \'%s\'', key)
+			return
+			
+		dt = t - sensor['last']
+		if dt < self.margin:
+			## Repeat of the same transmission
+			return
+			
+		if sensor['period'] is None:
+			if dt <= self.maxPeriod:
+				sensor['period'] = dt
+				
+		else:
+			### Allow for transmissions that we were not listening for
+			n = max([1, int(round(dt / sensor['period']))])
+			period = dt / n
+			error = abs(period - sensor['period'])
+			if error < self.margin:
+				sensor['period'] += (period - sensor['period']) / 4.0
+				sensor['error'] += (error - sensor['error']) / 4.0
+				if not sensor['locked']:
+					schdLogger.debug('Sensor \'%s\' transmits every %.1f s', key, sensor['period'])
+				sensor['locked'] = True
+			else:
+				sensor['period'] = dt if dt <= self.maxPeriod else None
+				sensor['error'] = 0.0
+				sensor['locked'] = False
+				
+		sensor['last'] = t
+		sensor['missed'] = 0
+		
+	def plan(self, tStart, tStop):
+		"""
+		Return a list of start/stop times, on whole seconds, to listen for 
+		between tStart and tStop or None if the whole cycle should be 
+		captured.
+		"""
+		
+		## Check for sensors that have gone missing
+		for key in self.sensors.keys():
+			sensor = self.sensors[key]
+			if sensor['locked']:
+				sensor['missed'] = int((tStart - sensor['last'] - self.margin) // sensor['period'])
+				if sensor['missed'] >= self.missing:
+					sensor['locked'] = False
+					schdLogger.warning('Sensor \'%s\' has missed %i transmissions, falling back to full scans', key, sensor['missed'])
+			if not sensor['locked'] and tStart - sensor['last'] > self.forget:
+				del self.sensors[key]
+				schdLogger.warning('Sensor \'%s\' has not been seen in %.0f s, dropping it', key, self.forget)
+				
+		## Do we need a full scan?
+		self._cycles += 1
+		if len(self.sensors) == 0 \
+		   or not all([sensor['locked'] for sensor in self.sensors.itervalues()]) \
+		   or self._cycles >= self.fullScanEvery:
+			self._cycles = 0
+			self._stats['fullScans'] += 1
+			return None
+			
+		## Windows around the expected transmissions, widening as the 
+		## uncertainty in the period builds up
+		windows = []
+		for sensor in self.sensors.itervalues():
+			k = 1
+			tExpected = sensor['last'] + sensor['period']
+			while tExpected - self.margin < tStop:
+				width = self.margin + k*sensor['error']
+				wStart = max([tStart, math.floor(tExpected - width)])
+				wStop = min([tStop, math.ceil(tExpected + width)])
+				if wStop > wStart:
+					windows.append( [wStart, wStop] )
+				k += 1
+				tExpected += sensor['period']
+				
+		## Merge windows that overlap or are too close to be worth stopping
+		## for
+		windows.sort()
+		merged = []
+		for window in windows:
+			if len(merged) > 0 and window[0] <= merged[-1][1] + 1:
+				merged[-1][1] = max([merged[-1][1], window[1]])
+			else:
+				merged.append( window )
+				
+		self._stats['windowed'] += 1
+		self._stats['windows'] += len(merged)
+		return [tuple(window) for window in merged]
+		
+	def record(self, listened, elapsed):
+		"""
+		Record how long the radio was listening for during a cycle.
+		"""
+		
+		self._stats['listened'] += listened
+		self._stats['elapsed'] += elapsed
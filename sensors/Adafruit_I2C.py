@@ -1,6 +1,9 @@
 #!/usr/bin/python
 
-import smbus
+try:
+  import smbus
+except ImportError:
+  smbus = None
 
 # ===========================================================================
 # Adafruit_I2C Class
@@ -26,15 +29,21 @@ class Adafruit_I2C :
     # Gets the I2C bus number /dev/i2c#
     return 1 if Adafruit_I2C.getPiRevision() > 1 else 0
  
-  def __init__(self, address, busnum=-1, debug=False):
+  def __init__(self, address, busnum=-1, debug=False, bus=None):
     self.address = address
     # By default, the correct I2C bus is auto-detected using /proc/cpuinfo
     # Alternatively, you can hard-code the bus version below:
     # self.bus = smbus.SMBus(0); # Force I2C0 (early 256MB Pi's)
     # self.bus = smbus.SMBus(1); # Force I2C1 (512MB Pi's)
-    self.bus = smbus.SMBus(
-      busnum if busnum >= 0 else Adafruit_I2C.getPiI2CBusNumber())
+    # or pass in an already opened bus, i.e., a fakeSMBus.FakeSMBus
+    if bus is not None:
+      self.bus = bus
+    else:
+      self.bus = smbus.SMBus(
+        busnum if busnum >= 0 else Adafruit_I2C.getPiI2CBusNumber())
     self.debug = debug
+    # Number of bus transactions made so far
+    self.transactions = 0
 
   def reverseByteOrder(self, data):
     "Reverses the byte order of an int (16-bit) or long (32-bit) value"
@@ -53,6 +62,7 @@ class Adafruit_I2C :
   def write8(self, reg, value):
     "Writes an 8-bit value to the specified register/address"
     try:
+      self.transactions += 1
       self.bus.write_byte_data(self.address, reg, value)
       if self.debug:
         print "I2C: Wrote 0x%02X to register 0x%02X" % (value, reg)
@@ -62,6 +72,7 @@ class Adafruit_I2C :
   def write16(self, reg, value):
     "Writes a 16-bit value to the specified register/address pair"
     try:
+      self.transactions += 1
       self.bus.write_word_data(self.address, reg, value)
       if self.debug:
         print ("I2C: Wrote 0x%02X to register pair 0x%02X,0x%02X" %
@@ -75,6 +86,7 @@ class Adafruit_I2C :
       if self.debug:
         print "I2C: Writing list to register 0x%02X:" % reg
         print list
+      self.transactions += 1
       self.bus.write_i2c_block_data(self.address, reg, list)
     except IOError, err:
       return self.errMsg()
@@ -82,6 +94,7 @@ class Adafruit_I2C :
   def readList(self, reg, length):
     "Read a list of bytes from the I2C device"
     try:
+      self.transactions += 1
       results = self.bus.read_i2c_block_data(self.address, reg, length)
       if self.debug:
         print ("I2C: Device 0x%02X returned the following from reg 0x%02X" %
@@ -94,6 +107,7 @@ class Adafruit_I2C :
   def readU8(self, reg):
     "Read an unsigned byte from the I2C device"
     try:
+      self.transactions += 1
       result = self.bus.read_byte_data(self.address, reg)
       if self.debug:
         print ("I2C: Device 0x%02X returned 0x%02X from reg 0x%02X" %
@@ -105,6 +119,7 @@ class Adafruit_I2C :
   def readS8(self, reg):
     "Reads a signed byte from the I2C device"
     try:
+      self.transactions += 1
       result = self.bus.read_byte_data(self.address, reg)
       if result > 127: result -= 256
       if self.debug:
@@ -117,6 +132,7 @@ class Adafruit_I2C :
   def readU16(self, reg):
     "Reads an unsigned 16-bit value from the I2C device"
     try:
+      self.transactions += 1
       result = self.bus.read_word_data(self.address,reg)
       if (self.debug):
         print "I2C: Device 0x%02X returned 0x%04X from reg 0x%02X" % (self.address, result & 0xFFFF, reg)
@@ -127,6 +143,7 @@ class Adafruit_I2C :
   def readS16(self, reg):
     "Reads a signed 16-bit value from the I2C device"
     try:
+      self.transactions += 1
       result = self.bus.read_word_data(self.address,reg)
       if (self.debug):
         print "I2C: Device 0x%02X returned 0x%04X from reg 0x%02X" % (self.address, result & 0xFFFF, reg)
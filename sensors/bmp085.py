@@ -30,7 +30,7 @@ class BMP085(sensor.Sensor):
 						print "To calculate MSLP, please provide an 'altitude' config setting (in m) for the BMP085 pressure module"
 						self.mslp = False
 		if (BMP085.bmpClass==None):
-			BMP085.bmpClass = bmpBackend.BMP085(bus=int(data["i2cbus"]))
+			BMP085.bmpClass = bmpBackend.getBMP085(busnum=int(data["i2cbus"]))
 		return
 
 	def getVal(self):
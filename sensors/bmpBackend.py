@@ -1,6 +1,7 @@
 #!/usr/bin/python
 
 import time
+import threading
 from Adafruit_I2C import Adafruit_I2C
 
 # ===========================================================================
@@ -48,8 +49,10 @@ class BMP085 :
   _cal_MD = 0
 
   # Constructor
-  def __init__(self, address=0x77, mode=1, debug=False):
-    self.i2c = Adafruit_I2C(address)
+  def __init__(self, address=0x77, mode=1, debug=False, busnum=-1, bus=None):
+    self.i2c = Adafruit_I2C(address, busnum=busnum, bus=bus)
+    # Held for each conversion so that handles can be shared between threads
+    self.lock = threading.RLock()
 
     self.address = address
     self.debug = debug
@@ -75,19 +78,42 @@ class BMP085 :
     lo = self.i2c.readU8(register+1)
     return (hi << 8) + lo
 
+  def getTransactionCount(self):
+    "Returns the number of I2C transactions made so far"
+    return self.i2c.transactions
+
+  def reloadCalibration(self):
+    "Re-reads the cached calibration data from the IC"
+    with self.lock:
+      self.readCalibrationData()
+
+  def readBlock(self, register, length):
+    "Reads a block of bytes in a single transaction"
+    data = self.i2c.readList(register, length)
+    if not isinstance(data, list) or len(data) != length:
+      raise IOError("Cannot read %i bytes from register 0x%02X" % (length, register))
+    return data
+
   def readCalibrationData(self):
-    "Reads the calibration data from the IC"
-    self._cal_AC1 = self.readS16(self.__BMP085_CAL_AC1)   # INT16
-    self._cal_AC2 = self.readS16(self.__BMP085_CAL_AC2)   # INT16
-    self._cal_AC3 = self.readS16(self.__BMP085_CAL_AC3)   # INT16
-    self._cal_AC4 = self.readU16(self.__BMP085_CAL_AC4)   # UINT16
-    self._cal_AC5 = self.readU16(self.__BMP085_CAL_AC5)   # UINT16
-    self._cal_AC6 = self.readU16(self.__BMP085_CAL_AC6)   # UINT16
-    self._cal_B1 = self.readS16(self.__BMP085_CAL_B1)     # INT16
-    self._cal_B2 = self.readS16(self.__BMP085_CAL_B2)     # INT16
-    self._cal_MB = self.readS16(self.__BMP085_CAL_MB)     # INT16
-    self._cal_MC = self.readS16(self.__BMP085_CAL_MC)     # INT16
-    self._cal_MD = self.readS16(self.__BMP085_CAL_MD)     # INT16
+    "Reads the calibration data from the IC in a single 22-byte block"
+    data = self.readBlock(self.__BMP085_CAL_AC1, 22)
+    values = []
+    for i in xrange(0, 22, 2):
+      value = (data[i] << 8) + data[i+1]
+      values.append(value)
+    signed = [v - 65536 if v > 32767 else v for v in values]
+
+    self._cal_AC1 = signed[0]   # INT16
+    self._cal_AC2 = signed[1]   # INT16
+    self._cal_AC3 = signed[2]   # INT16
+    self._cal_AC4 = values[3]   # UINT16
+    self._cal_AC5 = values[4]   # UINT16
+    self._cal_AC6 = values[5]   # UINT16
+    self._cal_B1 = signed[6]    # INT16
+    self._cal_B2 = signed[7]    # INT16
+    self._cal_MB = signed[8]    # INT16
+    self._cal_MC = signed[9]    # INT16
+    self._cal_MD = signed[10]   # INT16
     if (self.debug):
       self.showCalibrationData()
 
@@ -107,28 +133,29 @@ class BMP085 :
 
   def readRawTemp(self):
     "Reads the raw (uncompensated) temperature from the sensor"
-    self.i2c.write8(self.__BMP085_CONTROL, self.__BMP085_READTEMPCMD)
-    time.sleep(0.005)  # Wait 5ms
-    raw = self.readU16(self.__BMP085_TEMPDATA)
+    with self.lock:
+      self.i2c.write8(self.__BMP085_CONTROL, self.__BMP085_READTEMPCMD)
+      time.sleep(0.005)  # Wait 5ms
+      msb, lsb = self.readBlock(self.__BMP085_TEMPDATA, 2)
+    raw = (msb << 8) + lsb
     if (self.debug):
       print "DBG: Raw Temp: 0x%04X (%d)" % (raw & 0xFFFF, raw)
     return raw
 
   def readRawPressure(self):
     "Reads the raw (uncompensated) pressure level from the sensor"
-    self.i2c.write8(self.__BMP085_CONTROL, self.__BMP085_READPRESSURECMD + (self.mode << 6))
-    if (self.mode == self.__BMP085_ULTRALOWPOWER):
-      time.sleep(0.005)
-    elif (self.mode == self.__BMP085_HIGHRES):
-      time.sleep(0.014)
-    elif (self.mode == self.__BMP085_ULTRAHIGHRES):
-      time.sleep(0.026)
-    else:
-      time.sleep(0.008)
-    msb = self.i2c.readU8(self.__BMP085_PRESSUREDATA)
-    lsb = self.i2c.readU8(self.__BMP085_PRESSUREDATA+1)
-    xlsb = self.i2c.readU8(self.__BMP085_PRESSUREDATA+2)
-    raw = ((msb << 16) + (lsb << 8) + xlsb) >> (8 - self.mode)
+    with self.lock:
+      self.i2c.write8(self.__BMP085_CONTROL, self.__BMP085_READPRESSURECMD + (self.mode << 6))
+      if (self.mode == self.__BMP085_ULTRALOWPOWER):
+        time.sleep(0.005)
+      elif (self.mode == self.__BMP085_HIGHRES):
+        time.sleep(0.014)
+      elif (self.mode == self.__BMP085_ULTRAHIGHRES):
+        time.sleep(0.026)
+      else:
+        time.sleep(0.008)
+      msb, lsb, xlsb = self.readBlock(self.__BMP085_PRESSUREDATA, 3)
+      raw = ((msb << 16) + (lsb << 8) + xlsb) >> (8 - self.mode)
     if (self.debug):
       print "DBG: Raw Pressure: 0x%04X (%d)" % (raw & 0xFFFF, raw)
     return raw
@@ -151,95 +178,42 @@ class BMP085 :
       print "DBG: Calibrated temperature = %f C" % temp
     return temp
 
-  def readPressure(self):
-    "Gets the compensated pressure in pascal"
-    UT = 0
-    UP = 0
-    B3 = 0
-    B5 = 0
-    B6 = 0
-    X1 = 0
-    X2 = 0
-    X3 = 0
-    p = 0
-    B4 = 0
-    B7 = 0
+  def readTemperatureAndPressure(self):
+    "Gets the compensated temperature in degrees celcius and pressure in pascal from a single temperature conversion"
+    with self.lock:
+      UT = self.readRawTemp()
+      UP = self.readRawPressure()
 
-    UT = self.readRawTemp()
-    UP = self.readRawPressure()
-
-    # You can use the datasheet values to test the conversion results
-    # dsValues = True
-    dsValues = False
-
-    if (dsValues):
-      UT = 27898
-      UP = 23843
-      self._cal_AC6 = 23153
-      self._cal_AC5 = 32757
-      self._cal_MB = -32767
-      self._cal_MC = -8711
-      self._cal_MD = 2868
-      self._cal_B1 = 6190
-      self._cal_B2 = 4
-      self._cal_AC3 = -14383
-      self._cal_AC2 = -72
-      self._cal_AC1 = 408
-      self._cal_AC4 = 32741
-      self.mode = self.__BMP085_ULTRALOWPOWER
-      if (self.debug):
-        self.showCalibrationData()
+      # True Temperature Calculations
+      X1 = ((UT - self._cal_AC6) * self._cal_AC5) >> 15
+      X2 = (self._cal_MC << 11) / (X1 + self._cal_MD)
+      B5 = X1 + X2
+      temp = ((B5 + 8) >> 4) / 10.0
 
-    # True Temperature Calculations
-    X1 = ((UT - self._cal_AC6) * self._cal_AC5) >> 15
-    X2 = (self._cal_MC << 11) / (X1 + self._cal_MD)
-    B5 = X1 + X2
-    if (self.debug):
-      print "DBG: X1 = %d" % (X1)
-      print "DBG: X2 = %d" % (X2)
-      print "DBG: B5 = %d" % (B5)
-      print "DBG: True Temperature = %.2f C" % (((B5 + 8) >> 4) / 10.0)
+      return temp, self.compensatePressure(B5, UP)
 
-    # Pressure Calculations
+  def compensatePressure(self, B5, UP):
+    "Converts a raw pressure reading into pascal using the temperature term B5"
     B6 = B5 - 4000
     X1 = (self._cal_B2 * ((B6 * B6) >> 12)) >> 11
     X2 = (self._cal_AC2 * B6) >> 11
     X3 = X1 + X2
     B3 = (((self._cal_AC1 * 4 + X3) << self.mode) + 2) / 4
-    if (self.debug):
-      print "DBG: B6 = %d" % (B6)
-      print "DBG: X1 = %d" % (X1)
-      print "DBG: X2 = %d" % (X2)
-      print "DBG: X3 = %d" % (X3)
-      print "DBG: B3 = %d" % (B3)
 
     X1 = (self._cal_AC3 * B6) >> 13
     X2 = (self._cal_B1 * ((B6 * B6) >> 12)) >> 16
     X3 = ((X1 + X2) + 2) >> 2
     B4 = (self._cal_AC4 * (X3 + 32768)) >> 15
     B7 = (UP - B3) * (50000 >> self.mode)
-    if (self.debug):
-      print "DBG: X1 = %d" % (X1)
-      print "DBG: X2 = %d" % (X2)
-      print "DBG: X3 = %d" % (X3)
-      print "DBG: B4 = %d" % (B4)
-      print "DBG: B7 = %d" % (B7)
 
     if (B7 < 0x80000000):
       p = (B7 * 2) / B4
     else:
       p = (B7 / B4) * 2
 
-    if (self.debug):
-      print "DBG: X1 = %d" % (X1)
-      
     X1 = (p >> 8) * (p >> 8)
     X1 = (X1 * 3038) >> 16
     X2 = (-7357 * p) >> 16
-    if (self.debug):
-      print "DBG: p  = %d" % (p)
-      print "DBG: X1 = %d" % (X1)
-      print "DBG: X2 = %d" % (X2)
 
     p = p + ((X1 + X2 + 3791) >> 4)
     if (self.debug):
@@ -247,6 +221,11 @@ class BMP085 :
 
     return p
 
+  def readPressure(self):
+    "Gets the compensated pressure in pascal"
+    temp, p = self.readTemperatureAndPressure()
+    return p
+
   def readAltitude(self, seaLevelPressure=101325):
     "Calculates the altitude in meters"
     altitude = 0.0
@@ -265,3 +244,34 @@ class BMP085 :
     mslpressure = pressure / T1
     
     return mslpressure
+
+
+# ===========================================================================
+# Shared device handles
+# ===========================================================================
+
+_handles = {}
+_chipLocks = {}
+_handlesLock = threading.Lock()
+_defaultBusnum = None
+
+def getBMP085(address=0x77, mode=1, busnum=-1, bus=None):
+  "Returns a BMP085 instance for the mode that is opened once and then shared, along with its calibration data"
+  global _defaultBusnum
+  with _handlesLock:
+    # Resolve the default bus once so that the same chip always gets the same handle
+    if bus is None and busnum < 0:
+      if _defaultBusnum is None:
+        _defaultBusnum = Adafruit_I2C.getPiI2CBusNumber()
+      busnum = _defaultBusnum
+    chip = (address, busnum if bus is None else id(bus))
+    key = chip + (mode,)
+    if key not in _handles:
+      # Each mode gets its own handle but they all share the chip's lock so
+      # that conversions in different modes never overlap
+      lock = _chipLocks.setdefault(chip, threading.RLock())
+      with lock:
+        handle = BMP085(address=address, mode=mode, busnum=busnum, bus=bus)
+      handle.lock = lock
+      _handles[key] = handle
+    return _handles[key]
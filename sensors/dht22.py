@@ -1,15 +1,90 @@
 import sensor
 import dhtreader
 import time
+import threading
+
+class DHT22Reader(object):
+	"""
+	Reader for a DHT22 on a single pin that is shared by all of the plugin
+	instances using that pin.  There is at most one physical read per
+	interval: callers that arrive while a read is in progress wait for it
+	and callers that arrive after it get the cached result.  Failed reads
+	are retried until the retry budget, in seconds, is used up and then
+	(None, None) is returned rather than old data.
+	"""
+	def __init__(self, pinNum, interval=2.0, budget=4.0, retryDelay=2.0):
+		self.pinNum = pinNum
+		self.interval = interval
+		self.budget = budget
+		self.retryDelay = retryDelay
+		self.lock = threading.Condition()
+		self.reading = False
+		self.lastData = (None,None)
+		self.lastDataTime = 0
+		self.reads = 0
+		self.failures = 0
+
+	def _readOnce(self):
+		self.reads += 1
+		try:
+			data = dhtreader.read(22,self.pinNum)
+		except Exception:
+			data = None
+		if data is None or None in data:
+			self.failures += 1
+			return None
+		return data
+
+	def read(self):
+		self.lock.acquire()
+		try:
+			# Wait for a read that is already in progress
+			while self.reading:
+				self.lock.wait()
+			if (time.time()-self.lastDataTime)<self.interval:
+				return self.lastData
+			self.reading = True
+		finally:
+			self.lock.release()
+
+		# Read, retrying within the budget
+		tStart = time.time()
+		data = self._readOnce()
+		while data is None and (time.time()-tStart+self.retryDelay)<=self.budget:
+			time.sleep(self.retryDelay)
+			data = self._readOnce()
+		if data is None:
+			data = (None,None)
+
+		self.lock.acquire()
+		self.lastData = data
+		self.lastDataTime = time.time()
+		self.reading = False
+		self.lock.notifyAll()
+		self.lock.release()
+		return data
+
+_readers = {}
+_readersLock = threading.Lock()
+
+def getReader(pinNum):
+	_readersLock.acquire()
+	try:
+		if pinNum not in _readers:
+			if len(_readers) == 0:
+				dhtreader.init()
+			_readers[pinNum] = DHT22Reader(pinNum)
+		return _readers[pinNum]
+	finally:
+		_readersLock.release()
+
 class DHT22(sensor.Sensor):
 	requiredData = ["measurement","pinNumber"]
 	optionalData = ["unit"]
 	def __init__(self,data):
-		dhtreader.init()
-		dhtreader.lastDataTime = 0
-		dhtreader.lastData = (None,None)
 		self.sensorName = "DHT22"
 		self.pinNum = int(data["pinNumber"])
+		self.reader = getReader(self.pinNum)
 		if "temp" in data["measurement"].lower():
 			self.valName = "Temperature"
 			self.valUnit = "Celsius"
@@ -25,20 +100,10 @@ class DHT22(sensor.Sensor):
 		return
 
 	def getVal(self):
-		tm = dhtreader.lastDataTime
-		if (time.time()-tm)<2:
-			t, h = dhtreader.lastData
-		else:
-			tim = time.time()
-			try:
-				t, h = dhtreader.read(22,self.pinNum)
-			except Exception:
-				t, h = dhtreader.lastData
-			dhtreader.lastData = (t,h)
-			dhtreader.lastDataTime=tim
+		t, h = self.reader.read()
 		if self.valName == "Temperature":
 			temp = t
-			if self.valUnit == "Fahrenheit":
+			if self.valUnit == "Fahrenheit" and temp is not None:
 				temp = temp * 1.8 + 32
 			return temp
 		elif self.valName == "Relative_Humidity":
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+
+import time
+
+# ===========================================================================
+# FakeSMBus Class
+# ===========================================================================
+
+class FakeSMBus :
+  """
+  Stand-in for smbus.SMBus that passes reads and writes to simulated
+  devices and keeps track of the number of transactions, the number of
+  bytes moved, and the time the bus would have been busy at the specified
+  clock rate.  If realTime is True each transaction also sleeps for that
+  long.
+  """
+
+  def __init__(self, clock=100000, realTime=False):
+    self.clock = float(clock)
+    self.realTime = realTime
+    self.devices = {}
+    self.reset()
+
+  def reset(self):
+    "Zeros the transaction counters"
+    self.transactions = 0
+    self.bytes = 0
+    self.busTime = 0.0
+
+  def attach(self, address, device):
+    "Attaches a simulated device at the specified address"
+    self.devices[address] = device
+
+  def _account(self, nWrite, nRead):
+    # Start + address + register + data, plus a repeated start and address
+    # for reads, at 9 clocks per byte
+    nBytes = 2 + nWrite + (1 + nRead if nRead else 0)
+    duration = 9*nBytes / self.clock
+    self.transactions += 1
+    self.bytes += nWrite + nRead
+    self.busTime += duration
+    if self.realTime:
+      time.sleep(duration)
+
+  def _device(self, address):
+    try:
+      return self.devices[address]
+    except KeyError:
+      raise IOError(121, "Remote I/O error")
+
+  def write_byte_data(self, address, reg, value):
+    self._account(1, 0)
+    self._device(address).write(reg, [value & 0xFF])
+
+  def write_word_data(self, address, reg, value):
+    self._account(2, 0)
+    self._device(address).write(reg, [value & 0xFF, (value >> 8) & 0xFF])
+
+  def write_i2c_block_data(self, address, reg, data):
+    self._account(len(data), 0)
+    self._device(address).write(reg, list(data))
+
+  def read_byte_data(self, address, reg):
+    self._account(0, 1)
+    return self._device(address).read(reg, 1)[0]
+
+  def read_word_data(self, address, reg):
+    self._account(0, 2)
+    lo, hi = self._device(address).read(reg, 2)
+    return (hi << 8) + lo
+
+  def read_i2c_block_data(self, address, reg, length=32):
+    self._account(0, length)
+    return self._device(address).read(reg, length)
+
+# ===========================================================================
+# FakeBMP085 Class
+# ===========================================================================
+
+class FakeBMP085 :
+  """
+  Simulated BMP085/BMP180 that returns the example calibration and raw
+  values from the datasheet, which compensate to 15.0 C and 69964 Pa.
+  """
+
+  # Datasheet calibration values, AC1 through MD
+  calibration = [408, -72, -14383, 32741, 32757, 23153, 6190, 4, -32768, -8711, 2868]
+
+  def __init__(self, rawTemperature=27898, rawPressure=23843):
+    self.rawTemperature = rawTemperature
+    self.rawPressure = rawPressure
+    self.registers = [0]*256
+    for i,value in enumerate(self.calibration):
+      value &= 0xFFFF
+      self.registers[0xAA+2*i] = value >> 8
+      self.registers[0xAA+2*i+1] = value & 0xFF
+
+  def write(self, reg, data):
+    if reg == 0xF4:
+      command = data[0]
+      if command == 0x2E:
+        # Temperature conversion
+        raw = self.rawTemperature
+        self.registers[0xF6:0xF8] = [raw >> 8, raw & 0xFF]
+      elif command & 0x3F == 0x34:
+        # Pressure conversion - the oversampling setting in bits 6-7 adds
+        # more bits to the result, so UP scales by 2**oss
+        oss = command >> 6
+        raw = (self.rawPressure << oss) << (8 - oss)
+        self.registers[0xF6:0xF9] = [(raw >> 16) & 0xFF, (raw >> 8) & 0xFF, raw & 0xFF]
+    else:
+      for i,value in enumerate(data):
+        self.registers[reg+i] = value
+
+  def read(self, reg, length):
+    return self.registers[reg:reg+length]
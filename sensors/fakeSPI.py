@@ -0,0 +1,106 @@
+#!/usr/bin/python
+
+# ===========================================================================
+# FakeSpiDev Class
+# ===========================================================================
+
+class FakeSpiDev :
+  """
+  Stand-in for spidev.SpiDev with a simulated MCP3008 attached.  The
+  channel values are given as a list of eight 10-bit integers.  The number
+  of transfers and the time the bus would have been busy at max_speed_hz
+  are recorded.
+  """
+
+  def __init__(self, values=None):
+    self.values = values if values is not None else [64*(i+1) for i in range(8)]
+    self.max_speed_hz = 1000000
+    self.reset()
+
+  def reset(self):
+    "Zeros the transfer counters"
+    self.transfers = 0
+    self.busTime = 0.0
+
+  def open(self, bus, device):
+    pass
+
+  def close(self):
+    pass
+
+  def xfer2(self, data):
+    self.transfers += 1
+    self.busTime += 8.0*len(data) / self.max_speed_hz
+
+    # Start bit in the first byte, single-ended + channel in the second
+    if data[0] & 0x01 and data[1] & 0x80:
+      value = self.values[(data[1] >> 4) & 0x07]
+      return [0, (value >> 8) & 0x03, value & 0xFF]
+    return [0]*len(data)
+
+# ===========================================================================
+# FakeGPIO Class
+# ===========================================================================
+
+class FakeGPIO :
+  """
+  Stand-in for RPi.GPIO with a simulated MCP3008 attached to the specified
+  pins, for bit-banged reads.  The number of GPIO calls are recorded.
+  """
+
+  BCM = 11
+  OUT = 0
+  IN = 1
+
+  def __init__(self, values=None, mosi=23, miso=24, clk=18, cs=25):
+    self.values = values if values is not None else [64*(i+1) for i in range(8)]
+    self.mosi, self.miso, self.clk, self.cs = mosi, miso, clk, cs
+    self.pins = {}
+    self.reset()
+
+  def reset(self):
+    "Zeros the call counter"
+    self.calls = 0
+    self._clocks = 0
+    self._command = 0
+    self._out = 0
+
+  def setmode(self, mode):
+    pass
+
+  def setwarnings(self, flag):
+    pass
+
+  def setup(self, pin, direction):
+    self.pins[pin] = 0
+
+  def output(self, pin, value):
+    self.calls += 1
+    value = 1 if value else 0
+    previous = self.pins.get(pin, 0)
+    self.pins[pin] = value
+
+    if pin == self.cs and value:
+      # Deselected - get ready for the next conversion
+      self._clocks = 0
+      self._command = 0
+      self._out = 0
+    elif pin == self.clk and not self.pins.get(self.cs, 1):
+      if value and not previous:
+        # Rising edge - clock in the start bit, single-ended bit, and channel
+        self._clocks += 1
+        if self._clocks <= 5:
+          self._command = (self._command << 1) | self.pins.get(self.mosi, 0)
+      elif previous and not value and self._clocks >= 6:
+        # Falling edge - clock out the null bit and then B9 through B0
+        n = self._clocks - 7
+        if n < 0 or n > 9:
+          self._out = 0
+        else:
+          self._out = (self.values[self._command & 0x07] >> (9 - n)) & 1
+
+  def input(self, pin):
+    self.calls += 1
+    if pin == self.miso:
+      return self._out
+    return self.pins.get(pin, 0)
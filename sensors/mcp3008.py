@@ -1,38 +1,76 @@
 #!/usr/bin/python
 
-import RPi.GPIO as GPIO
+import time
+import threading
+try:
+	import spidev
+except ImportError:
+	spidev = None
+try:
+	import RPi.GPIO as GPIO
+except ImportError:
+	GPIO = None
 import sensor
 
 class MCP3008(sensor.Sensor):
 	requiredData = []
-	optionalData = ["mosiPin","misoPin","csPin","clkPin"]
+	optionalData = ["mosiPin","misoPin","csPin","clkPin","spiBus","spiDevice","spiSpeed","cacheTime"]
 	sharedClass = None
-	def __init__(self, data):
-		GPIO.setmode(GPIO.BCM)
-		GPIO.setwarnings(False)
-		self.SPIMOSI = 23
-		self.SPIMISO = 24
-		self.SPICLK = 18
-		self.SPICS = 25
-		if "mosiPin" in data:
-			self.SPIMOSI = data["mosiPin"]
-		if "misoPin" in data:
-			self.SPIMISO = data["misoPin"]
-		if "clkPin" in data:
-			self.SPICLK = data["clkPin"]
-		if "csPin" in data:
-			self.SPICS = data["csPin"] 
-		GPIO.setup(self.SPIMOSI, GPIO.OUT)
-		GPIO.setup(self.SPIMISO, GPIO.IN)
-		GPIO.setup(self.SPICLK, GPIO.OUT)
-		GPIO.setup(self.SPICS, GPIO.OUT)
+	def __init__(self, data, spi=None, gpio=None):
+		# Results from the last time all eight channels were read
+		self.cacheTime = 1.0
+		if "cacheTime" in data:
+			self.cacheTime = float(data["cacheTime"])
+		self.lock = threading.Lock()
+		self.lastData = [-1]*8
+		self.lastDataTime = 0
+		self.conversions = 0
+
+		# Use the hardware SPI interface if it has been asked for, via spiBus
+		# and/or spiDevice, and it is available.  Otherwise bit-bang the GPIO
+		# pins since the default pins are not the SPI0 pins.
+		self.spi = spi
+		if self.spi is None and spidev is not None \
+		   and ("spiBus" in data or "spiDevice" in data):
+			try:
+				self.spi = spidev.SpiDev()
+				self.spi.open(int(data.get("spiBus", 0)), int(data.get("spiDevice", 0)))
+				self.spi.max_speed_hz = int(data.get("spiSpeed", 1000000))
+			except IOError:
+				self.spi = None
+
+		if self.spi is None:
+			self.gpio = gpio if gpio is not None else GPIO
+			self.gpio.setmode(self.gpio.BCM)
+			self.gpio.setwarnings(False)
+			self.SPIMOSI = 23
+			self.SPIMISO = 24
+			self.SPICLK = 18
+			self.SPICS = 25
+			if "mosiPin" in data:
+				self.SPIMOSI = int(data["mosiPin"])
+			if "misoPin" in data:
+				self.SPIMISO = int(data["misoPin"])
+			if "clkPin" in data:
+				self.SPICLK = int(data["clkPin"])
+			if "csPin" in data:
+				self.SPICS = int(data["csPin"])
+			self.gpio.setup(self.SPIMOSI, self.gpio.OUT)
+			self.gpio.setup(self.SPIMISO, self.gpio.IN)
+			self.gpio.setup(self.SPICLK, self.gpio.OUT)
+			self.gpio.setup(self.SPICS, self.gpio.OUT)
 		if MCP3008.sharedClass == None:
 			MCP3008.sharedClass = self
 
-	#read SPI data from MCP3008 chip, 8 possible adc's (0 thru 7)
-	def readADC(self,adcnum):
-		if ((adcnum > 7) or (adcnum < 0)):
-			return -1
+	#read SPI data from MCP3008 chip using the hardware SPI interface
+	def readADCSPI(self,adcnum):
+		# start bit, single-ended + channel, and one byte to clock out the rest
+		reply = self.spi.xfer2([0x01, (0x08 | adcnum) << 4, 0x00])
+		return ((reply[1] & 0x03) << 8) | reply[2]
+
+	#read SPI data from MCP3008 chip by bit-banging the GPIO pins
+	def readADCBitBang(self,adcnum):
+		GPIO = self.gpio
 		GPIO.output(self.SPICS, True)
 
 		GPIO.output(self.SPICLK, False)  # start clock low
@@ -45,13 +83,13 @@ class MCP3008(sensor.Sensor):
 			if (commandout & 0x80):
 				GPIO.output(self.SPIMOSI, True)
 			else:
-	   			GPIO.output(self.SPIMOSI, False)
-	                commandout <<= 1
-	                GPIO.output(self.SPICLK, True)
-	                GPIO.output(self.SPICLK, False)
+				GPIO.output(self.SPIMOSI, False)
+			commandout <<= 1
+			GPIO.output(self.SPICLK, True)
+			GPIO.output(self.SPICLK, False)
 
 		adcout = 0
-		# read in one empty bit, one null bit and 10 ADC bits
+		# read in one null bit and 10 ADC bits
 		for i in range(11):
 			GPIO.output(self.SPICLK, True)
 			GPIO.output(self.SPICLK, False)
@@ -61,6 +99,29 @@ class MCP3008(sensor.Sensor):
 
 		GPIO.output(self.SPICS, True)
 		return adcout
-	
+
+	#read all 8 channels back-to-back and cache the results
+	def readAll(self):
+		self.lock.acquire()
+		try:
+			if (time.time()-self.lastDataTime) >= self.cacheTime:
+				if self.spi is not None:
+					read = self.readADCSPI
+				else:
+					read = self.readADCBitBang
+				self.lastData = [read(adcnum) for adcnum in range(8)]
+				self.lastDataTime = time.time()
+				self.conversions += 8
+			data = list(self.lastData)
+		finally:
+			self.lock.release()
+		return data
+
+	#read SPI data from MCP3008 chip, 8 possible adc's (0 thru 7)
+	def readADC(self,adcnum):
+		if ((adcnum > 7) or (adcnum < 0)):
+			return -1
+		return self.readAll()[adcnum]
+
 	def getVal(self):
 		return None #not that kind of plugin, this is to be used by other plugins
@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module for sharing the current conditions between the polling thread and
+the web interface without going through the database.
+"""
+
+import os
+import copy
+import json
+import time
+import heapq
+import logging
+
+from parser import SENSOR_FIELDS, DERIVED_FIELDS, getSensorKey
+
+__version__ = "0.3"
+__all__ = ["STATE_FILE", "LiveState", "SensorCheckpoint", "FreshnessTracker", 
+		   "__version__", "__all__"]
+
+
+# Logger instance
+stateLogger = logging.getLogger('__main__')
+
+
+# Files
+## Base path for the various files needed/generated by wxPi.py
+_BASE_PATH = os.path.dirname(os.path.abspath(__file__))
+
+## File for the last packet received from each sensor
+STATE_FILE = os.path.join(_BASE_PATH, 'archive', 'wx-state.json')
+
+
+class LiveState(object):
+	"""
+	Class that holds a versioned snapshot of the current conditions.  The 
+	polling thread is the only writer and it replaces the snapshot as a 
+	whole with publish() so that readers never need to take a lock - they 
+	simply grab whatever snapshot is current and work from a copy of it.
+	"""
+	
+	def __init__(self):
+		self._snapshot = (0, 0, {})
+		self._status = {}
+		
+	def publish(self, timestamp, data):
+		"""
+		Publish a new set of current conditions and return the new version 
+		number.
+		"""
+		
+		version = self._snapshot[0] + 1
+		self._snapshot = (version, timestamp, copy.deepcopy(data))
+		
+		stateLogger.debug('Published version %i of the current conditions', version)
+		
+		return version
+		
+	def getVersion(self):
+		"""
+		Return the version number of the current snapshot.  A version of zero
+		means that nothing has been published yet.
+		"""
+		
+		return self._snapshot[0]
+		
+	def getData(self, fallback=None):
+		"""
+		Return the timestamp and a copy of the current conditions in the same
+		format as Archive.getData().  If nothing has been published yet and
+		an Archive instance is provided via the 'fallback' keyword, the 
+		latest entry in the archive is returned instead.
+		"""
+		
+		version, timestamp, data = self._snapshot
+		if version == 0 and fallback is not None:
+			return fallback.getData()
+			
+		return timestamp, copy.deepcopy(data)
+		
+	def setStatus(self, name, status):
+		"""
+		Publish a dictionary of status information, i.e., queue depths and 
+		latencies, for the named component.
+		"""
+		
+		self._status[name] = copy.deepcopy(status)
+		
+	def getStatus(self):
+		"""
+		Return a dictionary of the status information for all components.
+		"""
+		
+		return copy.deepcopy(self._status)
+
+
+class SensorCheckpoint(object):
+	"""
+	Class for keeping the last packet received from each Oregon Scientific
+	sensor/channel, along with when it was received, in a small state file.
+	On startup the packets from the sensors that are still within the 
+	freshness TTL can be replayed through the parser so that the current
+	conditions are ready to go on the first cycle rather than having to be 
+	built up again from scratch.  To spare the SD card the state file is
+	written at most once every interval seconds.
+	"""
+	
+	def __init__(self, filename=STATE_FILE, ttl=300.0, interval=180.0):
+		self.filename = filename
+		self.ttl = float(ttl)
+		self.interval = float(interval)
+		
+		self._packets = {}
+		self._dirty = False
+		self._tLastSave = 0.0
+		
+		self.restored = []
+		self.missing = []
+		
+	def update(self, packets):
+		"""
+		Update the last packet received from each sensor using a list of 
+		type, payload[, timestamp] packets from read433.
+		"""
+		
+		for packet in packets:
+			key = getSensorKey(packet)
+			if key is None:
+				continue
+				
+			try:
+				tPacket = packet[2]
+			except IndexError:
+				tPacket = time.time()
+			self._packets[key] = [packet[0], packet[1], tPacket]
+			self._dirty = True
+			
+	def getPackets(self):
+		"""
+		Return a list of the last packet received from each sensor, sorted 
+		by time.
+		"""
+		
+		packets = [tuple(packet) for packet in self._packets.itervalues()]
+		packets.sort(key=lambda x: x[2])
+		return packets
+		
+	def getAges(self, tNow=None):
+		"""
+		Return a dictionary of how long ago, in seconds, each sensor was last
+		heard from.
+		"""
+		
+		if tNow is None:
+			tNow = time.time()
+			
+		ages = {}
+		for key,packet in self._packets.iteritems():
+			ages[key] = tNow - packet[2]
+		return ages
+		
+	def load(self, tNow=None):
+		"""
+		Load the state file and return a list of the packets from the sensors
+		that are still fresh, sorted by time.  The names of the sensors that
+		were restored and those that are too old are saved in the 'restored'
+		and 'missing' attributes.
+		"""
+		
+		if tNow is None:
+			tNow = time.time()
+			
+		try:
+			fh = open(self.filename, 'r')
+			saved = json.load(fh)
+			fh.close()
+		except (IOError, ValueError), e:
+			stateLogger.warning('Cannot load the sensor state from \'%s\': %s', self.filename, str(e))
+			saved = {}
+			
+		self._packets = {}
+		self.restored = []
+		self.missing = []
+		for key,packet in saved.iteritems():
+			key = str(key)
+			try:
+				pType, pPayload, tPacket = packet
+				tPacket = float(tPacket)
+			except (TypeError, ValueError):
+				continue
+				
+			if tNow - tPacket <= self.ttl:
+				self._packets[key] = [str(pType), str(pPayload), tPacket]
+				self.restored.append(key)
+			else:
+				self.missing.append(key)
+				
+		if len(self.restored) > 0:
+			stateLogger.info('Restored the state of %i sensor(s): %s', len(self.restored), ', '.join(sorted(self.restored)))
+		if len(self.missing) > 0:
+			stateLogger.warning('State of %i sensor(s) is too old to use: %s', len(self.missing), ', '.join(sorted(self.missing)))
+			
+		return self.getPackets()
+		
+	def save(self, force=False):
+		"""
+		Write the state file if anything has changed since the last time it
+		was saved and it has been at least interval seconds since then, or
+		if 'force' is True.
+		"""
+		
+		if not self._dirty:
+			return True
+		if not force and time.time() - self._tLastSave < self.interval:
+			return True
+			
+		try:
+			fh = open(self.filename+'.tmp', 'w')
+			json.dump(self._packets, fh)
+			fh.flush()
+			os.fsync(fh.fileno())
+			fh.close()
+			os.rename(self.filename+'.tmp', self.filename)
+			self._dirty = False
+			self._tLastSave = time.time()
+			
+		except (IOError, OSError), e:
+			stateLogger.error('Cannot save the sensor state to \'%s\': %s', self.filename, str(e))
+			return False
+			
+		return True
+
+
+class FreshnessTracker(object):
+	"""
+	Class for keeping track of which sensor each value in the current 
+	conditions came from and when that sensor was last heard from so that 
+	the values from a sensor that has stopped reporting, i.e., because of a 
+	dead battery, are not carried forward forever.  Each sensor has a 
+	time-to-live based on its type, i.e., 'thgr968', or its name for the 
+	sensors that are sampled.  The expiration times are kept in a heap so 
+	that checking for stale sensors only needs to look at the top of it.
+	
+	The values in the list-valued fields, i.e., altTemperature, are tracked
+	individually since each one comes from a different channel.
+	"""
+	
+	def __init__(self, ttls={}, defaultTTL=300.0):
+		self.ttls = {}
+		for key,value in ttls.iteritems():
+			self.ttls[key.lower()] = float(value)
+		self.defaultTTL = float(defaultTTL)
+		
+		self._heap = []
+		self._expires = {}
+		self._updated = {}
+		self._fields = {}
+		self._stale = set()
+		
+	def getTTL(self, source):
+		"""
+		Return the time-to-live, in seconds, for the named sensor.
+		"""
+		
+		try:
+			return self.ttls[source.lower()]
+		except KeyError:
+			return self.ttls.get(source.split('-', 1)[0].lower(), self.defaultTTL)
+			
+	def update(self, source, fields, timestamp):
+		"""
+		Record that the named sensor provided the specified fields at the 
+		given time.  Fields are given as either names or (name, index) 
+		tuples for the list-valued fields.
+		"""
+		
+		for field in fields:
+			if not isinstance(field, tuple):
+				field = (field, None)
+			self._fields[field] = source
+			
+		if timestamp <= self._updated.get(source, -1):
+			return
+		self._updated[source] = timestamp
+		
+		expires = timestamp + self.getTTL(source)
+		self._expires[source] = expires
+		heapq.heappush(self._heap, (expires, source))
+		
+		if source in self._stale:
+			self._stale.discard(source)
+			stateLogger.info('Sensor \'%s\' is reporting again', source)
+			
+	def updateFromData(self, source, data, timestamp):
+		"""
+		Record that the named sensor provided all of the values in a 
+		dictionary of current conditions at the given time.
+		"""
+		
+		fields = []
+		for key,value in data.iteritems():
+			if isinstance(value, list):
+				fields.extend( [(key, i) for i in xrange(len(value)) if value[i] is not None] )
+			else:
+				fields.append( key )
+		self.update(source, fields, timestamp)
+		
+	def observe(self, packets):
+		"""
+		Update the sensors using a list of type, payload[, timestamp] packets
+		from read433.
+		"""
+		
+		for packet in packets:
+			key = getSensorKey(packet)
+			if key is None:
+				continue
+				
+			try:
+				tPacket = packet[2]
+			except IndexError:
+				tPacket = time.time()
+				
+			sensorName, channel = key.split('-', 1)
+			if sensorName == 'THGR268':
+				fields = [(name, int(channel)-1) for name in SENSOR_FIELDS[sensorName]]
+			else:
+				fields = [(name, None) for name in SENSOR_FIELDS[sensorName]]
+			self.update(key, fields, tPacket)
+			
+	def expire(self, tNow=None):
+		"""
+		Mark any sensors that have not been heard from within their 
+		time-to-live as stale and return the set of stale sensors.
+		"""
+		
+		if tNow is None:
+			tNow = time.time()
+			
+		while len(self._heap) > 0 and self._heap[0][0] <= tNow:
+			expires, source = heapq.heappop(self._heap)
+			
+			## Skip over entries that have been replaced by a newer update
+			if self._expires.get(source, None) != expires:
+				continue
+				
+			self._stale.add(source)
+			stateLogger.warning('Sensor \'%s\' has not reported in %.0f s, its values are stale', source, tNow - self._updated[source])
+			
+		return set(self._stale)
+		
+	def getStaleFields(self):
+		"""
+		Return a list of the (name, index) fields that are stale, including
+		any derived fields that depend on them.
+		"""
+		
+		stale = [field for field,source in self._fields.iteritems() if source in self._stale]
+		
+		names = [name for name,index in stale]
+		for name,inputs in DERIVED_FIELDS.iteritems():
+			for input in inputs:
+				if input in names:
+					stale.append( (name, None) )
+					break
+					
+		return stale
+		
+	def filter(self, data):
+		"""
+		Given a dictionary of current conditions, return a copy with the 
+		stale values removed and a list of the names of the fields removed.
+		"""
+		
+		output = copy.deepcopy(data)
+		
+		removed = []
+		for name,index in self.getStaleFields():
+			if name not in output:
+				continue
+				
+			if index is None:
+				del output[name]
+				removed.append( name )
+			elif index < len(output[name]) and output[name][index] is not None:
+				output[name][index] = None
+				removed.append( '%s%i' % (name, index+1) )
+				
+		return output, removed
+		
+	def describe(self):
+		"""
+		Return a dictionary with the sensor, last update time, and stale 
+		status of each field.
+		"""
+		
+		output = {}
+		for (name,index),source in self._fields.iteritems():
+			if index is not None:
+				name = '%s%i' % (name, index+1)
+			output[name] = {'sensor': source, 'updated': self._updated.get(source, 0.0), 
+							'stale': source in self._stale}
+		return output
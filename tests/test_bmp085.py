@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+"""
+Unit tests for the BMP085/180 backend that run against the simulated I2C bus
+in sensors/fakeSMBus.py.
+"""
+
+import unittest
+import threading
+
+from sensors.fakeSMBus import FakeSMBus, FakeBMP085
+from sensors.bmpBackend import BMP085, getBMP085
+
+
+class bmp085_tests(unittest.TestCase):
+	"""
+	A unittest.TestCase collection of unit tests for the BMP085/180 backend.
+	"""
+	
+	def setUp(self):
+		self.bus = FakeSMBus()
+		self.bus.attach(0x77, FakeBMP085())
+		
+	def test_calibration(self):
+		"""Test that the calibration data are read in a single block read."""
+		
+		bmp = BMP085(address=0x77, mode=0, bus=self.bus)
+		self.assertEqual(self.bus.transactions, 1)
+		self.assertEqual(self.bus.bytes, 22)
+		self.assertEqual(bmp.getTransactionCount(), 1)
+		
+		## Signed and unsigned values from the datasheet
+		self.assertEqual(bmp._cal_AC1, 408)
+		self.assertEqual(bmp._cal_AC3, -14383)
+		self.assertEqual(bmp._cal_AC4, 32741)
+		self.assertEqual(bmp._cal_MB, -32768)
+		self.assertEqual(bmp._cal_MD, 2868)
+		
+	def test_temperature_pressure(self):
+		"""Test that a temperature and pressure reading takes four transactions."""
+		
+		bmp = BMP085(address=0x77, mode=0, bus=self.bus)
+		self.bus.reset()
+		
+		temp, pressure = bmp.readTemperatureAndPressure()
+		self.assertEqual(self.bus.transactions, 4)
+		self.assertAlmostEqual(temp, 15.0, 6)
+		self.assertEqual(pressure, 69964)
+		
+		self.bus.reset()
+		self.assertEqual(bmp.readPressure(), 69964)
+		self.assertEqual(self.bus.transactions, 4)
+		
+	def test_shared(self):
+		"""Test that shared handles can be read from several threads at once."""
+		
+		bmp = getBMP085(address=0x77, mode=0, bus=self.bus)
+		self.assertTrue(getBMP085(address=0x77, mode=0, bus=self.bus) is bmp)
+		
+		## Other modes get their own handle on the same lock
+		bmp3 = getBMP085(address=0x77, mode=3, bus=self.bus)
+		self.assertTrue(bmp3 is not bmp)
+		self.assertEqual((bmp.mode, bmp3.mode), (0, 3))
+		self.assertTrue(bmp3.lock is bmp.lock)
+		
+		results = []
+		def reader():
+			for i in xrange(25):
+				results.append( bmp.readTemperatureAndPressure() )
+		threads = [threading.Thread(target=reader) for i in xrange(4)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+			
+		self.assertEqual(len(results), 100)
+		for result in results:
+			self.assertEqual(result, (15.0, 69964))
+
+
+class bmp085_test_suite(unittest.TestSuite):
+	"""
+	A unittest.TestSuite class which contains all of the BMP085/180 backend 
+	unit tests.
+	"""
+	
+	def __init__(self):
+		unittest.TestSuite.__init__(self)
+		
+		loader = unittest.TestLoader()
+		self.addTests(loader.loadTestsFromTestCase(bmp085_tests))
+
+
+if __name__ == '__main__':
+	unittest.main()
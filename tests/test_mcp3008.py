@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""
+Unit tests for the MCP3008 plugin that run against the simulated SPI bus and
+GPIO pins in sensors/fakeSPI.py.
+"""
+
+import unittest
+
+from sensors import mcp3008
+from sensors.fakeSPI import FakeSpiDev, FakeGPIO
+from sensors.mcp3008 import MCP3008
+
+
+class mcp3008_tests(unittest.TestCase):
+	"""
+	A unittest.TestCase collection of unit tests for the MCP3008 plugin.
+	"""
+	
+	values = [0, 1, 511, 512, 683, 1000, 1022, 1023]
+	
+	def setUp(self):
+		## Make sure that a real spidev is never picked up
+		self.spidev = mcp3008.spidev
+		mcp3008.spidev = None
+		
+	def tearDown(self):
+		mcp3008.spidev = self.spidev
+		MCP3008.sharedClass = None
+		
+	def test_spi(self):
+		"""Test that the spidev path reads the same values as the bit-banged path."""
+		
+		gpio = FakeGPIO(values=self.values)
+		adc = MCP3008({"cacheTime": 0}, gpio=gpio)
+		self.assertTrue(adc.spi is None)
+		bitBanged = adc.readAll()
+		
+		spi = FakeSpiDev(values=self.values)
+		adc = MCP3008({"cacheTime": 0}, spi=spi)
+		hardware = adc.readAll()
+		
+		self.assertEqual(bitBanged, self.values)
+		self.assertEqual(hardware, bitBanged)
+		for i in xrange(8):
+			self.assertEqual(adc.readADC(i), self.values[i])
+			
+	def test_optin(self):
+		"""Test that hardware SPI is only used when spiBus or spiDevice is set."""
+		
+		class fakeSpidevModule(object):
+			SpiDev = FakeSpiDev
+		mcp3008.spidev = fakeSpidevModule
+		
+		gpio = FakeGPIO(values=self.values)
+		adc = MCP3008({"cacheTime": 0}, gpio=gpio)
+		self.assertTrue(adc.spi is None)
+		self.assertEqual(adc.readAll(), self.values)
+		
+		adc = MCP3008({"cacheTime": 0, "spiBus": "0"})
+		self.assertTrue(isinstance(adc.spi, FakeSpiDev))
+		
+	def test_transfers(self):
+		"""Test that reading all eight channels over spidev takes eight transfers."""
+		
+		spi = FakeSpiDev(values=self.values)
+		adc = MCP3008({"cacheTime": 0}, spi=spi)
+		adc.readAll()
+		self.assertEqual(spi.transfers, 8)
+		self.assertEqual(adc.conversions, 8)
+		
+	def test_cache(self):
+		"""Test that channel reads within the cache time do not touch the bus."""
+		
+		spi = FakeSpiDev(values=self.values)
+		adc = MCP3008({"cacheTime": 60}, spi=spi)
+		adc.readAll()
+		spi.reset()
+		for i in xrange(8):
+			self.assertEqual(adc.readADC(i), self.values[i])
+		self.assertEqual(spi.transfers, 0)
+		self.assertEqual(adc.readADC(8), -1)
+
+
+class mcp3008_test_suite(unittest.TestSuite):
+	"""
+	A unittest.TestSuite class which contains all of the MCP3008 plugin unit
+	tests.
+	"""
+	
+	def __init__(self):
+		unittest.TestSuite.__init__(self)
+		
+		loader = unittest.TestLoader()
+		self.addTests(loader.loadTestsFromTestCase(mcp3008_tests))
+
+
+if __name__ == '__main__':
+	unittest.main()
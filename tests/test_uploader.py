@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+
+"""
+Unit tests for the uploader module that run the publishers against a local
+stand-in HTTP server.
+"""
+
+import os
+import json
+import time
+import socket
+import struct
+import shutil
+import urlparse
+import tempfile
+import unittest
+import threading
+import SocketServer
+import BaseHTTPServer
+
+from uploader import Publisher, HTTPPublisher, WUPublisher, CWOPPublisher, WebhookPublisher
+
+
+class _StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	"""
+	Request handler that records every POST and fails the first 'failures'
+	of them with a 500.  The connection is reset after the first 'resets'
+	successful POSTs to mimic a server dropping an idle keep-alive 
+	connection.  GETs are answered like the WUnderground PWS service and
+	every request waits 'delay' seconds before it is answered.
+	"""
+	
+	protocol_version = 'HTTP/1.1'
+	
+	def do_GET(self):
+		server = self.server
+		time.sleep(server.delay)
+		
+		url = urlparse.urlsplit(self.path)
+		server.clients.append( self.client_address )
+		if server.failures > 0:
+			server.failures -= 1
+			reply = 'INVALIDPASSWORDID|Password or key and/or id are incorrect\n'
+		else:
+			server.received.append( (url.path, dict(urlparse.parse_qsl(url.query))) )
+			reply = 'success\n'
+			
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/html')
+		self.send_header('Content-Length', str(len(reply)))
+		self.end_headers()
+		self.wfile.write(reply)
+		
+	def do_POST(self):
+		body = self.rfile.read(int(self.headers.getheader('content-length', 0)))
+		
+		server = self.server
+		time.sleep(server.delay)
+		server.clients.append( self.client_address )
+		if server.failures > 0:
+			server.failures -= 1
+			code, reply = 500, 'failure'
+		else:
+			server.received.append( json.loads(body) )
+			code, reply = 200, 'success'
+			
+		self.send_response(code)
+		self.send_header('Content-Type', 'text/plain')
+		self.send_header('Content-Length', str(len(reply)))
+		self.end_headers()
+		self.wfile.write(reply)
+		
+		if code == 200 and server.resets > 0:
+			server.resets -= 1
+			self.wfile.flush()
+			self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+			self.close_connection = 1
+			
+	def log_message(self, format, *args):
+		pass
+
+
+class _StandInAPRSHandler(SocketServer.StreamRequestHandler):
+	"""
+	Request handler that mimics an APRS-IS server, answering the login with
+	a 'logresp' of 'status' (or hanging up if it is None) and recording the
+	packet that follows.
+	"""
+	
+	def handle(self):
+		server = self.server
+		self.wfile.write('# aprsc 2.1.4\r\n')
+		login = self.rfile.readline().split()
+		if server.status is None:
+			return
+		self.wfile.write('# logresp %s %s, server T2TEST\r\n' % (login[1], server.status))
+		packet = self.rfile.readline()
+		if packet != '':
+			server.received.append( packet )
+
+
+class uploader_tests(unittest.TestCase):
+	"""
+	A unittest.TestCase collection of unit tests for the uploader module.
+	"""
+	
+	def setUp(self):
+		self.path = tempfile.mkdtemp(prefix='wxPi-')
+		self.backlogName = os.path.join(self.path, 'webhook-backlog.json')
+		
+		self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), _StandInHandler)
+		self.server.failures = 0
+		self.server.resets = 0
+		self.server.delay = 0.0
+		self.server.clients = []
+		self.server.received = []
+		self.thread = threading.Thread(target=self.server.serve_forever)
+		self.thread.setDaemon(1)
+		self.thread.start()
+		
+		self.publishers = []
+		
+	def tearDown(self):
+		for publisher in self.publishers:
+			publisher.cancel()
+		self.server.shutdown()
+		self.server.server_close()
+		shutil.rmtree(self.path)
+		
+	def _getPublisher(self, retryInterval=0.1, timeout=5.0):
+		url = 'http://127.0.0.1:%i/hook' % self.server.server_address[1]
+		publisher = WebhookPublisher(url, timeout=timeout, retryInterval=retryInterval, 
+									 maxRetryInterval=retryInterval, 
+									 backlogName=self.backlogName)
+		self.publishers.append( publisher )
+		return publisher
+		
+	def _getWUPublisher(self, retryInterval=0.1):
+		url = 'http://127.0.0.1:%i/weatherstation/updateweatherstation.php' % self.server.server_address[1]
+		publisher = WUPublisher('KXXTEST1', 'secret', includeIndoor=True, baseURL=url, 
+								timeout=5.0, retryInterval=retryInterval, 
+								maxRetryInterval=retryInterval, 
+								backlogName=self.backlogName)
+		self.publishers.append( publisher )
+		return publisher
+		
+	def _waitFor(self, check, timeout=10.0):
+		tStop = time.time() + timeout
+		while time.time() < tStop:
+			if check():
+				return True
+			time.sleep(0.05)
+		return False
+		
+	def _readBacklog(self):
+		try:
+			fh = open(self.backlogName, 'r')
+		except IOError:
+			return []
+		entries = [json.loads(line)[0] for line in fh]
+		fh.close()
+		return entries
+		
+	def test_abstract(self):
+		"""Test that the publisher base classes cannot be used directly."""
+		
+		self.assertRaises(TypeError, Publisher, 'base')
+		self.assertRaises(TypeError, HTTPPublisher, 'base', 'http://127.0.0.1/')
+		
+	def test_retry(self):
+		"""Test that failed uploads are retried and then replayed in order."""
+		
+		self.server.failures = 2
+		publisher = self._getPublisher()
+		publisher.start()
+		for t in (1, 2, 3):
+			publisher.put(t, {'temperature': 20.0+t})
+			
+		self.assertTrue(self._waitFor(lambda: publisher.getStats()['uploaded'] == 3))
+		self.assertEqual([entry['dateTime'] for entry in self.server.received], [1, 2, 3])
+		self.assertEqual([entry['temperature'] for entry in self.server.received], [21.0, 22.0, 23.0])
+		
+		stats = publisher.getStats()
+		self.assertEqual(stats['failed'], 2)
+		self.assertEqual(stats['uploaded'], 3)
+		self.assertTrue(stats['replayed'] > 0)
+		self.assertEqual(stats['backlog'], 0)
+		self.assertTrue(self._waitFor(lambda: not os.path.exists(self.backlogName)))
+		
+	def test_backlog(self):
+		"""Test that the backlog is saved during an outage and replayed after a restart."""
+		
+		self.server.failures = 1000
+		publisher = self._getPublisher(retryInterval=60.0)
+		publisher.start()
+		publisher.put(1, {'temperature': 21.0})
+		self.assertTrue(self._waitFor(lambda: publisher.getStats()['failed'] == 1))
+		
+		## Observations that arrive while waiting to retry need to be on disk
+		publisher.put(2, {'temperature': 22.0})
+		publisher.put(3, {'temperature': 23.0})
+		self.assertTrue(self._waitFor(lambda: self._readBacklog() == [1, 2, 3]))
+		
+		## Restart once the server has recovered
+		publisher.cancel()
+		self.publishers.remove( publisher )
+		self.server.failures = 0
+		
+		publisher = self._getPublisher()
+		publisher.start()
+		self.assertTrue(self._waitFor(lambda: publisher.getStats()['uploaded'] == 3))
+		self.assertEqual([entry['dateTime'] for entry in self.server.received], [1, 2, 3])
+		self.assertEqual(publisher.getStats()['replayed'], 3)
+		self.assertTrue(self._waitFor(lambda: not os.path.exists(self.backlogName)))
+		
+	def test_keepalive(self):
+		"""Test that uploads share a single keep-alive connection."""
+		
+		publisher = self._getPublisher()
+		publisher.start()
+		for t in xrange(1, 6):
+			publisher.put(t, {'temperature': 20.0+t})
+			self.assertTrue(self._waitFor(lambda: publisher.getStats()['uploaded'] == t))
+			
+		self.assertEqual(len(set(self.server.clients)), 1)
+		self.assertEqual(publisher.getStats()['connections'], 1)
+		
+	def test_wunderground(self):
+		"""Test the WUnderground PWS query parameters."""
+		
+		sensorData = {'temperature': 20.0, 'humidity': 50, 'dewpoint': 9.3, 
+					  'pressure': 1013.25, 'average': 2.0, 'gust': 5.0, 
+					  'direction': 180, 'gustDirection': 200, 
+					  'rainfallHour': 2.54, 'rainfallDay': 25.4, 
+					  'indoorTemperature': 22.0, 'indoorHumidity': 40, 
+					  'altTemperature': [None, 15.0, None, None]}
+					
+		publisher = self._getWUPublisher()
+		publisher.start()
+		publisher.put(1400000000, sensorData)
+		
+		## Nothing interesting to send
+		publisher.put(1400000060, {'humidity': 50})
+		
+		self.assertTrue(self._waitFor(lambda: publisher.getStats()['uploaded'] == 1))
+		time.sleep(0.5)
+		self.assertEqual(len(self.server.received), 1)
+		path, query = self.server.received[0]
+		self.assertEqual(path, '/weatherstation/updateweatherstation.php')
+		self.assertEqual(query, {'ID': 'KXXTEST1', 'PASSWORD': 'secret', 
+								 'softwaretype': 'wxPi', 'action': 'updateraw', 
+								 'dateutc': '2014-05-13 16:53:20', 
+								 'tempf': '68.0', 'humidity': '50', 'dewptf': '48.7', 
+								 'temp2f': '59.0', 'baromin': '29.92', 
+								 'windspeedmph': '4.5', 'windgustmph': '11.2', 
+								 'winddir': '180', 'windgustdir': '200', 
+								 'rainin': '0.1', 'dailyrainin': '1.0', 
+								 'indoortempf': '71.6', 'indoorhumidity': '40'})
+								
+	def test_wunderground_backlog(self):
+		"""Test that rejected WUnderground uploads are kept privately and replayed."""
+		
+		self.server.failures = 1
+		publisher = self._getWUPublisher(retryInterval=60.0)
+		publisher.start()
+		for t in (1400000000, 1400000060):
+			publisher.put(t, {'temperature': 20.0, 'humidity': 50, 'dewpoint': 9.3})
+		self.assertTrue(self._waitFor(lambda: self._readBacklog() == [1400000000, 1400000060]))
+		self.assertEqual(publisher.getStats()['failed'], 1)
+		
+		## The backlog holds the account credentials
+		self.assertEqual(os.stat(self.backlogName).st_mode & 0777, 0600)
+		
+		## Restart and replay
+		publisher.cancel()
+		self.publishers.remove( publisher )
+		
+		publisher = self._getWUPublisher()
+		publisher.start()
+		self.assertTrue(self._waitFor(lambda: publisher.getStats()['uploaded'] == 2))
+		self.assertEqual([query['dateutc'] for path,query in self.server.received], 
+						 ['2014-05-13 16:53:20', '2014-05-13 16:54:20'])
+		self.assertEqual(publisher.getStats()['replayed'], 2)
+		self.assertTrue(self._waitFor(lambda: not os.path.exists(self.backlogName)))
+		
+	def test_timeout(self):
+		"""Test that an upload to a slow server times out and is retried."""
+		
+		self.server.delay = 1.0
+		publisher = self._getPublisher(retryInterval=0.1, timeout=0.25)
+		publisher.start()
+		publisher.put(1, {'temperature': 21.0})
+		self.assertTrue(self._waitFor(lambda: publisher.getStats()['failed'] >= 1))
+		self.assertEqual(publisher.getStats()['uploaded'], 0)
+		self.assertEqual(publisher.getStats()['backlog'], 1)
+		
+		## Recover
+		self.server.delay = 0.0
+		self.assertTrue(self._waitFor(lambda: publisher.getStats()['uploaded'] == 1))
+		self.assertEqual(publisher.getStats()['backlog'], 0)
+		self.assertTrue(publisher.getStats()['lastLatency'] < 1.0)
+		
+	def test_cwop(self):
+		"""Test that CWOP packets are only sent after a successful login."""
+		
+		aprs = SocketServer.TCPServer(('127.0.0.1', 0), _StandInAPRSHandler)
+		aprs.status = 'verified'
+		aprs.received = []
+		thread = threading.Thread(target=aprs.serve_forever)
+		thread.setDaemon(1)
+		thread.start()
+		
+		try:
+			publisher = CWOPPublisher('cw0001', 40.0, -105.5, passcode='12345', 
+									  server='127.0.0.1:%i' % aprs.server_address[1], 
+									  timeout=5.0, backlogName=self.backlogName)
+			payload = publisher._format(1400000000, {'temperature': 20.0, 'humidity': 50, 'dewpoint': 9.3})
+			self.assertEqual(payload, 'CW0001>APRS,TCPIP*:@131653z4000.00N/10530.00W_.../...g...t068r...P...h50wxPi\r\n')
+			
+			self.assertTrue(publisher._send(payload))
+			self.assertTrue(self._waitFor(lambda: aprs.received == [payload]))
+			
+			## A rejected passcode or a server that hangs up is a failure
+			aprs.status = 'unverified'
+			self.assertFalse(publisher._send(payload))
+			aprs.status = None
+			self.assertFalse(publisher._send(payload))
+			self.assertEqual(aprs.received, [payload])
+			
+			## Unless the station does not have a passcode
+			aprs.status = 'unverified'
+			publisher.passcode = '-1'
+			self.assertTrue(publisher._send(payload))
+			self.assertTrue(self._waitFor(lambda: aprs.received == [payload, payload]))
+			
+		finally:
+			aprs.shutdown()
+			aprs.server_close()
+			
+	def test_reset(self):
+		"""Test that a reset keep-alive connection is reopened without a failure."""
+		
+		self.server.resets = 1
+		publisher = self._getPublisher(retryInterval=60.0)
+		publisher.start()
+		for t in (1, 2):
+			publisher.put(t, {'temperature': 20.0+t})
+			self.assertTrue(self._waitFor(lambda: publisher.getStats()['uploaded'] == t))
+			
+		stats = publisher.getStats()
+		self.assertEqual(stats['failed'], 0)
+		self.assertEqual(stats['connections'], 2)
+
+
+class uploader_test_suite(unittest.TestSuite):
+	"""
+	A unittest.TestSuite class which contains all of the uploader module 
+	unit tests.
+	"""
+	
+	def __init__(self):
+		unittest.TestSuite.__init__(self)
+		
+		loader = unittest.TestLoader()
+		self.addTests(loader.loadTestsFromTestCase(uploader_tests))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,899 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module for publishing observations to WUnderground and other services in
+the background.
+"""
+
+import os
+import abc
+import time
+import json
+import Queue
+import socket
+import urllib
+import httplib
+import logging
+import threading
+import traceback
+import urlparse
+from collections import deque
+from datetime import datetime
+
+from utils import pressure_inHg2mb, wuParameters
+
+__version__ = "0.2"
+__all__ = ["WU_BASE_URL", "WU_RT_BASE_URL", "PWSWEATHER_BASE_URL", "CWOP_SERVER", "BACKLOG_PATH",
+		   "Publisher", "HTTPPublisher", "WUPublisher", "RealtimeWUPublisher", "PWSWeatherPublisher",
+		   "CWOPPublisher", "WebhookPublisher", "FilePublisher", "PublisherPool",
+		   "initPublishers", "__version__", "__all__"]
+
+
+# Logger instance
+upldLogger = logging.getLogger('__main__')
+
+
+# Wunderground PWS Base URL
+WU_BASE_URL = "http://weatherstation.wunderground.com/weatherstation/updateweatherstation.php"
+
+# Wunderground RapidFire Base URL
+WU_RT_BASE_URL = "http://rtupdate.wunderground.com/weatherstation/updateweatherstation.php"
+
+# PWSWeather Base URL
+PWSWEATHER_BASE_URL = "http://www.pwsweather.com/pwsupdate/pwsupdate.php"
+
+# CWOP APRS-IS server
+CWOP_SERVER = "cwop.aprs.net:14580"
+
+
+# Files
+## Base path for the various files needed/generated by wxPi.py
+_BASE_PATH = os.path.dirname(os.path.abspath(__file__))
+
+## Directory for the backlogs of observations that have not been published yet
+BACKLOG_PATH = os.path.join(_BASE_PATH, 'archive')
+
+
+class Publisher(object):
+	"""
+	Base class for publishing observations to a single destination from a
+	background thread.  Each publisher has its own:
+	  * rate limit - observations that arrive less than minInterval seconds
+	    after the last one are skipped,
+	  * backoff - failed uploads are retried after retryInterval seconds,
+	    doubling with each failure up to maxRetryInterval seconds,
+	  * backlog - observations that could not be published are kept, up to
+	    maxBacklog of them, on disk and replayed in the order they were
+	    taken, and
+	  * field mapping - fieldMap is a dictionary that maps output names to
+	    the names used in the current conditions.
+	
+	Publisher is an abstract class and cannot be used directly.  Sub-classes
+	need to provide the _send() method and, usually, the _format() method.
+	"""
+	
+	__metaclass__ = abc.ABCMeta
+	
+	def __init__(self, name, fieldMap=None, minInterval=0.0, timeout=10.0, maxBacklog=1440, retryInterval=30.0, maxRetryInterval=900.0, backlogName=None):
+		self.name = name
+		self.fieldMap = fieldMap
+		self.minInterval = float(minInterval)
+		self.timeout = float(timeout)
+		self.maxBacklog = int(maxBacklog)
+		self.retryInterval = float(retryInterval)
+		self.maxRetryInterval = float(maxRetryInterval)
+		if backlogName is None:
+			backlogName = os.path.join(BACKLOG_PATH, '%s-backlog.json' % self.name)
+		self.backlogName = backlogName
+		
+		self.input = Queue.Queue()
+		self._backlog = deque()
+		self._saved = False
+		self._dirty = False
+		self._tLastQueued = 0.0
+		self._callback = None
+		
+		self._stats = {'uploaded': 0, 'failed': 0, 'skipped': 0, 'dropped': 0,
+					   'replayed': 0, 'lastLatency': 0.0, 'meanLatency': 0.0}
+					
+		self.thread = None
+		self.alive = threading.Event()
+		
+	def start(self):
+		if self.thread is not None:
+			self.cancel()
+			
+		self._loadBacklog()
+		
+		self.thread = threading.Thread(target=self.run, name=self.name)
+		self.thread.setDaemon(1)
+		self.alive.set()
+		self.thread.start()
+		
+		upldLogger.info('Started the %s publisher background thread', self.name)
+		
+	def cancel(self):
+		if self.thread is not None:
+			self.alive.clear()          # clear alive event for thread
+			self.thread.join()
+			self.thread = None
+			
+		## Save anything that has not been sent yet
+		self._gather(block=False)
+		self._saveBacklog()
+		self._disconnect()
+		
+		upldLogger.info('Stopped the %s publisher background thread', self.name)
+		
+	def setCallback(self, callback):
+		"""
+		Set a function to be called as callback(name, tData, success) after
+		each upload attempt.
+		"""
+		
+		self._callback = callback
+		
+	def put(self, tData, sensorData):
+		"""
+		Queue the current conditions for publishing.  This never blocks.
+		"""
+		
+		self.input.put( (tData, sensorData) )
+		
+	def getStats(self):
+		"""
+		Return a dictionary of publishing statistics, including the size of
+		the backlog.
+		"""
+		
+		stats = self._stats.copy()
+		stats['backlog'] = len(self._backlog) + self.input.qsize()
+		return stats
+		
+	def _mapFields(self, sensorData):
+		"""
+		Apply the field mapping to the current conditions.
+		"""
+		
+		if self.fieldMap is None:
+			return dict(sensorData)
+			
+		output = {}
+		for name,key in self.fieldMap.iteritems():
+			try:
+				output[name] = sensorData[key]
+			except KeyError:
+				pass
+		return output
+		
+	def _format(self, tData, sensorData):
+		"""
+		Convert the current conditions into whatever needs to be sent.
+		Returns None if there is nothing to send.
+		"""
+		
+		payload = self._mapFields(sensorData)
+		payload['dateTime'] = tData
+		return payload
+		
+	@abc.abstractmethod
+	def _send(self, payload):
+		"""
+		Send a formatted observation and return True if it was accepted.
+		"""
+		
+		return False
+		
+	def _disconnect(self):
+		"""
+		Close any open connections.
+		"""
+		
+		pass
+		
+	def _loadBacklog(self):
+		"""
+		Load any observations left over from the last run.
+		"""
+		
+		self._backlog.clear()
+		try:
+			fh = open(self.backlogName, 'r')
+			for line in fh:
+				try:
+					tData, payload = json.loads(line)
+					self._backlog.append( (tData, payload) )
+				except ValueError:
+					pass
+			fh.close()
+			
+			self._saved = True
+			upldLogger.info('Loaded %i observations from the %s backlog', len(self._backlog), self.name)
+			
+		except IOError:
+			pass
+			
+		while len(self._backlog) > self.maxBacklog:
+			self._backlog.popleft()
+			self._stats['dropped'] += 1
+			self._dirty = True
+			
+	def _saveBacklog(self):
+		"""
+		Write the backlog to disk, removing the file if the backlog is
+		empty.
+		"""
+		
+		if len(self._backlog) == 0:
+			if self._saved:
+				try:
+					os.unlink(self.backlogName)
+				except OSError:
+					pass
+				self._saved = False
+			self._dirty = False
+			return True
+			
+		try:
+			## Owner-only since some payloads, i.e., WUnderground, carry the
+			## account credentials
+			fd = os.open(self.backlogName+'.tmp', os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0600)
+			os.fchmod(fd, 0600)
+			fh = os.fdopen(fd, 'w')
+			for entry in self._backlog:
+				fh.write("%s\n" % json.dumps(entry))
+			fh.flush()
+			os.fsync(fh.fileno())
+			fh.close()
+			os.rename(self.backlogName+'.tmp', self.backlogName)
+			self._saved = True
+			self._dirty = False
+			
+		except (IOError, OSError), e:
+			upldLogger.error('Cannot save the %s backlog: %s', self.name, str(e))
+			return False
+			
+		return True
+		
+	def _addToBacklog(self, entry):
+		"""
+		Add an observation to the end of the backlog, dropping the oldest one
+		if the backlog is full.
+		"""
+		
+		self._backlog.append(entry)
+		self._dirty = True
+		while len(self._backlog) > self.maxBacklog:
+			self._backlog.popleft()
+			self._stats['dropped'] += 1
+			upldLogger.warning('The %s backlog is full, dropped the oldest observation', self.name)
+			
+	def _gather(self, block=True):
+		"""
+		Move new observations from the input queue into the backlog,
+		applying the rate limit and formatting them along the way.
+		"""
+		
+		while True:
+			try:
+				if block:
+					tData, sensorData = self.input.get(timeout=1.0)
+					block = False
+				else:
+					tData, sensorData = self.input.get_nowait()
+			except Queue.Empty:
+				break
+				
+			if tData - self._tLastQueued < self.minInterval:
+				self._stats['skipped'] += 1
+				continue
+				
+			try:
+				payload = self._format(tData, sensorData)
+			except Exception, e:
+				payload = None
+				upldLogger.error('Cannot format observation for %s: %s', self.name, str(e))
+				for line in traceback.format_exc().split('\n'):
+					upldLogger.debug("%s", line)
+					
+			if payload is not None:
+				self._addToBacklog( (tData, payload) )
+				self._tLastQueued = tData
+				
+	def run(self):
+		tRetry = 0.0
+		nFailures = 0
+		while self.alive.isSet():
+			## Gather new observations into the backlog
+			self._gather()
+			
+			## Wait to retry after a failure, keeping anything new that came
+			## in while waiting on disk
+			if len(self._backlog) == 0 or time.time() < tRetry:
+				if self._dirty:
+					self._saveBacklog()
+				continue
+				
+			## Upload in order, oldest first
+			replay = len(self._backlog) > 1
+			while self.alive.isSet() and len(self._backlog) > 0:
+				tData, payload = self._backlog[0]
+				
+				t0 = time.time()
+				try:
+					success = self._send(payload)
+				except Exception, e:
+					success = False
+					self._disconnect()
+					upldLogger.warning('Publishing to %s failed: %s', self.name, str(e))
+					for line in traceback.format_exc().split('\n'):
+						upldLogger.debug("%s", line)
+				t1 = time.time()
+				
+				## Update the statistics
+				latency = t1 - t0
+				nAttempts = self._stats['uploaded'] + self._stats['failed'] + 1
+				self._stats['lastLatency'] = latency
+				self._stats['meanLatency'] += (latency - self._stats['meanLatency']) / nAttempts
+				
+				if self._callback is not None:
+					self._callback(self.name, tData, success)
+					
+				if success:
+					self._backlog.popleft()
+					self._dirty = True
+					self._stats['uploaded'] += 1
+					if replay:
+						self._stats['replayed'] += 1
+					nFailures = 0
+				else:
+					self._stats['failed'] += 1
+					nFailures += 1
+					tRetry = time.time() + min([self.retryInterval*2**(nFailures-1), self.maxRetryInterval])
+					break
+					
+			if replay and len(self._backlog) == 0:
+				upldLogger.info('Finished replaying the %s backlog', self.name)
+				
+			## Keep the on-disk backlog in sync
+			if self._dirty:
+				self._saveBacklog()
+
+
+class HTTPPublisher(Publisher):
+	"""
+	Base class for publishers that talk to a HTTP server.  A single
+	keep-alive connection is kept open between uploads.
+	"""
+	
+	def __init__(self, name, baseURL, **kwds):
+		Publisher.__init__(self, name, **kwds)
+		
+		url = urlparse.urlsplit(baseURL)
+		self.host = url.hostname
+		self.port = url.port
+		self.path = url.path
+		self._connection = None
+		
+		self._stats['connections'] = 0
+		
+	def _connect(self):
+		if self._connection is None:
+			self._connection = httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+			self._stats['connections'] += 1
+		return self._connection
+		
+	def _disconnect(self):
+		if self._connection is not None:
+			try:
+				self._connection.close()
+			except:
+				pass
+			self._connection = None
+			
+	def _request(self, method, url, body=None, headers={}):
+		"""
+		Make a request over the persistent connection and return the HTTP
+		status code and the response body.
+		"""
+		
+		headers = dict(headers)
+		headers['Connection'] = 'keep-alive'
+		
+		## Try the request twice in case the server closed an idle connection,
+		## which can show up as a bad status line or as a reset/broken pipe.
+		## A timeout is not retried here since the server is just slow.
+		for attempt in (1, 2):
+			try:
+				conn = self._connect()
+				conn.request(method, url, body, headers)
+				response = conn.getresponse()
+				status = response.read()
+				if response.getheader('connection', '').lower() == 'close':
+					self._disconnect()
+				break
+				
+			except socket.timeout:
+				self._disconnect()
+				raise
+			except (httplib.BadStatusLine, httplib.CannotSendRequest, socket.error), e:
+				self._disconnect()
+				if attempt == 2:
+					raise
+					
+		return response.status, status
+
+
+class WUPublisher(HTTPPublisher):
+	"""
+	Publisher for the WUnderground PWS service.
+	"""
+	
+	def __init__(self, id, password, archive=None, includeIndoor=False, baseURL=WU_BASE_URL, **kwds):
+		HTTPPublisher.__init__(self, 'wunderground', baseURL, **kwds)
+		self.id = id
+		self.password = password
+		self.archive = archive
+		self.includeIndoor = includeIndoor
+		
+	def _format(self, tData, sensorData):
+		return wuParameters(self.id, self.password, tData, sensorData, archive=self.archive,
+							includeIndoor=self.includeIndoor)
+							
+	def _send(self, payload):
+		url = "%s?%s" % (self.path, urllib.urlencode(payload))
+		upldLogger.debug('WUnderground upload URL: %s', url)
+		
+		code, status = self._request('GET', url)
+		upldLogger.debug('WUnderground PWS update status: %s', status.strip())
+		
+		return (status.find('success') != -1)
+
+
+class RealtimeWUPublisher(object):
+	"""
+	Class for uploading to the WUnderground RapidFire service as packets
+	arrive.  Rather than queuing every packet, the fields that have changed
+	since the last upload are coalesced until the next upload is allowed,
+	which happens at most once every rtfreq seconds.  Uploads are made from
+	a small number of threads, each with its own keep-alive connection, so
+	that at most window uploads are ever in flight.
+	
+	The latency is measured from the time that the oldest packet in an
+	upload was received to the time that WUnderground acknowledged it.
+	"""
+	
+	# Parameters that are sent with every upload
+	_fixed = ('ID', 'PASSWORD', 'softwaretype', 'dateutc', 'action')
+	
+	def __init__(self, id, password, rtfreq=5.0, window=2, timeout=5.0, baseURL=WU_RT_BASE_URL):
+		self.id = id
+		self.password = password
+		self.rtfreq = float(rtfreq)
+		self.window = int(window)
+		self.timeout = float(timeout)
+		
+		url = urlparse.urlsplit(baseURL)
+		self.host = url.hostname
+		self.port = url.port
+		self.path = url.path
+		
+		self._lock = threading.Condition()
+		self._current = {}
+		self._pending = {}
+		self._tOldest = None
+		self._tNext = 0.0
+		self._inFlight = 0
+		
+		self._stats = {'uploaded': 0, 'failed': 0, 'coalesced': 0, 'inFlight': 0, 
+					   'lastLatency': 0.0, 'meanLatency': 0.0, 'maxLatency': 0.0, 
+					   'lastRequest': 0.0}
+					
+		self.threads = []
+		self.alive = threading.Event()
+		
+	def start(self):
+		if len(self.threads) > 0:
+			self.cancel()
+			
+		self.alive.set()
+		for i in xrange(self.window):
+			thread = threading.Thread(target=self.run, name='rapidfire%i' % i)
+			thread.setDaemon(1)
+			thread.start()
+			self.threads.append(thread)
+			
+		upldLogger.info('Started the RealtimeWUPublisher background threads')
+		
+	def cancel(self):
+		self.alive.clear()          # clear alive event for threads
+		self._lock.acquire()
+		self._lock.notifyAll()
+		self._lock.release()
+		for thread in self.threads:
+			thread.join()
+		self.threads = []
+		
+		upldLogger.info('Stopped the RealtimeWUPublisher background threads')
+		
+	def put(self, tPacket, sensorData):
+		"""
+		Queue the fields that have changed in the current conditions since 
+		the last packet, where tPacket is the time the packet was received.
+		This never blocks.
+		"""
+		
+		pwsData = wuParameters(self.id, self.password, tPacket, sensorData)
+		if pwsData is None:
+			return False
+			
+		self._lock.acquire()
+		changed = False
+		for key,value in pwsData.iteritems():
+			if key in self._fixed:
+				continue
+			if self._current.get(key, None) != value:
+				self._current[key] = value
+				self._pending[key] = value
+				changed = True
+				
+		if changed:
+			self._pending['dateutc'] = pwsData['dateutc']
+			if self._tOldest is None:
+				self._tOldest = tPacket
+			else:
+				self._stats['coalesced'] += 1
+			self._lock.notify()
+		self._lock.release()
+		
+		return changed
+		
+	def getStats(self):
+		"""
+		Return a dictionary of upload statistics.
+		"""
+		
+		stats = self._stats.copy()
+		stats['inFlight'] = self._inFlight
+		return stats
+		
+	def _send(self, conn, pwsData):
+		"""
+		Send the changed fields over the provided connection and return True
+		if WUnderground accepted them.
+		"""
+		
+		payload = {'ID': self.id, 'PASSWORD': self.password, 'softwaretype': 'wxPi', 
+				   'action': 'updateraw', 'realtime': 1, 'rtfreq': self.rtfreq}
+		payload.update(pwsData)
+		url = "%s?%s" % (self.path, urllib.urlencode(payload))
+		
+		conn.request('GET', url, None, {'Connection': 'keep-alive'})
+		response = conn.getresponse()
+		status = response.read()
+		upldLogger.debug('WUnderground RapidFire update status: %s', status.strip())
+		
+		return (status.find('success') != -1)
+		
+	def run(self):
+		conn = None
+		while self.alive.isSet():
+			## Wait for something to send and for the rate limit to allow it
+			self._lock.acquire()
+			while self.alive.isSet():
+				if len(self._pending) > 0:
+					tWait = self._tNext - time.time()
+					if tWait <= 0:
+						break
+				else:
+					tWait = 1.0
+				self._lock.wait(tWait)
+			if not self.alive.isSet():
+				self._lock.release()
+				break
+				
+			pwsData, tOldest = self._pending, self._tOldest
+			self._pending, self._tOldest = {}, None
+			self._tNext = time.time() + self.rtfreq
+			self._inFlight += 1
+			self._lock.release()
+			
+			## Send
+			t0 = time.time()
+			try:
+				if conn is None:
+					conn = httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+				success = self._send(conn, pwsData)
+			except Exception, e:
+				success = False
+				upldLogger.warning('WUnderground RapidFire update failed: %s', str(e))
+				try:
+					conn.close()
+				except:
+					pass
+				conn = None
+			t1 = time.time()
+			
+			## Update the statistics and put back anything that has not been 
+			## superseded if the upload failed
+			self._lock.acquire()
+			self._inFlight -= 1
+			self._stats['lastRequest'] = t1 - t0
+			if success:
+				latency = t1 - tOldest
+				self._stats['uploaded'] += 1
+				self._stats['lastLatency'] = latency
+				self._stats['maxLatency'] = max([self._stats['maxLatency'], latency])
+				self._stats['meanLatency'] += (latency - self._stats['meanLatency']) / self._stats['uploaded']
+			else:
+				self._stats['failed'] += 1
+				for key,value in pwsData.iteritems():
+					if key not in self._pending:
+						self._pending[key] = value
+				if self._tOldest is None or tOldest < self._tOldest:
+					self._tOldest = tOldest
+			self._lock.release()
+			
+		if conn is not None:
+			conn.close()
+
+
+class PWSWeatherPublisher(HTTPPublisher):
+	"""
+	Publisher for the PWSWeather service, which accepts the same query
+	parameters as WUnderground.
+	"""
+	
+	def __init__(self, id, password, archive=None, baseURL=PWSWEATHER_BASE_URL, **kwds):
+		HTTPPublisher.__init__(self, 'pwsweather', baseURL, **kwds)
+		self.id = id
+		self.password = password
+		self.archive = archive
+		
+	def _format(self, tData, sensorData):
+		return wuParameters(self.id, self.password, tData, sensorData, archive=self.archive)
+		
+	def _send(self, payload):
+		url = "%s?%s" % (self.path, urllib.urlencode(payload))
+		
+		code, status = self._request('GET', url)
+		upldLogger.debug('PWSWeather update status: %s', status.strip())
+		
+		return (status.lower().find('logged and posted') != -1)
+
+
+class CWOPPublisher(Publisher):
+	"""
+	Publisher for the Citizen Weather Observer Program via APRS-IS.  CWOP
+	does not want old observations so only the most recent one is kept when
+	the server cannot be reached.
+	"""
+	
+	def __init__(self, callsign, latitude, longitude, passcode='-1', server=CWOP_SERVER, archive=None, **kwds):
+		kwds['maxBacklog'] = 1
+		Publisher.__init__(self, 'cwop', **kwds)
+		self.callsign = callsign.upper()
+		self.latitude = float(latitude)
+		self.longitude = float(longitude)
+		self.passcode = passcode
+		self.server = server
+		self.archive = archive
+		
+	def _format(self, tData, sensorData):
+		pwsData = wuParameters('', '', tData, sensorData, archive=self.archive)
+		if pwsData is None:
+			return None
+			
+		def field(code, key, width, scale=1.0):
+			try:
+				value = int(round(float(pwsData[key])*scale))
+				if code == 'h' and value >= 100:
+					value = 0
+				return "%s%0*i" % (code, width, value)
+			except (KeyError, ValueError):
+				return "%s%s" % (code, '.'*width)
+				
+		## Position
+		lat = abs(self.latitude)
+		lat = "%02i%05.2f%s" % (int(lat), (lat - int(lat))*60, 'N' if self.latitude >= 0 else 'S')
+		lng = abs(self.longitude)
+		lng = "%03i%05.2f%s" % (int(lng), (lng - int(lng))*60, 'E' if self.longitude >= 0 else 'W')
+		
+		## Weather report
+		report = "%s/%s" % (field('', 'winddir', 3), field('', 'windspeedmph', 3))
+		report += field('g', 'windgustmph', 3)
+		report += field('t', 'tempf', 3)
+		report += field('r', 'rainin', 3, scale=100)
+		report += field('P', 'dailyrainin', 3, scale=100)
+		report += field('h', 'humidity', 2)
+		if 'baromin' in pwsData:
+			report += "b%05i" % int(round(pressure_inHg2mb(pwsData['baromin'])*10))
+			
+		tStamp = datetime.utcfromtimestamp(tData).strftime("%d%H%M")
+		return "%s>APRS,TCPIP*:@%sz%s/%s_%swxPi\r\n" % (self.callsign, tStamp, lat, lng, report)
+		
+	def _send(self, payload):
+		host, port = self.server.split(':', 1)
+		sock = socket.create_connection((host, int(port)), self.timeout)
+		fh = sock.makefile('rb')
+		try:
+			fh.readline()
+			sock.sendall("user %s pass %s vers wxPi %s\r\n" % (self.callsign, self.passcode, __version__))
+			
+			## Wait for the server to acknowledge the login, skipping over any
+			## other server comments.  Stations without a passcode, i.e., 
+			## CW/DW stations, are always unverified and that is fine.
+			status = None
+			for i in xrange(5):
+				line = fh.readline()
+				if line == '':
+					break
+				fields = line.split()
+				if fields[:2] == ['#', 'logresp'] and len(fields) >= 4:
+					status = fields[3].rstrip(',')
+					break
+			if status is None:
+				upldLogger.warning('CWOP server did not acknowledge the login for %s', self.callsign)
+				return False
+			if status != 'verified' and self.passcode != '-1':
+				upldLogger.warning('CWOP login for %s was %s', self.callsign, status)
+				return False
+				
+			sock.sendall(payload)
+		finally:
+			fh.close()
+			sock.close()
+		upldLogger.debug('CWOP packet: %s', payload.strip())
+		
+		return True
+
+
+class WebhookPublisher(HTTPPublisher):
+	"""
+	Publisher that POSTs the current conditions as JSON to a HTTP endpoint.
+	"""
+	
+	def __init__(self, url, fieldMap=None, **kwds):
+		HTTPPublisher.__init__(self, 'webhook', url, fieldMap=fieldMap, **kwds)
+		
+	def _send(self, payload):
+		code, status = self._request('POST', self.path, json.dumps(payload),
+									 {'Content-Type': 'application/json'})
+		upldLogger.debug('Webhook status: %i', code)
+		
+		return (code >= 200 and code < 300)
+
+
+class FilePublisher(Publisher):
+	"""
+	Publisher that appends the current conditions as JSON to a local file.
+	"""
+	
+	def __init__(self, filename, fieldMap=None, **kwds):
+		Publisher.__init__(self, 'file', fieldMap=fieldMap, **kwds)
+		self.filename = filename
+		
+	def _send(self, payload):
+		fh = open(self.filename, 'a')
+		fh.write("%s\n" % json.dumps(payload))
+		fh.close()
+		
+		return True
+
+
+class PublisherPool(object):
+	"""
+	Class for fanning observations out to a collection of publishers.  Each
+	publisher runs in its own thread so that a slow destination never holds
+	up the others.
+	"""
+	
+	def __init__(self, publishers=[]):
+		self.publishers = list(publishers)
+		
+	def add(self, publisher):
+		self.publishers.append(publisher)
+		
+	def start(self):
+		for publisher in self.publishers:
+			publisher.start()
+			
+	def cancel(self):
+		for publisher in self.publishers:
+			publisher.cancel()
+			
+	def setCallback(self, callback):
+		for publisher in self.publishers:
+			publisher.setCallback(callback)
+			
+	def publish(self, tData, sensorData):
+		"""
+		Queue the current conditions with every publisher.
+		"""
+		
+		for publisher in self.publishers:
+			publisher.put(tData, sensorData)
+			
+	def getStats(self):
+		"""
+		Return a dictionary of publishing statistics for each publisher.
+		"""
+		
+		stats = {}
+		for publisher in self.publishers:
+			stats[publisher.name] = publisher.getStats()
+		return stats
+
+
+def _parseFieldMap(value):
+	"""
+	Convert a comma-separated list of name=key pairs into a field mapping.
+	An empty value means that all fields are passed through.
+	"""
+	
+	value = value.strip()
+	if value == '':
+		return None
+		
+	fieldMap = {}
+	for pair in value.split(','):
+		try:
+			name, key = pair.split('=', 1)
+		except ValueError:
+			name = key = pair
+		fieldMap[name.strip()] = key.strip()
+	return fieldMap
+
+
+def initPublishers(config, archive=None):
+	"""
+	Given a LockingConfigParser configuration instance, create a
+	PublisherPool with all of the enabled publishers.
+	"""
+	
+	pool = PublisherPool()
+	
+	# WUnderground
+	pool.add( WUPublisher(config.get('Account', 'id'), config.get('Account', 'password'),
+						  archive=archive, includeIndoor=config.getbool('Station', 'includeindoor'),
+						  baseURL=config.get('Upload', 'baseurl'),
+						  minInterval=config.getfloat('Upload', 'interval'),
+						  timeout=config.getfloat('Upload', 'timeout'),
+						  maxBacklog=config.getint('Upload', 'backlogsize'),
+						  retryInterval=config.getfloat('Upload', 'retryinterval')) )
+						
+	# PWSWeather
+	if config.getbool('PWSWeather', 'enabled'):
+		pool.add( PWSWeatherPublisher(config.get('PWSWeather', 'id'), config.get('PWSWeather', 'password'),
+									  archive=archive,
+									  minInterval=config.getfloat('PWSWeather', 'interval'),
+									  timeout=config.getfloat('Upload', 'timeout'),
+									  maxBacklog=config.getint('Upload', 'backlogsize'),
+									  retryInterval=config.getfloat('Upload', 'retryinterval')) )
+									
+	# CWOP
+	if config.getbool('CWOP', 'enabled'):
+		pool.add( CWOPPublisher(config.get('CWOP', 'callsign'),
+								config.getfloat('CWOP', 'latitude'), config.getfloat('CWOP', 'longitude'),
+								passcode=config.get('CWOP', 'passcode'), server=config.get('CWOP', 'server'),
+								archive=archive,
+								minInterval=config.getfloat('CWOP', 'interval'),
+								timeout=config.getfloat('Upload', 'timeout'),
+								retryInterval=config.getfloat('Upload', 'retryinterval')) )
+								
+	# Webhook
+	if config.getbool('Webhook', 'enabled'):
+		pool.add( WebhookPublisher(config.get('Webhook', 'url'),
+								   fieldMap=_parseFieldMap(config.get('Webhook', 'fields')),
+								   minInterval=config.getfloat('Webhook', 'interval'),
+								   timeout=config.getfloat('Upload', 'timeout'),
+								   maxBacklog=config.getint('Upload', 'backlogsize'),
+								   retryInterval=config.getfloat('Upload', 'retryinterval')) )
+								
+	# Local file
+	if config.getbool('FileSink', 'enabled'):
+		pool.add( FilePublisher(config.get('FileSink', 'filename'),
+								fieldMap=_parseFieldMap(config.get('FileSink', 'fields')),
+								minInterval=config.getfloat('FileSink', 'interval')) )
+								
+	return pool
@@ -6,7 +6,6 @@ Various utility functions needed by wxPi.py
 
 import math
 import time
-import urllib
 import logging
 from datetime import datetime
 
@@ -18,7 +17,7 @@ __all__ = ["length_m2ft", "length_ft2m", "length_mm2in", "length_in2mm",
 		   "temp_C2F", "temp_F2C", 
 		   "pressure_mb2inHg", "pressure_inHg2mb", 
 		   "computeDewPoint", "computeWindchill", "computeSeaLevelPressure", 
-		   "generateWeatherReport", "wuUploader", "__version__", "__all__"]
+		   "generateWeatherReport", "wuParameters", "__version__", "__all__"]
 
 
 # Setup the logger
@@ -268,14 +267,13 @@ def generateWeatherReport(output, includeIndoor=True):
 	return wxReport
 
 
-def wuUploader(id, password, tData, sensorData, archive=None, includeIndoor=False):
+def wuParameters(id, password, tData, sensorData, archive=None, includeIndoor=False):
 	"""
-	Upload a collection of data to the WUnderground PWD service.
+	Build the dictionary of query parameters needed to upload a collection 
+	of data to the WUnderground PWS service.  Returns None if there is 
+	nothing interesting to send.
 	"""
 	
-	# Wunderground PWS Base URL
-	PWS_BASE_URL = "http://weatherstation.wunderground.com/weatherstation/updateweatherstation.php"
-	
 	# Data dictionary to upload
 	pwsData = {}
 	
@@ -305,7 +303,10 @@ def wuUploader(id, password, tData, sensorData, archive=None, includeIndoor=Fals
 			pass
 			
 	## Add in the barometric pressure
-	pwsData['baromin'] = round(pressure_mb2inHg( sensorData['pressure'] ), 2)
+	try:
+		pwsData['baromin'] = round(pressure_mb2inHg( sensorData['pressure'] ), 2)
+	except KeyError:
+		pass
 	
 	## Add in the wind values
 	try:
@@ -315,6 +316,16 @@ def wuUploader(id, password, tData, sensorData, archive=None, includeIndoor=Fals
 		pwsData['windgustdir'] = sensorData['gustDirection']
 	except KeyError:
 		pass
+	try:
+		pwsData['windgustmph_10m'] = round(speed_ms2mph( sensorData['rollingGust'] ), 1)
+		pwsData['windgustdir_10m'] = sensorData['rollingGustDirection']
+	except KeyError:
+		pass
+	try:
+		pwsData['windspdmph_avg2m'] = round(speed_ms2mph( sensorData['rollingAverage'] ), 1)
+		pwsData['winddir_avg2m'] = sensorData['rollingDirection']
+	except KeyError:
+		pass
 		
 	## Add in the UV index
 	try:
@@ -323,8 +334,13 @@ def wuUploader(id, password, tData, sensorData, archive=None, includeIndoor=Fals
 	except KeyError:
 		pass
 		
-	## Add in the rain values
-	if archive is not None:
+	## Add in the rain values - from the current conditions if they are 
+	## there, otherwise from the archive
+	if 'rainfallHour' in sensorData and 'rainfallDay' in sensorData:
+		pwsData['rainin'] = round(length_mm2in( sensorData['rainfallHour'] ), 2)
+		pwsData['dailyrainin'] = round(length_mm2in( sensorData['rainfallDay'] ), 2)
+		
+	elif archive is not None:
 		### Ouch... there has to be a better way to do this
 		tUTCMidnight = (int(time.time()) / 86400) * 86400
 		localOffset = int(round(float(datetime.utcnow().strftime("%s.%f")) - time.time(), 1))
@@ -360,33 +376,8 @@ def wuUploader(id, password, tData, sensorData, archive=None, includeIndoor=Fals
 		except KeyError:
 			pass
 			
-	# Post to Wunderground for the PWS protocol (if there is something 
-	# interesting to send)
-	status = False
-	if len(pwsData.keys()) > 4:
-		## Convert to a GET-safe string
-		pwsData = urllib.urlencode(pwsData)
-		url = "%s?%s" % (PWS_BASE_URL, pwsData)
-		utilsLogger.info('WUnderground upload URL: %s', url)
-			
-		## Send
-		try:
-			uh = urllib.urlopen(url)
-			status = uh.read()
-			utilsLogger.debug('WUnderground PWS update status: %s', status)
-		except Exception, e:
-			utilsLogger.warning('WUnderground PWS update failed: %s', str(e))
-			status = 'failed'
-			
-		try:
-			uh.close()
-		except:
-			pass
-			
-		## Evaluate
-		if status.find('success') != -1:
-			status = True
-		else:
-			status = False
-		
-	return status
+	# Is there something interesting to send?
+	if len(pwsData.keys()) > 5:
+		return pwsData
+	else:
+		return None
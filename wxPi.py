@@ -10,6 +10,7 @@ This script takes no arguments.
 
 import os
 import sys
+import math
 import time
 import getopt
 import calendar
@@ -27,6 +28,9 @@ except ImportError:
 
 from config import *
 from database import Archive
+from state import LiveState, SensorCheckpoint
+from parser import parsePacketStream
+from backup import BackupProcessor, CompactionProcessor
 from polling import PollingProcessor
 from utils import temp_C2F, pressure_mb2inHg, speed_ms2mph, length_mm2in
 
@@ -166,10 +170,25 @@ def parseOptions(args):
 
 # AJAX interface
 class AJAX(object):
-	def __init__(self, config, db, leds):
+	def __init__(self, config, db, leds, state):
 		self.config = config
 		self.db = db
 		self.leds = leds
+		self.state = state
+		
+		self._yearStart = (None, -99)
+		
+	def _getRainYearStart(self):
+		"""
+		Return the rainfall counter at the start of the year, which is only 
+		looked up in the archive once per year.
+		"""
+		
+		year = datetime.now().year
+		if self._yearStart[0] != year or self._yearStart[1] < 0:
+			jk, entry = self.db.getDataYearStart()
+			self._yearStart = (year, entry.get('rainfall', -99))
+		return self._yearStart[1]
 		
 	def serialize(self, dt):
 		if isinstance(dt, datetime):
@@ -182,22 +201,24 @@ class AJAX(object):
 	@cherrypy.tools.json_out()
 	def summary(self):
 		## Query
-		ts, output = self.db.getData()
+		ts, output = self.state.getData(fallback=self.db)
 		
-		### Ouch... there has to be a better way to do this
-		tUTCMidnight = (int(time.time()) / 86400) * 86400
-		localOffset = int(round(float(datetime.utcnow().strftime("%s.%f")) - time.time(), 1))
-		tLocalMidnight = tUTCMidnight + localOffset
-		if tLocalMidnight > time.time():
-			tLocalMidnight -= 86400
-			
-		### Get the rainfall from an hour ago, from local midnight, and year-to-date
-		jk, entry = self.db.getData(age=3630)
-		rainHour = entry['rainfall']
-		jk, entry  = self.db.getData(age=time.time()-tLocalMidnight+30)
-		rainDay = entry['rainfall']
-		jk, entry = self.db.getDataYearStart()
-		rainYear = entry['rainfall']
+		### Get the rainfall from an hour ago and from local midnight if they
+		### aren't in the current conditions, and year-to-date
+		rainHour, rainDay = -99, -99
+		if 'rainfallHour' not in output or 'rainfallDay' not in output:
+			#### Ouch... there has to be a better way to do this
+			tUTCMidnight = (int(time.time()) / 86400) * 86400
+			localOffset = int(round(float(datetime.utcnow().strftime("%s.%f")) - time.time(), 1))
+			tLocalMidnight = tUTCMidnight + localOffset
+			if tLocalMidnight > time.time():
+				tLocalMidnight -= 86400
+				
+			jk, entry = self.db.getData(age=3630)
+			rainHour = entry['rainfall']
+			jk, entry  = self.db.getData(age=time.time()-tLocalMidnight+30)
+			rainDay = entry['rainfall']
+		rainYear = self._getRainYearStart()
 		
 		## Cleanup
 		for key in ('temperature', 'windchill', 'dewpoint', 'indoorTemperature', 'indoorDewpoint'):
@@ -205,18 +226,22 @@ class AJAX(object):
 				output[key] = temp_C2F( output[key] )
 			except KeyError:
 				pass
-		for key in ('average', 'gust'):
+		for key in ('average', 'gust', 'rollingAverage', 'rollingGust'):
 			try:
 				output[key] = speed_ms2mph( output[key] )
 			except KeyError:
 				pass
-		for key in ('rainrate', 'rainfall'):
+		for key in ('rainrate', 'rainfall', 'rainfall15min', 'rainfallHour', 'rainfall24hr', 'rainfallDay', 'rainrateInstant'):
 			try:
 				output[key] = length_mm2in( output[key] )
 			except KeyError:
 				pass
-		output['pressure'] = pressure_mb2inHg( output['pressure'] )
-		
+		for key in ('pressure', 'pressureTendency1hr', 'pressureTendency3hr'):
+			try:
+				output[key] = pressure_mb2inHg( output[key] )
+			except KeyError:
+				pass
+				
 		## Computed rain quantities
 		if rainHour >= 0:
 			try:
@@ -242,23 +267,119 @@ class AJAX(object):
 				
 		## Timestamp
 		output['timestamp'] = datetime.fromtimestamp(ts).strftime('%Y/%m/%d %H:%M:%S')
+		
+		## Done
+		return output
+	
+	@cherrypy.expose
+	@cherrypy.tools.json_out()
+	def status(self):
+		## Query
+		output = self.state.getStatus()
+		output['archive'] = self.db.getWriteStats()
+		
+		## Done
+		return output
+		
+	@cherrypy.expose
+	@cherrypy.tools.json_out()
+	def storage(self):
+		## Query - this is separate from status since it has to look at every
+		## page in the database
+		output = self.db.getStorageStats()
+		
+		## Done
+		return output
+		
+	@cherrypy.expose
+	@cherrypy.tools.json_out()
+	def history(self, fields='temperature', days=1, points=500):
+		## Validate
+		try:
+			days, points = float(days), int(points)
+			if math.isnan(days) or math.isinf(days):
+				raise ValueError
+		except ValueError:
+			raise cherrypy.HTTPError(400, 'Invalid number of days or points: %s, %s' % (days, points))
 			
+		## Query
+		fields = [field for field in fields.split(',') if field != '']
+		tStop = time.time()
+		tStart = tStop - days*86400
+		try:
+			output = self.db.getHistory(tStart, tStop, fields=fields, nPoints=min([points, 5000]))
+		except KeyError, e:
+			raise cherrypy.HTTPError(400, 'Unknown field: %s' % str(e))
+		
+		## Cleanup
+		for field in fields:
+			if field in ('temperature', 'windchill', 'dewpoint', 'indoorTemperature', 'indoorDewpoint'):
+				convert = temp_C2F
+			elif field in ('average', 'gust'):
+				convert = speed_ms2mph
+			elif field in ('rainrate', 'rainfall'):
+				convert = length_mm2in
+			elif field == 'pressure':
+				convert = pressure_mb2inHg
+			else:
+				continue
+			
+			for stat in ('mean', 'min', 'max'):
+				output[field][stat] = [convert(v) if v is not None else None for v in output[field][stat]]
+		
+		## Timestamps in milliseconds
+		output['timestamp'] = [t*1000 for t in output['timestamp']]
+		
+		## Done
+		return output
+		
+	@cherrypy.expose
+	@cherrypy.tools.json_out()
+	def records(self, period='day'):
+		## Query
+		if period not in ('day', 'month', 'year', 'all'):
+			raise cherrypy.HTTPError(400, 'Unknown period: %s' % period)
+		output = self.db.getRecords(period)
+		
+		## Cleanup
+		for field in output.keys():
+			if field in ('temperature', 'windchill', 'dewpoint', 'indoorTemperature', 'indoorDewpoint') \
+			   or field[:7] in ('outTemp', 'outDewp'):
+				convert = temp_C2F
+			elif field in ('average', 'gust'):
+				convert = speed_ms2mph
+			elif field in ('rainrate', 'rainfall'):
+				convert = length_mm2in
+			elif field == 'pressure':
+				convert = pressure_mb2inHg
+			else:
+				continue
+				
+			for stat in ('min', 'max'):
+				output[field][stat] = convert(output[field][stat])
+				
+		## Timestamps in milliseconds
+		for field in output.keys():
+			for stat in ('minTime', 'maxTime'):
+				output[field][stat] *= 1000
+				
 		## Done
 		return output
 
 
 # Main web interface
 class Interface(object):
-	def __init__(self, config, db, leds):
+	def __init__(self, config, db, leds, state):
 		self.config = config
 		self.db = db
 		self.leds = leds
+		self.state = state
 		
-		self.query = AJAX(config, db, leds)
+		self.query = AJAX(config, db, leds, state)
 		
 	@cherrypy.expose
 	def index(self):
-		ts, kwds = self.db.getData()
+		ts, kwds = self.state.getData(fallback=self.db)
 		kwds['tNow'] = datetime.now()
 		kwds['tzOffset'] = int(datetime.now().strftime("%s")) - int(datetime.utcnow().strftime("%s"))
 		
@@ -267,7 +388,7 @@ class Interface(object):
 		
 	@cherrypy.expose
 	def indoor(self):
-		ts, kwds = self.db.getData()
+		ts, kwds = self.state.getData(fallback=self.db)
 		kwds['tNow'] = datetime.now()
 		kwds['tzOffset'] = int(datetime.now().strftime("%s")) - int(datetime.utcnow().strftime("%s"))
 		
@@ -324,31 +445,44 @@ def main(args):
 	config = loadConfig(cmdConfig['configFile'])
 	
 	# Get the latest from the database
-	db = Archive()
+	db = Archive(storage=config.get('Archive', 'storage'), 
+				 keyframeInterval=config.getint('Archive', 'keyframeinterval'))
 	db.start()
 	
-	tData, sensorData = db.getData()
-	if time.time() - tData > 2*config.getfloat('Station', 'duration'):
-		sensorData = {}
-		
+	# Restore the sensors that are still fresh from the last run.  If there
+	# aren't any, fall back on the archive if it is recent enough.
+	checkpoint = SensorCheckpoint(ttl=config.getfloat('Station', 'statettl'), 
+								  interval=config.getfloat('Station', 'stateinterval'))
+	packets = checkpoint.load()
+	if len(packets) > 0:
+		tData = packets[-1][2]
+		sensorData = parsePacketStream(packets, elevation=config.getfloat('Station', 'elevation'))
+	else:
+		tData, sensorData = db.getData()
+		if time.time() - tData > 2*config.getfloat('Station', 'duration'):
+			sensorData = {}
+			
+	# Share the current conditions with the web interface
+	state = LiveState()
+	if len(sensorData.keys()) > 0:
+		state.publish(tData, sensorData)
+	state.setStatus('checkpoint', {'restored': checkpoint.restored, 'missing': checkpoint.missing})
+	
 	# Initialize the LEDs
 	leds = initLEDs(config)
 	
-	# Make sure the database has provided something useful.  If not, we need to
-	# run several iterations to build up the current picture of what is going on.
-	if len(sensorData.keys()) == 0:
-		buildState = True
-		loopsForState = 3
-	else:
-		buildState = False
-		loopsForState = 1
-		
 	# Start the sensor polling
-	bg = PollingProcessor(config, db, leds, buildState=buildState, loopsForState=loopsForState, sensorData=sensorData)
+	bg = PollingProcessor(config, db, leds, state, sensorData=sensorData, checkpoint=checkpoint)
 	bg.start()
 	
+	# Start the background backups and compaction
+	bk = BackupProcessor(config, db)
+	bk.start()
+	cp = CompactionProcessor(config, db)
+	cp.start()
+	
 	# Initialize the web interface
-	ws = Interface(config, db, leds)
+	ws = Interface(config, db, leds, state)
 	#cherrypy.quickstart(ws, config=cpConfig)
 	cherrypy.tree.mount(ws, "/", config=cpConfig)
 	cherrypy.engine.start()
@@ -357,8 +491,10 @@ def main(args):
 	# Shutdown process
 	logger.info('Shutting down wxPi, please wait...')
 	
-	# Stop the polling thread
+	# Stop the polling, backup, and compaction threads
 	bg.cancel()
+	bk.cancel()
+	cp.cancel()
 	
 	# Make sure the LEDs are off
 	for color in leds.keys():